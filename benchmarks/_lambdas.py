@@ -0,0 +1,28 @@
+"""Load the lambda scripts (whose file names are not importable) for local benchmarking."""
+import importlib.util
+import os
+import sys
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+LAMBDA_DIR = REPO_DIR / "lambda codes -cvp2"
+TEMPLATE_PATH = REPO_DIR / "html templates" / "template.html"
+SAMPLE_JSON_PATH = REPO_DIR / "Samples" / "Reported Adverse Reaction .json samples" / "reported_adverse_reaction_sample_1.json"
+
+# boto3 clients need a region to be built, even when never called
+os.environ.setdefault("AWS_DEFAULT_REGION", "ca-central-1")
+
+if str(LAMBDA_DIR) not in sys.path:
+    sys.path.insert(0, str(LAMBDA_DIR))
+
+
+def load_lambda(name):
+    """Import 'lambda codes -cvp2/<name>.py' as a module, e.g. load_lambda('lambda-3')."""
+    module_name = name.replace('-', '_')
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(module_name, LAMBDA_DIR / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
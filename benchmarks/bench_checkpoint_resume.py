@@ -0,0 +1,221 @@
+"""
+Check that lambda-1 to lambda-3 resume a killed run from its checkpoints with identical output.
+
+Generates a synthetic extract and runs the pipeline twice on separate local storage roots:
+once uninterrupted, and once with every lambda killed mid-stage (os._exit in a child process,
+so nothing is cleaned up) and then retried with the same run id:
+
+- lambda-1 (with priority alerts on) is killed while joining reports, after the matched report
+  ids were checkpointed, then killed again after the join was restored from its checkpoint
+- lambda-2 is killed while rendering the HTML, then retried with the email Lambda invoke
+  failing (the run must fail instead of reporting success), then retried once more
+- lambda-3 (native renderer) is killed after rendering part of its checkpointed segments
+
+The JSON, HTML and merged PDF of both runs must be byte-identical, each retry must write to
+the output key of its first attempt, and no checkpoints may be left once a run completes.
+Every priority report alerted by the uninterrupted run must also be alerted by the resumed one,
+although the alerts of lambda-1's killed attempts are dropped (as if still queued when killed).
+Reports the time of each uninterrupted and resumed lambda run.
+
+Usage: python benchmarks/bench_checkpoint_resume.py --reports 20000
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from types import SimpleNamespace
+
+from _lambdas import TEMPLATE_PATH, load_lambda
+from bench_pipeline import OUTPUT_BUCKET, configure_environment, load_extract
+from local_s3 import LocalLambdaClient, LocalS3Client, LocalSesClient, LocalSnsClient
+from synthetic_extract import generate_extract
+
+RUN_ID = 'resume-check'
+KILLED = 17  # Exit code of a child killed mid-stage
+OUTPUT_PREFIXES = {'lambda-1': 'report_output/', 'lambda-2': 'input-html/', 'lambda-3': 'output-pdf/'}
+
+
+def kill_on_call(module, name, call=1):
+    """Replace module.name so that its call-th call kills the process without any cleanup."""
+    original = getattr(module, name)
+    calls = []
+
+    def killing(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == call:
+            os._exit(KILLED)
+        return original(*args, **kwargs)
+
+    setattr(module, name, killing)
+
+
+class FileSesClient(LocalSesClient):
+    """Appends the subject of every email to a file, so that alerts sent by killed children are kept."""
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def send_email(self, Source, Destination, Message):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(Message['Subject']['Data'] + '\n')
+        return super().send_email(Source, Destination, Message)
+
+
+class FailingLambdaClient(LocalLambdaClient):
+    def invoke(self, **kwargs):
+        raise Exception("Simulated invoke failure")
+
+
+def run_step(work_dir, name, fault, segment_size):
+    """Run one lambda in this (child) process, with an optional fault injected."""
+    configure_environment(work_dir, 'local')
+    os.environ['CHECKPOINTS'] = 'true'  # Checkpoints are opt-in
+    os.environ['PRIORITY_ALERTS'] = 'true'
+    os.environ['PDF_CHECKPOINT_SEGMENT_SIZE'] = str(segment_size)
+    if name != 'lambda-1':
+        os.environ['INPUT_BUCKET'] = OUTPUT_BUCKET  # Earlier lambdas wrote their output to the output bucket
+    logging.getLogger().setLevel(logging.WARNING)
+    module = load_lambda(name)
+    context = SimpleNamespace(aws_request_id=f"{RUN_ID}-attempt")
+
+    if name == 'lambda-1':
+        module.sns_client = LocalSnsClient()
+        # Alerts of a killed attempt are treated as still queued when it died: they are lost with the process
+        module.ses_client = FileSesClient(os.path.join(work_dir, 'alerts.txt')) if fault is None else LocalSesClient()
+        if fault == 'kill':
+            kill_on_call(module, 'assign_report_clusters')
+        elif fault == 'kill-after-join':
+            kill_on_call(module, 'generate_json_output')
+        module.lambda_handler({'run_id': RUN_ID}, context)
+    elif name == 'lambda-2':
+        # lambda-2 reads template.html from next to itself
+        shutil.copyfile(TEMPLATE_PATH, os.path.join(work_dir, 'template.html'))
+        module.__file__ = os.path.join(work_dir, 'lambda-2.py')
+        module.lambda_client = FailingLambdaClient() if fault == 'invoke' else LocalLambdaClient()
+        if fault == 'kill':
+            kill_on_call(module, 'generate_input_html')
+        try:
+            module.lambda_handler({'run_id': RUN_ID}, context)
+        except module.ChainingError:
+            os._exit(2)
+    else:
+        if fault == 'kill':
+            kill_on_call(module, 'render_and_upload', call=3)
+        response = module.lambda_handler({'renderer': 'native', 'run_id': RUN_ID}, context)
+        if response['statusCode'] != 200:
+            raise SystemExit(f"lambda-3 failed: {response['body']}")
+
+
+def run_child(work_dir, name, fault, segment_size):
+    """Run a step in a child process and return its exit code and wall time."""
+    start = time.perf_counter()
+    process = multiprocessing.Process(target=run_step, args=(work_dir, name, fault, segment_size))
+    process.start()
+    process.join()
+    return process.exitcode, time.perf_counter() - start
+
+
+def list_keys(s3, prefix):
+    return sorted(item['Key'] for item in s3.list_objects_v2(Bucket=OUTPUT_BUCKET, Prefix=prefix).get('Contents', []))
+
+
+def single_output(s3, name):
+    keys = [key for key in list_keys(s3, OUTPUT_PREFIXES[name]) if '/chunks/' not in key]
+    if len(keys) != 1:
+        raise SystemExit(f"{name} wrote {len(keys)} outputs: {keys}")
+    return keys[0], s3.get_object(Bucket=OUTPUT_BUCKET, Key=keys[0])['Body'].read()
+
+
+def checkpointed_timestamp(s3, name):
+    body = s3.get_object(Bucket=OUTPUT_BUCKET, Key=f"checkpoints/{name}/{RUN_ID}/run.json")['Body'].read()
+    return json.loads(body)['timestamp']
+
+
+def alerted_reports(work_dir):
+    """Report numbers of the priority alerts sent in work_dir, each once."""
+    path = os.path.join(work_dir, 'alerts.txt')
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding='utf-8') as f:
+        return {line.split(' - ', 1)[1].split(' ')[0] for line in f if line.startswith('Priority')}
+
+
+def expect(code, expected, what):
+    if code != expected:
+        raise SystemExit(f"{what}: exit code {code}, expected {expected}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reports', type=int, default=20000)
+    parser.add_argument('--watchlist-ranks', default='0,3,10,40,150')
+    parser.add_argument('--segment-size', type=int, default=50, help="lambda-3 reports per checkpointed segment")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        extract_dir = os.path.join(root, 'extract')
+        _, drugs = generate_extract(extract_dir, args.reports, args.seed)
+        watchlist = [drugs[int(rank)] for rank in args.watchlist_ranks.split(',') if int(rank) < len(drugs)]
+
+        runs = {}
+        for run in ('uninterrupted', 'resumed'):
+            work_dir = os.path.join(root, run)
+            runs[run] = LocalS3Client(os.path.join(work_dir, 's3'))
+            load_extract(runs[run], extract_dir, watchlist)
+
+        results = []
+        for name in OUTPUT_PREFIXES:
+            code, reference_seconds = run_child(os.path.join(root, 'uninterrupted'), name, None, args.segment_size)
+            expect(code, 0, f"{name} uninterrupted")
+
+            resumed_dir, s3 = os.path.join(root, 'resumed'), runs['resumed']
+            code, killed_seconds = run_child(resumed_dir, name, 'kill', args.segment_size)
+            expect(code, KILLED, f"{name} killed")
+            timestamp = checkpointed_timestamp(s3, name)
+            left_behind = list_keys(s3, f"checkpoints/{name}/")
+            if name == 'lambda-1':
+                code, _ = run_child(resumed_dir, name, 'kill-after-join', args.segment_size)
+                expect(code, KILLED, "lambda-1 killed after restoring the join")
+            elif name == 'lambda-2':
+                code, _ = run_child(resumed_dir, name, 'invoke', args.segment_size)
+                expect(code, 2, "lambda-2 with a failing email invoke")
+            code, resumed_seconds = run_child(resumed_dir, name, None, args.segment_size)
+            expect(code, 0, f"{name} resumed")
+
+            reference_key, reference = single_output(runs['uninterrupted'], name)
+            resumed_key, resumed = single_output(s3, name)
+            if resumed != reference:
+                raise SystemExit(f"{name}: resumed output differs from the uninterrupted run")
+            if timestamp not in resumed_key:
+                raise SystemExit(f"{name}: resumed run wrote {resumed_key}, not its first attempt's key")
+            alerted = alerted_reports(os.path.join(root, 'uninterrupted'))
+            if name == 'lambda-1' and (not alerted or alerted_reports(resumed_dir) != alerted):
+                raise SystemExit("lambda-1: the resumed run did not alert the same priority reports")
+            if list_keys(s3, 'checkpoints/') or list_keys(runs['uninterrupted'], 'checkpoints/'):
+                raise SystemExit(f"{name}: checkpoints left after the run completed")
+
+            result = {
+                'lambda': name,
+                'output_bytes': len(resumed),
+                'checkpoints_at_kill': [key.rsplit('/', 1)[-1] for key in left_behind],
+                'uninterrupted_seconds': round(reference_seconds, 3),
+                'killed_attempt_seconds': round(killed_seconds, 3),
+                'resumed_seconds': round(resumed_seconds, 3),
+                'identical': True
+            }
+            results.append(result)
+            print(json.dumps(result))
+
+    with open(args.output, 'w') as f:
+        json.dump({'benchmark': 'checkpoint_resume', 'reports': args.reports, 'results': results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Measure each lambda's cold-start init duration: module import in a fresh interpreter.
+
+Every sample runs in its own Python process, so imports and clients are never warm. For
+each lambda it reports the median time to import the module, the time until its S3 client
+is usable (import plus any lazy client construction), and which heavy modules the import
+pulled in. --baseline compares against an earlier results file (e.g. from the previous commit).
+
+Usage: python benchmarks/bench_cold_start.py --samples 7 --output bench_output.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+LAMBDAS = ['lambda-1', 'lambda-2', 'lambda-3', 'lambda-4', 'zip-lambda-cvp-2']
+HEAVY_MODULES = ['boto3', 'botocore', 'pdfkit', 'PyPDF2', 'requests', 'pandas']
+
+
+def child(name):
+    """Import one lambda and print its timings; runs in a fresh process."""
+    start = time.perf_counter()
+    from _lambdas import load_lambda
+    module = load_lambda(name)
+    init_seconds = time.perf_counter() - start
+    modules = [module_name for module_name in HEAVY_MODULES if module_name in sys.modules]
+
+    s3_client = getattr(module, 's3_client', None)
+    if s3_client is not None:
+        s3_client.meta  # Builds a lazily created client
+    ready_seconds = time.perf_counter() - start
+    print(json.dumps({'init_ms': init_seconds * 1000, 'ready_ms': ready_seconds * 1000,
+                      'modules': modules}))
+
+
+def sample(name):
+    env = dict(os.environ, STORAGE_BACKEND='s3', METRICS_FORMAT='off')
+    result = subprocess.run([sys.executable, __file__, '--child', name], capture_output=True, text=True,
+                            check=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--samples', type=int, default=7)
+    parser.add_argument('--lambdas', default=','.join(LAMBDAS))
+    parser.add_argument('--baseline', help="Earlier results file to compare init times against")
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return
+
+    results = {'benchmark': 'cold_start', 'samples': args.samples, 'lambdas': {}}
+    for name in args.lambdas.split(','):
+        samples = [sample(name) for _ in range(args.samples)]
+        results['lambdas'][name] = {
+            'init_ms': round(statistics.median(s['init_ms'] for s in samples), 1),
+            'ready_ms': round(statistics.median(s['ready_ms'] for s in samples), 1),
+            'modules_at_init': samples[0]['modules']
+        }
+        print(json.dumps({'lambda': name, **results['lambdas'][name]}))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['lambdas']
+        results['comparison'] = {
+            name: {'init_ms': row['init_ms'], 'baseline_init_ms': baseline[name]['init_ms'],
+                   'speedup': round(baseline[name]['init_ms'] / row['init_ms'], 2)}
+            for name, row in results['lambdas'].items() if name in baseline
+        }
+        for name, row in results['comparison'].items():
+            print(json.dumps({'lambda': name, **row}))
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Benchmark the versioned extract history: storage growth and as-of query time over monthly extracts.
+
+Generates a synthetic extract and derives --months monthly extracts from it. Each month adds new
+reports (appended, as the real extract does), changes the outcome and a reaction of some existing
+reports and withdraws a few. Every month is recorded with extract_history.record_extract, as
+zip-lambda does, and the history's size is compared with keeping a full copy of every extract.
+
+Then, for every version, the tables are materialized as of that version and checked against the
+month's own files (in full, and for a sample of reports read through the index), and lambda-1
+is run twice: on the month's extract as the current one, and as of the month's date through the
+history (reactions and indications materialized for the matched reports only). Both runs must
+write byte-identical report JSON.
+
+Usage: python benchmarks/bench_extract_history.py --reports 20000 --months 12
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from datetime import date
+
+from _lambdas import load_lambda
+from bench_pipeline import INPUT_BUCKET, OUTPUT_BUCKET, configure_environment, load_extract
+from local_s3 import LocalS3Client, LocalSnsClient
+from synthetic_extract import TABLES, generate_extract
+
+HISTORY_PREFIX = 'Input_data/extract_history/'
+ID_COLUMNS = {'reports.txt': 0, 'reactions.txt': 1, 'report_links.txt': 1, 'report_drug.txt': 1,
+              'report_drug_indication.txt': 1}
+OUTCOME_COLUMN = 17  # In reports.txt
+DURATION_COLUMN = 2  # In reactions.txt
+OUTCOMES = ['Recovered/resolved', 'Recovering/resolving', 'Not recovered/not resolved', 'Fatal', 'Unknown']
+
+
+def read_tables(extract_dir):
+    """{table: {report_id: [lines]}}, keeping the file order of reports."""
+    tables = {}
+    for table in TABLES:
+        rows = tables[table] = {}
+        with open(os.path.join(extract_dir, table), encoding='utf-8') as f:
+            for line in f.read().splitlines():
+                rows.setdefault(line.split('$')[ID_COLUMNS[table]].strip('"'), []).append(line)
+    return tables
+
+
+def set_field(line, column, value):
+    fields = line.split('$')
+    fields[column] = f'"{value}"'
+    return '$'.join(fields)
+
+
+def next_month(state, pool, month, args, rng):
+    """Apply one month of additions, changes and withdrawals to state in place; returns the counts."""
+    current = list(state['reports.txt'])
+    added = [pool.pop(0) for _ in range(min(len(pool), int(args.reports * args.added_share)))]
+    changed = rng.sample(current, int(len(current) * args.changed_share))
+    removed = set(rng.sample([report_id for report_id in current if report_id not in changed],
+                             int(len(current) * args.removed_share)))
+
+    for table, rows in state.items():
+        for report_id in removed:
+            rows.pop(report_id, None)
+        for report_id, lines in added:
+            if table in lines:
+                rows[report_id] = lines[table]
+    for report_id in changed:
+        reports = state['reports.txt'][report_id]
+        reports[0] = set_field(reports[0], OUTCOME_COLUMN, rng.choice(OUTCOMES))
+        reactions = state['reactions.txt'].get(report_id)
+        if reactions:
+            reactions[0] = set_field(reactions[0], DURATION_COLUMN, month)
+    return {'added': len(added), 'changed': len(changed), 'removed': len(removed)}
+
+
+def write_tables(state, extract_dir):
+    os.makedirs(extract_dir, exist_ok=True)
+    for table, rows in state.items():
+        with open(os.path.join(extract_dir, table), 'w', encoding='utf-8') as f:
+            f.writelines(f"{line}\n" for lines in rows.values() for line in lines)
+
+
+def prefix_bytes(s3, prefix, bucket=INPUT_BUCKET):
+    return sum(item['Size'] for item in s3.list_objects_v2(Bucket=bucket, Prefix=prefix).get('Contents', []))
+
+
+def single_output(s3, prefix):
+    keys = [item['Key'] for item in s3.list_objects_v2(Bucket=OUTPUT_BUCKET, Prefix=prefix).get('Contents', [])]
+    if len(keys) != 1:
+        raise SystemExit(f"Expected one output under {prefix}, found {keys}")
+    return s3.get_object(Bucket=OUTPUT_BUCKET, Key=keys[0])['Body'].read()
+
+
+def stage_seconds(summary, *names):
+    return sum(stage['seconds'] for stage in summary['stages'] if stage['stage'] in names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reports', type=int, default=20000, help="Reports in the first extract")
+    parser.add_argument('--months', type=int, default=12)
+    parser.add_argument('--added-share', type=float, default=0.02, help="New reports per month, of --reports")
+    parser.add_argument('--changed-share', type=float, default=0.01)
+    parser.add_argument('--removed-share', type=float, default=0.002)
+    parser.add_argument('--watchlist-ranks', default='0,3,10,40,150')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as work_dir:
+        configure_environment(work_dir, 'local')
+        s3 = LocalS3Client(os.path.join(work_dir, 's3'))
+        lambda_1 = load_lambda('lambda-1')
+        lambda_1.sns_client = LocalSnsClient()
+        from extract_history import ExtractSnapshot, record_extract
+
+        # The extra reports of the generated extract are added month by month
+        total_reports = args.reports + int(args.reports * args.added_share) * args.months
+        source_dir = os.path.join(work_dir, 'source')
+        _, drugs = generate_extract(source_dir, total_reports, args.seed)
+        watchlist = [drugs[int(rank)] for rank in args.watchlist_ranks.split(',') if int(rank) < len(drugs)]
+        source = read_tables(source_dir)
+        report_ids = list(source['reports.txt'])
+        state = {table: {report_id: source[table][report_id] for report_id in report_ids[:args.reports]
+                         if report_id in source[table]} for table in TABLES}
+        pool = [(report_id, {table: source[table][report_id] for table in TABLES if report_id in source[table]})
+                for report_id in report_ids[args.reports:]]
+        logging.getLogger().setLevel(logging.WARNING)  # lambda-1 logs every report at INFO
+
+        months, full_copy_bytes = [], 0
+        for month in range(args.months + 1):
+            changes = next_month(state, pool, month, args, rng) if month else {'added': args.reports}
+            extract_dir = os.path.join(work_dir, f"month_{month:02d}")
+            write_tables(state, extract_dir)
+            extract_date = date(2024 + month // 12, month % 12 + 1, 1).isoformat()
+
+            start = time.perf_counter()
+            record_extract(lambda_1.storage, INPUT_BUCKET,
+                           {table[:-len('.txt')]: os.path.join(extract_dir, table) for table in TABLES},
+                           extract_date, prefix=HISTORY_PREFIX, work_dir=work_dir)
+            record_seconds = time.perf_counter() - start
+
+            extract_bytes = sum(os.path.getsize(os.path.join(extract_dir, table)) for table in TABLES)
+            full_copy_bytes += extract_bytes
+            history_bytes = prefix_bytes(s3, HISTORY_PREFIX)
+            months.append({'extract_dir': extract_dir, 'extract_date': extract_date, 'changes': changes,
+                           'extract_bytes': extract_bytes, 'history_bytes': history_bytes,
+                           'full_copies_bytes': full_copy_bytes, 'record_seconds': round(record_seconds, 3)})
+
+        results = []
+        for version, month in enumerate(months, start=1):
+            # Materialize every table as of this version and check it against the month's files
+            start = time.perf_counter()
+            snapshot = ExtractSnapshot(lambda_1.storage, INPUT_BUCKET, month['extract_date'], prefix=HISTORY_PREFIX)
+            tables = {table: list(snapshot.read_table(table[:-len('.txt')])) for table in TABLES}
+            materialize_seconds = time.perf_counter() - start
+            for table, lines in tables.items():
+                with open(os.path.join(month['extract_dir'], table), encoding='utf-8') as f:
+                    if lines != f.read().splitlines():
+                        raise SystemExit(f"{table} as of version {version} differs from the month's extract")
+            # A few reports (including ones not yet added or already withdrawn) through the report index
+            sample = set(rng.sample(report_ids, 40))
+            for table, lines in tables.items():
+                expected = [line for line in lines if line.split('$')[ID_COLUMNS[table]].strip('"') in sample]
+                if snapshot.read_rows(table[:-len('.txt')], sample) != expected:
+                    raise SystemExit(f"Indexed read of {table} as of version {version} differs from the extract")
+            if snapshot.version != version:
+                raise SystemExit(f"{month['extract_date']} resolved to version {snapshot.version}, not {version}")
+
+            # lambda-1 on the month's extract as the current one...
+            load_extract(s3, month['extract_dir'], watchlist)
+            for item in s3.list_objects_v2(Bucket=OUTPUT_BUCKET, Prefix='report_output/').get('Contents', []):
+                s3.delete_object(Bucket=OUTPUT_BUCKET, Key=item['Key'])
+            live = lambda_1.main(f"live-{version}")
+            live_output = single_output(s3, 'report_output/')
+            # ...and as of the month's date through the history
+            lambda_1.fuzzy_indexes.clear()
+            as_of = lambda_1.main(f"as-of-{version}", month['extract_date'])
+            as_of_output = single_output(s3, f"as_of_output/{month['extract_date']}/report_output/")
+            if as_of_output != live_output:
+                raise SystemExit(f"lambda-1 as of {month['extract_date']} differs from the run on that extract")
+
+            result = {
+                'version': version,
+                'extract_date': month['extract_date'],
+                **month['changes'],
+                'extract_mb': round(month['extract_bytes'] / 1e6, 2),
+                'history_mb': round(month['history_bytes'] / 1e6, 2),
+                'full_copies_mb': round(month['full_copies_bytes'] / 1e6, 2),
+                'history_to_full_copies': round(month['history_bytes'] / month['full_copies_bytes'], 3),
+                'record_seconds': month['record_seconds'],
+                'materialize_all_seconds': round(materialize_seconds, 3),
+                'live_read_seconds': round(stage_seconds(live, 'read_inputs'), 3),
+                'as_of_read_seconds': round(stage_seconds(as_of, 'open_snapshot', 'read_inputs'), 3),
+                'live_lambda1_seconds': live['seconds'],
+                'as_of_lambda1_seconds': as_of['seconds'],
+                'identical_output': True
+            }
+            results.append(result)
+            print(json.dumps(result))
+
+    with open(args.output, 'w') as f:
+        json.dump({'benchmark': 'extract_history', 'reports': args.reports, 'results': results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Benchmark lambda-1's trigram-indexed fuzzy drug name matching.
+
+Builds a synthetic report_drug.txt (as bench_lambda1_multi_tenant.py does) for each --rows
+size, with a fixed number of distinct drug names. A share of the rows of the watchlisted
+names is rewritten as a misspelling (swapped, dropped or doubled letter, or a space or
+hyphen inside the name), and half of the watchlist names carry a salt suffix ("... hcl")
+that the rows never have. Reports recall of the exact and the fuzzy match against every
+report of the watchlisted drugs, reports matched beyond those, the cost of building,
+loading and reusing the per-extract index, and the lookup time, which should stay flat as
+the row count grows.
+
+Usage: python benchmarks/bench_fuzzy_drug_match.py --rows 200000,1000000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from _lambdas import load_lambda
+from bench_lambda1_multi_tenant import make_report_drug_lines
+
+INPUT_BUCKET = 'cvp-input'
+OUTPUT_BUCKET = 'cvp-output'
+REPORT_DRUG_KEY = 'Input_data/report_id_database/report_drug.txt'
+
+
+def misspell(rng, name):
+    i = rng.randrange(1, len(name) - 2)
+    kind = rng.choice(['swap', 'drop', 'double', 'space', 'hyphen'])
+    if kind == 'swap':
+        return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+    if kind == 'drop':
+        return name[:i] + name[i + 1:]
+    if kind == 'double':
+        return name[:i] + name[i] + name[i:]
+    return name[:i] + (' ' if kind == 'space' else '-') + name[i:]
+
+
+def make_extract(rows, distinct_names, targets, misspelled_share, seed):
+    """report_drug lines with misspelled target rows, the target names and each target's report ids."""
+    lines, names = make_report_drug_lines(rows, distinct_names, seed)
+    rng = random.Random(seed)
+    target_names = rng.sample([name for name in names if len(name) >= 8], targets)
+    expected = {name: set() for name in target_names}
+    for index, line in enumerate(lines):
+        fields = line.split('$')
+        name = fields[3].strip('"')
+        if name in expected:
+            expected[name].add(fields[1])
+            if rng.random() < misspelled_share:
+                fields[3] = f'"{misspell(rng, name)}"'
+                lines[index] = '$'.join(fields)
+    return lines, expected
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', default='200000,1000000')
+    parser.add_argument('--distinct-names', type=int, default=20000)
+    parser.add_argument('--targets', type=int, default=20)
+    parser.add_argument('--misspelled-share', type=float, default=0.1)
+    parser.add_argument('--min-recall', type=float, default=0.95)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.environ.update({'STORAGE_BACKEND': 'local', 'STORAGE_ROOT': work_dir, 'INPUT_BUCKET': INPUT_BUCKET,
+                           'OUTPUT_BUCKET': OUTPUT_BUCKET, 'REPORT_DRUG_FILE_PATH': REPORT_DRUG_KEY,
+                           'METRICS_FORMAT': 'off'})
+        lambda_1 = load_lambda('lambda-1')
+
+        for rows in [int(size) for size in args.rows.split(',')]:
+            lines, expected = make_extract(rows, args.distinct_names, args.targets, args.misspelled_share, args.seed)
+            lambda_1.storage.write(INPUT_BUCKET, REPORT_DRUG_KEY, '\n'.join(lines))
+            watchlist = [name.lower() + (' hcl' if index % 2 else '') for index, name in enumerate(expected)]
+            expected_ids = set().union(*expected.values())
+
+            lambda_1.fuzzy_match_enabled = False
+            (exact, _), exact_seconds = timed(lambda_1.find_report_ids_by_tenant, {'bench': watchlist}, lines)
+            exact_ids = set(exact['bench'])
+
+            lambda_1.fuzzy_match_enabled = True
+            lambda_1.fuzzy_indexes.clear()
+            for obj in lambda_1.storage.list(OUTPUT_BUCKET, lambda_1.fuzzy_index_prefix):
+                lambda_1.storage.delete(OUTPUT_BUCKET, obj['Key'])
+            (fuzzy, _), build_seconds = timed(lambda_1.find_report_ids_by_tenant, {'bench': watchlist}, lines)
+            fuzzy_ids = set(fuzzy['bench'])
+            _, warm_seconds = timed(lambda_1.find_report_ids_by_tenant, {'bench': watchlist}, lines)
+            lambda_1.fuzzy_indexes.clear()
+            index, load_seconds = timed(lambda_1.load_fuzzy_index, lines)
+            _, lookup_seconds = timed(lambda names: [index.lookup(name) for name in names], watchlist)
+
+            result = {
+                'rows': rows,
+                'distinct_names': len(index.names),
+                'watchlist': len(watchlist),
+                'target_reports': len(expected_ids),
+                'exact_recall': round(len(exact_ids & expected_ids) / len(expected_ids), 4),
+                'fuzzy_recall': round(len(fuzzy_ids & expected_ids) / len(expected_ids), 4),
+                'fuzzy_extra_reports': len(fuzzy_ids - expected_ids - exact_ids),
+                'exact_seconds': round(exact_seconds, 3),
+                'fuzzy_cold_seconds': round(build_seconds, 3),
+                'fuzzy_warm_seconds': round(warm_seconds, 3),
+                'index_load_seconds': round(load_seconds, 3),
+                'lookup_ms': round(lookup_seconds * 1000, 2)
+            }
+            results.append(result)
+            print(json.dumps(result))
+
+    with open(args.output, 'w') as f:
+        json.dump({'benchmark': 'fuzzy_drug_match', 'results': results}, f, indent=4)
+
+    low = [result['rows'] for result in results if result['fuzzy_recall'] < args.min_recall]
+    if low:
+        raise SystemExit(f"Fuzzy recall is below {args.min_recall} for {low} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Check and time the vectorized per-drug aggregates against a loop over lambda-1's report_data.
+
+Builds synthetic extract tables, computes the aggregates with aggregates.build_drug_aggregates
+and with a plain loop over extract_report_data's dict-of-dicts, fails if the two disagree,
+and records the time of each.
+
+Usage: python benchmarks/bench_lambda1_aggregates.py --reports 100000
+"""
+import argparse
+import json
+import random
+import time
+from collections import Counter, defaultdict
+
+from _lambdas import load_lambda
+
+DRUGS = ['PANZYGA', 'ASPIRIN', 'TYLENOL', 'ADVIL', 'HUMIRA']
+WATCHLIST = ['panzyga', 'aspirin', 'humira']
+PTS = [f'Preferred term {i}' for i in range(300)]
+MONTHS = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+
+
+def quoted(value):
+    return f'"{value}"'
+
+
+def make_tables(report_count, seed=11):
+    rng = random.Random(seed)
+    ids = [str(i) for i in range(1, report_count + 1)]
+    reports = []
+    for rid in ids:
+        fields = [rid] + [quoted(f'v{column}') for column in range(1, 40)]
+        fields[3] = quoted(f'{rng.randint(1, 28):02d}-{rng.choice(MONTHS)}-{rng.choice(["21", "22", "23"])}')
+        fields[10] = quoted(rng.choice(['Male', 'Female', 'Unknown', '']))
+        fields[12] = quoted(rng.choice([str(rng.randint(0, 99)), '']))
+        fields[14] = quoted(rng.choice(['Years', 'Years', 'Months', 'Days', '']))
+        fields[17] = quoted(rng.choice(['Recovered/resolved', 'Not recovered/not resolved', 'Fatal', 'Unknown']))
+        fields[26] = quoted(rng.choice(['Serious', 'Not Serious']))
+        fields[37] = quoted(rng.choice(['Community', 'Clinical Study']))
+        reports.append('$'.join(fields))
+    reactions = ['$'.join([quoted(i), rng.choice(ids)] + [quoted(f'r{i}_{column}') for column in range(2, 5)]
+                          + [quoted(rng.choice(PTS))] + [quoted(f'r{i}_{column}') for column in range(6, 12)])
+                 for i in range(report_count * 3)]
+    drugs = ['$'.join([quoted(i), rng.choice(ids), quoted('1'), quoted(rng.choice(DRUGS))]
+                      + [quoted(f'd{i}_{column}') for column in range(4, 22)]) for i in range(report_count * 2)]
+    return reports, reactions, drugs
+
+
+def loop_aggregates(aggregates, report_ids, report_data):
+    """The dict-of-dicts approach: walk every matched report and count in Python."""
+    matcher = aggregates.DrugNameMatcher({'watchlist': WATCHLIST})
+    counts = defaultdict(lambda: defaultdict(Counter))
+    for report_id, rows in report_ids.items():
+        names = set()
+        for fields in rows:
+            value = fields[3].strip('"').replace('\\"', '').strip().lower()
+            names.update(name for _, name in matcher.match(value))
+        data = report_data[report_id]
+        band = age_band(aggregates, data['age'], data['age_unit_eng'])
+        month = data['datreceived'][:7] if data['datreceived'][4:5] == '-' else aggregates.UNKNOWN
+        for name in names:
+            counts[name]['report_count'][''] += 1
+            for key in ('seriousness_eng', 'outcome_eng', 'gender_eng'):
+                counts[name][key][data[key] or aggregates.UNKNOWN] += 1
+            counts[name]['age_band'][band] += 1
+            counts[name]['reports_per_month'][month] += 1
+            for pt in set(data.get('pt_name_eng', '').split(', ')) - {''}:
+                counts[name]['pt'][pt] += 1
+    return counts
+
+
+def age_band(aggregates, age, unit):
+    try:
+        years = float(age) * aggregates.AGE_UNIT_YEARS[unit.lower()]
+    except (ValueError, KeyError):
+        return aggregates.UNKNOWN
+    for low, high, label in zip(aggregates.AGE_BAND_EDGES, aggregates.AGE_BAND_EDGES[1:], aggregates.AGE_BAND_LABELS):
+        if low <= years < high:
+            return label
+    return aggregates.UNKNOWN
+
+
+def compare(summary, counts, top_pts):
+    if set(summary) != set(counts):
+        return False
+    for drug, tables in summary.items():
+        if tables['report_count'] != counts[drug]['report_count']['']:
+            return False
+        for dimension in ('seriousness_eng', 'outcome_eng', 'gender_eng', 'age_band', 'reports_per_month'):
+            if tables[dimension] != dict(counts[drug][dimension]):
+                return False
+        expected = sorted(counts[drug]['pt'].items(), key=lambda item: (-item[1], item[0]))[:top_pts]
+        if [(pt['pt_name_eng'], pt['count']) for pt in tables['top_pt_name_eng']] != expected:
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reports', type=int, default=100000)
+    parser.add_argument('--top-pts', type=int, default=20)
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    lambda_1 = load_lambda('lambda-1')
+    aggregates = __import__('aggregates')
+    reports, reactions, drugs = make_tables(args.reports)
+    report_ids = lambda_1.filter_report_ids_by_source(lambda_1.find_report_ids(WATCHLIST, drugs), reports)
+
+    start = time.perf_counter()
+    summary, table = aggregates.build_drug_aggregates(report_ids, WATCHLIST, reports, reactions, args.top_pts)
+    vectorized_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    report_data = lambda_1.extract_report_data(report_ids, reports, reactions, [], [], drugs)
+    extract_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    counts = loop_aggregates(aggregates, report_ids, report_data)
+    loop_seconds = time.perf_counter() - start
+
+    result = {
+        'benchmark': 'lambda1_aggregates',
+        'reports': args.reports,
+        'matched_reports': len(report_ids),
+        'drugs': len(summary),
+        'csv_rows': len(table),
+        'vectorized_seconds': round(vectorized_seconds, 3),
+        'extract_report_data_seconds': round(extract_seconds, 3),
+        'loop_seconds': round(loop_seconds, 3),
+        'identical': compare(summary, counts, args.top_pts)
+    }
+    print(json.dumps(result))
+
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=4)
+
+    if not result['identical']:
+        raise SystemExit("Vectorized aggregates differ from the loop over report_data")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark lambda-1's single-pass multi-tenant screening: 1 tenant vs 50 tenants.
+
+Builds a synthetic report_drug.txt (in the extract's quoted, $-delimited format) and
+compares one combined scan for N tenants with running the scan once per tenant.
+
+Usage: python benchmarks/bench_lambda1_multi_tenant.py --rows 500000 --tenants 1,50
+"""
+import argparse
+import json
+import random
+import time
+
+from _lambdas import load_lambda
+
+
+def make_report_drug_lines(rows, distinct_names, seed=7):
+    rng = random.Random(seed)
+    syllables = ['pan', 'zy', 'ga', 'tor', 'vel', 'mab', 'lin', 'ox', 'ra', 'sol', 'ium', 'dex', 'pro', 'cet']
+    names = sorted({''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).upper()
+                    for _ in range(distinct_names)})
+    lines = []
+    for row in range(rows):
+        name = rng.choice(names)
+        lines.append(f'"{row}"${rng.randint(1, rows // 3)}$"1"$"{name}"$"Suspect"$"1"$"Oral"$"1"$"10"$"mg"')
+    return lines, names
+
+
+def make_watchlists(tenants, names, names_per_tenant=25, seed=11):
+    rng = random.Random(seed)
+    return {f"tenant_{index:02d}": [name.lower() for name in rng.sample(names, names_per_tenant)] + [f"absent{index}"]
+            for index in range(tenants)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--distinct-names', type=int, default=20000)
+    parser.add_argument('--tenants', default='1,50')
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    lambda_1 = load_lambda('lambda-1')
+    lines, names = make_report_drug_lines(args.rows, args.distinct_names)
+
+    results = []
+    for tenant_count in [int(count) for count in args.tenants.split(',')]:
+        watchlists = make_watchlists(tenant_count, names)
+
+        start = time.perf_counter()
+        combined, _ = lambda_1.find_report_ids_by_tenant(watchlists, lines)
+        combined_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        separate = {tenant: lambda_1.find_report_ids_by_tenant({tenant: names_}, lines)[0][tenant]
+                    for tenant, names_ in watchlists.items()}
+        separate_seconds = time.perf_counter() - start
+
+        if any(set(combined[tenant]) != set(separate[tenant]) for tenant in watchlists):
+            raise SystemExit("Combined and per-tenant scans disagree")
+
+        results.append({
+            'rows': args.rows,
+            'tenants': tenant_count,
+            'combined_scan_seconds': round(combined_seconds, 3),
+            'per_tenant_scans_seconds': round(separate_seconds, 3),
+            'matched_reports': sum(len(report_ids) for report_ids in combined.values())
+        })
+        print(json.dumps(results[-1]))
+
+    with open(args.output, 'w') as f:
+        json.dump({'benchmark': 'lambda1_multi_tenant', 'results': results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Check and time the PRR/ROR signal detection over a synthetic extract.
+
+Builds report_drug and reactions tables with one planted drug/PT association, computes the
+ranked signals with signal_detection.compute_signals, recomputes every 2x2 table with Python
+sets, and fails if the counts or statistics differ or the planted pair is not the top signal.
+The full Canada Vigilance extract is on the order of 1M reports; the runtime target applies
+at that scale (--reports 1000000).
+
+Usage: python benchmarks/bench_lambda1_signals.py --reports 200000 --target-seconds 60
+"""
+import argparse
+import json
+import math
+import random
+import time
+from collections import defaultdict
+
+from _lambdas import load_lambda
+
+DRUGS = ['PANZYGA', 'ASPIRIN', 'TYLENOL', 'ADVIL', 'HUMIRA', 'PRIVIGEN', 'METFORMIN']
+WATCHLIST = ['panzyga', 'aspirin', 'humira']
+PTS = [f'Preferred term {i}' for i in range(500)]
+PLANTED = ('humira', 'Preferred term 7')
+
+
+def quoted(value):
+    return f'"{value}"'
+
+
+def make_tables(report_count, seed=17):
+    rng = random.Random(seed)
+    drugs, reactions = [], []
+    for rid in range(1, report_count + 1):
+        report_drugs = rng.sample(DRUGS, rng.randint(1, 3))
+        for drug in report_drugs:
+            drugs.append('$'.join([quoted(len(drugs)), str(rid), quoted('1'), quoted(drug)]
+                                  + [quoted('x')] * 18))
+        pts = {rng.choice(PTS) for _ in range(rng.randint(1, 4))}
+        if 'HUMIRA' in report_drugs and rng.random() < 0.3:
+            pts.add(PLANTED[1])
+        for pt in pts:
+            reactions.append('$'.join([quoted(len(reactions)), str(rid), quoted('x'), quoted('x'), quoted('x'),
+                                       quoted(pt)] + [quoted('x')] * 6))
+    return drugs, reactions
+
+
+def reference_counts(drugs, reactions):
+    """Brute-force a, drug_reports and pt_reports with Python sets."""
+    pts_by_report = defaultdict(set)
+    for line in reactions:
+        fields = line.split('$')
+        pts_by_report[fields[1].strip('"')].add(fields[5].strip('"'))
+    reports_by_drug = defaultdict(set)
+    for line in drugs:
+        fields = line.split('$')
+        value = fields[3].strip('"').lower()
+        for name in WATCHLIST:
+            if name in value and fields[1].strip('"') in pts_by_report:
+                reports_by_drug[name].add(fields[1].strip('"'))
+    reports_by_pt = defaultdict(set)
+    for report_id, pts in pts_by_report.items():
+        for pt in pts:
+            reports_by_pt[pt].add(report_id)
+    return reports_by_drug, reports_by_pt, len(pts_by_report)
+
+
+def check(ranked, total_reports, drugs, reactions):
+    reports_by_drug, reports_by_pt, expected_total = reference_counts(drugs, reactions)
+    if total_reports != expected_total:
+        return False
+    for row in ranked.itertuples():
+        a = len(reports_by_drug[row.drug] & reports_by_pt[row.pt_name_eng])
+        b = len(reports_by_drug[row.drug]) - a
+        c = len(reports_by_pt[row.pt_name_eng]) - a
+        d = total_reports - a - b - c
+        if (row.a, row.drug_reports, row.pt_reports) != (a, a + b, a + c):
+            return False
+        if 0 in (b, c, d):
+            a, b, c, d = a + 0.5, b + 0.5, c + 0.5, d + 0.5
+        ror = (a * d) / (b * c)
+        prr = (a / (a + b)) / (c / (c + d))
+        if not (math.isclose(row.ror, ror, rel_tol=1e-9) and math.isclose(row.prr, prr, rel_tol=1e-9)):
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reports', type=int, default=200000)
+    parser.add_argument('--target-seconds', type=float, default=60.0)
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    load_lambda('lambda-1')  # puts the lambda directory on sys.path, like the other benchmarks
+    signal_detection = __import__('signal_detection')
+    drugs, reactions = make_tables(args.reports)
+
+    start = time.perf_counter()
+    ranked, total_reports = signal_detection.compute_signals(WATCHLIST, drugs, reactions)
+    elapsed = time.perf_counter() - start
+
+    top = ranked[(ranked['drug'] == PLANTED[0]) & (ranked['rank'] == 1)]
+    result = {
+        'benchmark': 'lambda1_signals',
+        'reports': args.reports,
+        'report_drug_rows': len(drugs),
+        'reaction_rows': len(reactions),
+        'ranked_pairs': len(ranked),
+        'signals': int(ranked['signal'].sum()),
+        'seconds': round(elapsed, 3),
+        'target_seconds': args.target_seconds,
+        'within_target': elapsed <= args.target_seconds,
+        'planted_pair_top': bool(len(top)) and top['pt_name_eng'].iloc[0] == PLANTED[1] and bool(top['signal'].iloc[0]),
+        'identical': check(ranked, total_reports, drugs, reactions)
+    }
+    print(json.dumps(result))
+
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=4)
+
+    if not (result['identical'] and result['planted_pair_top']):
+        raise SystemExit("Signal statistics differ from the brute-force reference")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Check and time lambda-1's spill-to-disk mode for extract_report_data.
+
+Runs the in-memory path and the spilling path at several (deliberately tiny) memory budgets
+over synthetic extract tables, fails if any output differs, and records time and peak Python
+heap for each. Each path is also run the way lambda-1's main uses it: joined reports go through
+the new-report filter into the JSON output, which the spilling path streams one report at a
+time. The JSON must be byte-identical, and the peak heap of that flow must be lower at the
+smallest budget than at the largest, and below the in-memory flow's at every budget (at tiny
+budgets the merge's open run files, not the budget, bound it).
+
+Usage: python benchmarks/bench_lambda1_spill.py --reports 20000 --budgets-kb 4,64,1024
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from _lambdas import load_lambda
+from storage import LocalStorage
+
+OUTPUT_BUCKET = 'bench-output'
+
+
+def quoted(value):
+    return f'"{value}"'
+
+
+def make_tables(report_count, seed=5):
+    rng = random.Random(seed)
+    ids = [str(i) for i in range(1, report_count + 1)]
+    reports = ['$'.join([rid] + [quoted(rng.choice(['1', '2', '14-MAR-21', f'v{column}']))
+                                 for column in range(1, 40)]) for rid in ids]
+    reactions = ['$'.join([quoted(i), rng.choice(ids)] + [quoted(f'r{i}_{column}') for column in range(2, 12)])
+                 for i in range(report_count * 3)]
+    links = ['$'.join([quoted(i), rng.choice(ids), quoted('Duplicate'), quoted('x'), quoted(f'L{i}')])
+             for i in range(report_count // 4)]
+    drugs = ['$'.join([quoted(i), rng.choice(ids), quoted('1'), quoted(rng.choice(['PANZYGA', 'ASPIRIN', 'TYLENOL']))]
+                      + [quoted(f'd{i}_{column}') for column in range(4, 22)]) for i in range(report_count * 4)]
+    indications = ['$'.join([quoted(i), rng.choice(ids), quoted('1'), quoted(rng.choice(['panzyga', 'aspirin'])),
+                             quoted(f'ind{i}')]) for i in range(report_count * 2)]
+    report_ids = {rid: [] for rid in ids if rng.random() < 0.6}
+    return report_ids, reports, reactions, indications, links, drugs
+
+
+def run(lambda_1, tables, budget_bytes):
+    lambda_1.report_data_memory_budget_mb = budget_bytes / (1024 * 1024)
+    tracemalloc.start()
+    start = time.perf_counter()
+    report_data = lambda_1.extract_report_data(*tables)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return json.dumps(report_data), elapsed, peak
+
+
+def run_output(lambda_1, tables, budget_bytes, output_prefix):
+    """Join, filter and write the JSON output as lambda-1's main does; returns (JSON bytes, seconds, peak heap)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    if budget_bytes:
+        reports = lambda_1.extract_report_data_spilling(*tables, budget_bytes)
+        lambda_1.generate_json_output(lambda_1.iter_new_reports(reports, set()), output_prefix, 'bench')
+    else:
+        lambda_1.report_data_memory_budget_mb = 0
+        report_data = lambda_1.extract_report_data(*tables)
+        lambda_1.generate_json_output(lambda_1.filter_new_report_data(report_data, set()), output_prefix, 'bench')
+        del report_data
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    output_key = f"{output_prefix}reported_adverse_reaction_bench.json"
+    return lambda_1.storage.read_bytes(OUTPUT_BUCKET, output_key), elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reports', type=int, default=20000)
+    parser.add_argument('--budgets-kb', default='4,64,1024')
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    lambda_1 = load_lambda('lambda-1')
+    logging.getLogger().setLevel(logging.WARNING)  # The new-report filter logs every report at INFO
+    tables = make_tables(args.reports)
+    budgets_kb = sorted(int(budget) for budget in args.budgets_kb.split(','))
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        lambda_1.storage, lambda_1.output_bucket = LocalStorage(os.path.join(work_dir, 's3')), OUTPUT_BUCKET
+        lambda_1.spill_dir = os.path.join(work_dir, 'spill')
+
+        expected, elapsed, peak = run(lambda_1, tables, 0)
+        expected_json, output_seconds, output_peak = run_output(lambda_1, tables, 0, 'in_memory/')
+        results = [{'mode': 'in_memory', 'seconds': round(elapsed, 3), 'peak_heap_mb': round(peak / 2 ** 20, 2),
+                    'output_seconds': round(output_seconds, 3), 'output_peak_heap_mb': round(output_peak / 2 ** 20, 2),
+                    'identical': True}]
+        for budget_kb in budgets_kb:
+            output, elapsed, peak = run(lambda_1, tables, budget_kb * 1024)
+            output_json, output_seconds, output_peak = run_output(lambda_1, tables, budget_kb * 1024,
+                                                                  f"spilling_{budget_kb}/")
+            results.append({'mode': 'spilling', 'budget_kb': budget_kb, 'seconds': round(elapsed, 3),
+                            'peak_heap_mb': round(peak / 2 ** 20, 2), 'output_seconds': round(output_seconds, 3),
+                            'output_peak_heap_mb': round(output_peak / 2 ** 20, 2),
+                            'identical': output == expected and output_json == expected_json})
+    for result in results:
+        print(json.dumps(result))
+
+    with open(args.output, 'w') as f:
+        json.dump({'benchmark': 'lambda1_spill', 'reports': args.reports, 'results': results}, f, indent=4)
+
+    if not all(result['identical'] for result in results):
+        raise SystemExit("Spilling output differs from the in-memory output")
+    in_memory_peak, *spilling_peaks = [result['output_peak_heap_mb'] for result in results]
+    if max(spilling_peaks) >= in_memory_peak or (len(spilling_peaks) > 1 and spilling_peaks[0] >= spilling_peaks[-1]):
+        raise SystemExit(f"Peak heap of the streamed output does not fall with the budget: "
+                         f"{in_memory_peak} MB in memory, {spilling_peaks} MB at {budgets_kb} KB")
+
+
+if __name__ == "__main__":
+    main()
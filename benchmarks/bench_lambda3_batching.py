@@ -0,0 +1,69 @@
+"""
+Sweep lambda-3 wkhtmltopdf batch sizes and check that batching preserves page counts.
+
+Usage: WKHTMLTOPDF_PATH=/usr/local/bin/wkhtmltopdf python benchmarks/bench_lambda3_batching.py --reports 100
+"""
+import argparse
+import json
+import os
+import time
+from io import BytesIO
+
+import pdfkit
+import PyPDF2
+
+from _lambdas import SAMPLE_JSON_PATH, TEMPLATE_PATH, load_lambda
+
+
+def count_pages(pdf_parts):
+    return sum(len(PyPDF2.PdfReader(BytesIO(part)).pages) for part in pdf_parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reports', type=int, default=50, help='Number of reports to render')
+    parser.add_argument('--batch-sizes', default='1,2,5,10,25,50', help='Comma separated batch sizes')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    lambda_2 = load_lambda('lambda-2')
+    lambda_3 = load_lambda('lambda-3')
+
+    template_html = TEMPLATE_PATH.read_text()
+    records = json.loads(SAMPLE_JSON_PATH.read_text())
+    html_parts = [lambda_2.render_report_html(records[i % len(records)], template_html)
+                  for i in range(args.reports)]
+
+    config = pdfkit.configuration(wkhtmltopdf=os.getenv("WKHTMLTOPDF_PATH", "wkhtmltopdf"))
+    options = {'orientation': 'Landscape', 'page-size': 'A4'}
+
+    results = []
+    expected_pages = None
+    for batch_size in [int(size) for size in args.batch_sizes.split(',')]:
+        start = time.perf_counter()
+        pages = count_pages(lambda_3.render_pdf_parts(html_parts, config, options,
+                                                      batch_size=batch_size, max_workers=args.workers))
+        elapsed = time.perf_counter() - start
+        if expected_pages is None:
+            expected_pages = pages
+        results.append({
+            'batch_size': batch_size,
+            'workers': args.workers,
+            'reports': args.reports,
+            'seconds': round(elapsed, 3),
+            'reports_per_second': round(args.reports / elapsed, 2),
+            'pages': pages,
+            'pages_match_unbatched': pages == expected_pages
+        })
+        print(json.dumps(results[-1]))
+
+    with open(args.output, 'w') as f:
+        json.dump({'benchmark': 'lambda3_batching', 'results': results}, f, indent=4)
+
+    if not all(result['pages_match_unbatched'] for result in results):
+        raise SystemExit("Batched rendering changed the page count")
+
+
+if __name__ == "__main__":
+    main()
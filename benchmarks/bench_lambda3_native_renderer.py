@@ -0,0 +1,109 @@
+"""
+Compare lambda-3's native PDF renderer with the pdfkit/wkhtmltopdf path.
+
+Parity: every field value that template.html shows must appear in the text of the natively
+rendered page(s) for that report, and in the pdfkit output when --pdfkit is given.
+Throughput: reports/sec for each renderer over --reports reports.
+
+Usage: WKHTMLTOPDF_PATH=/usr/local/bin/wkhtmltopdf python benchmarks/bench_lambda3_native_renderer.py --pdfkit
+"""
+import argparse
+import json
+import os
+import re
+import time
+from io import BytesIO
+
+import PyPDF2
+
+from _lambdas import SAMPLE_JSON_PATH, TEMPLATE_PATH, load_lambda
+from native_pdf import render_reports_pdf
+from report_format import format_data
+
+SHOWN_FIELDS = ['report_no', 'version_no', 'datintreceived', 'datreceived', 'source_eng', 'mah_no',
+                'report_type_eng', 'reporter_type_eng', 'seriousness_eng', 'death', 'disability',
+                'congenital_anomaly', 'life_threatening', 'hospitalization', 'other_medically_imp_cond',
+                'gender_eng', 'outcome_eng', 'record_type_eng', 'report_link_no']
+SHOWN_LISTS = ['drug_name', 'drug_involvement', 'dosage_form', 'route', 'dose', 'freq_time', 'indication',
+               'pt_name', 'meddra_version']
+
+
+def normalize(text):
+    # Both renderers wrap long values onto several lines, so compare without whitespace
+    return re.sub(r'\s+', '', text)
+
+
+def expected_values(record):
+    formatted_data = format_data(record)
+    values = [record.get(key, '') for key in SHOWN_FIELDS]
+    values += [value for key in SHOWN_LISTS for value in formatted_data[key]]
+    return {normalize(value) for value in values if normalize(value)}
+
+
+def pdf_text(pdf_bytes):
+    return normalize("".join(page.extract_text() for page in PyPDF2.PdfReader(BytesIO(pdf_bytes)).pages))
+
+
+def missing_values(record, pdf_bytes):
+    text = pdf_text(pdf_bytes)
+    return sorted(value for value in expected_values(record) if value not in text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reports', type=int, default=1000, help='Reports rendered for the throughput run')
+    parser.add_argument('--pdfkit', action='store_true', help='Also render with wkhtmltopdf (WKHTMLTOPDF_PATH)')
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    records = json.loads(SAMPLE_JSON_PATH.read_text())
+    lambda_3 = load_lambda('lambda-3')
+    if args.pdfkit:
+        import pdfkit
+        lambda_2 = load_lambda('lambda-2')
+        template_html = TEMPLATE_PATH.read_text()
+        config = pdfkit.configuration(wkhtmltopdf=os.getenv("WKHTMLTOPDF_PATH", "wkhtmltopdf"))
+
+    # Visual parity: field-by-field text check, one report at a time
+    parity = []
+    for record in records:
+        result = {'report_no': record.get('report_no'),
+                  'native_missing': missing_values(record, render_reports_pdf([record]))}
+        if args.pdfkit:
+            html = lambda_2.render_report_html(record, template_html)
+            pdf = pdfkit.from_string(html, False, configuration=config, options=lambda_3.PDF_OPTIONS)
+            result['pdfkit_missing'] = missing_values(record, pdf)
+        parity.append(result)
+    mismatches = [result for result in parity if result['native_missing']]
+
+    # Throughput
+    workload = [records[i % len(records)] for i in range(args.reports)]
+    throughput = []
+    start = time.perf_counter()
+    pages = sum(len(PyPDF2.PdfReader(BytesIO(part)).pages) for part in lambda_3.render_native_pdf_parts(workload))
+    elapsed = time.perf_counter() - start
+    throughput.append({'renderer': 'native', 'reports': args.reports, 'pages': pages, 'seconds': round(elapsed, 3),
+                       'reports_per_second': round(args.reports / elapsed, 2)})
+    if args.pdfkit:
+        html_parts = [lambda_2.render_report_html(record, template_html) for record in workload]
+        batch_size, max_workers = lambda_3.get_render_settings(len(html_parts))
+        start = time.perf_counter()
+        pages = sum(len(PyPDF2.PdfReader(BytesIO(part)).pages) for part in lambda_3.render_pdf_parts(
+            html_parts, config, lambda_3.PDF_OPTIONS, batch_size=batch_size, max_workers=max_workers))
+        elapsed = time.perf_counter() - start
+        throughput.append({'renderer': 'pdfkit', 'reports': args.reports, 'pages': pages,
+                           'seconds': round(elapsed, 3), 'reports_per_second': round(args.reports / elapsed, 2)})
+
+    for result in throughput:
+        print(json.dumps(result))
+    print(json.dumps({'parity_checked': len(parity), 'native_mismatches': len(mismatches)}))
+
+    with open(args.output, 'w') as f:
+        json.dump({'benchmark': 'lambda3_native_renderer', 'throughput': throughput, 'parity': parity}, f, indent=4)
+
+    if mismatches:
+        raise SystemExit(f"Native renderer is missing values for {len(mismatches)} reports")
+
+
+if __name__ == "__main__":
+    main()
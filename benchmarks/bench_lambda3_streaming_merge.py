@@ -0,0 +1,106 @@
+"""
+Memory regression check for lambda-3's streaming PDF merge.
+
+Merges N single-page PDFs (5000 by default) with StreamingPdfMerger and, optionally, with
+PyPDF2.PdfMerger for comparison. Peak Python heap is measured with tracemalloc; the run
+fails if the streaming merge goes over --max-peak-mb or loses pages.
+
+Usage: python benchmarks/bench_lambda3_streaming_merge.py --parts 5000 --compare
+"""
+import argparse
+import json
+import tempfile
+import time
+import tracemalloc
+from io import BytesIO
+
+import PyPDF2
+
+import _lambdas  # noqa: F401  (puts the lambda directory on sys.path)
+from pdf_stream_merge import StreamingPdfMerger
+
+
+def make_single_page_pdf(index, padding=16 * 1024):
+    """Build a small one-page PDF whose content stream is about `padding` bytes."""
+    text = f"BT /F1 12 Tf 72 720 Td (Report {index}) Tj ET\n"
+    content = (text + "% " + "x" * max(padding - len(text) - 3, 0) + "\n").encode('ascii')
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [ 3 0 R ] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [ 0 0 842 595 ] /Contents 4 0 R "
+        b"/Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length " + str(len(content)).encode('ascii') + b" >>\nstream\n" + content + b"endstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n".encode('ascii') + body + b"\nendobj\n"
+    xref_position = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('ascii')
+    for offset in offsets:
+        pdf += f"{offset:010d} 00000 n \n".encode('ascii')
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_position}\n%%EOF\n".encode('ascii')
+    return bytes(pdf)
+
+
+def measure(merge, parts):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = merge(parts)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def streaming_merge(parts):
+    with tempfile.TemporaryFile() as output:
+        merger = StreamingPdfMerger(output)
+        for index in range(parts):
+            merger.append(make_single_page_pdf(index))
+        merger.close()
+        size = output.tell()
+        output.seek(0)
+        pages = len(PyPDF2.PdfReader(output).pages) if parts <= 20000 else merger.page_count
+    return {'pages': pages, 'output_bytes': size}
+
+
+def in_memory_merge(parts):
+    merger = PyPDF2.PdfMerger()
+    for index in range(parts):
+        merger.append(PyPDF2.PdfReader(BytesIO(make_single_page_pdf(index))))
+    output = BytesIO()
+    merger.write(output)
+    return {'pages': len(PyPDF2.PdfReader(output).pages), 'output_bytes': output.tell()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--parts', type=int, default=5000)
+    parser.add_argument('--max-peak-mb', type=float, default=32.0)
+    parser.add_argument('--compare', action='store_true', help='Also measure PyPDF2.PdfMerger')
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    results = []
+    modes = [('streaming', streaming_merge)] + ([('pdfmerger', in_memory_merge)] if args.compare else [])
+    for name, merge in modes:
+        result, elapsed, peak = measure(merge, args.parts)
+        results.append(dict(result, mode=name, parts=args.parts, seconds=round(elapsed, 3),
+                            peak_heap_mb=round(peak / (1024 * 1024), 2)))
+        print(json.dumps(results[-1]))
+
+    with open(args.output, 'w') as f:
+        json.dump({'benchmark': 'lambda3_streaming_merge', 'results': results}, f, indent=4)
+
+    streaming = results[0]
+    if streaming['pages'] != args.parts:
+        raise SystemExit(f"Streaming merge produced {streaming['pages']} pages, expected {args.parts}")
+    if streaming['peak_heap_mb'] > args.max_peak_mb:
+        raise SystemExit(f"Streaming merge peak heap {streaming['peak_heap_mb']} MB is over {args.max_peak_mb} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark lambda-4's digest builder: build time, payload size and email count by row count.
+
+SES and S3 are replaced with local stubs that record what would have been sent, so the
+whole lambda_handler path runs without AWS.
+
+Usage: python benchmarks/bench_lambda4_digest.py --rows 10,1000,50000
+"""
+import argparse
+import json
+import time
+from types import SimpleNamespace
+
+from _lambdas import SAMPLE_JSON_PATH, load_lambda
+from storage import S3Storage
+
+
+class LocalSesStub:
+    """Records send_email calls and enforces the SES message size limit."""
+
+    MAX_MESSAGE_BYTES = 10 * 1024 * 1024
+
+    def __init__(self):
+        self.messages = []
+
+    def send_email(self, Source, Destination, Message):
+        size = len(Message['Body']['Html']['Data'].encode('utf-8'))
+        if size > self.MAX_MESSAGE_BYTES:
+            raise ValueError(f"Message of {size} bytes is over the SES limit")
+        self.messages.append({'subject': Message['Subject']['Data'], 'bytes': size})
+        return {'MessageId': f"local-{len(self.messages)}"}
+
+
+class LocalS3Stub:
+    """Serves one JSON report file and accepts CSV uploads."""
+
+    def __init__(self, data):
+        self.body = json.dumps(data).encode('utf-8')
+        self.objects = {}
+
+    def list_objects_v2(self, Bucket, Prefix):
+        return {'Contents': [{'Key': f"{Prefix}report.json", 'Size': len(self.body), 'LastModified': 0}]}
+
+    def get_paginator(self, operation):
+        return SimpleNamespace(paginate=lambda **kwargs: [getattr(self, operation)(**kwargs)])
+
+    def get_object(self, Bucket, Key):
+        import io
+        return {'Body': io.BytesIO(self.body)}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        return f"https://example.invalid/{Params['Key']}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', default='10,1000,50000')
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    lambda_4 = load_lambda('lambda-4')
+    records = json.loads(SAMPLE_JSON_PATH.read_text())
+
+    results = []
+    for row_count in [int(rows) for rows in args.rows.split(',')]:
+        data = [records[i % len(records)] for i in range(row_count)]
+
+        start = time.perf_counter()
+        bodies = lambda_4.generate_email_bodies(data, '2024-01-01 00:00:00')
+        build_seconds = time.perf_counter() - start
+
+        for mode in ('split', 'summary'):
+            ses_stub, s3_stub = LocalSesStub(), LocalS3Stub(data)
+            lambda_4.ses_client, lambda_4.s3_client = ses_stub, s3_stub
+            lambda_4.storage = S3Storage(s3_stub)
+            lambda_4.EMAIL_OVERFLOW_MODE = mode
+            start = time.perf_counter()
+            lambda_4.lambda_handler({}, None)
+            handler_seconds = time.perf_counter() - start
+            results.append({
+                'rows': row_count,
+                'mode': mode,
+                'build_seconds': round(build_seconds, 4),
+                'handler_seconds': round(handler_seconds, 4),
+                'payload_bytes': sum(len(body.encode('utf-8')) for body in bodies),
+                'emails_sent': len(ses_stub.messages),
+                'largest_email_bytes': max(message['bytes'] for message in ses_stub.messages),
+                'csv_uploads': len(s3_stub.objects)
+            })
+            print(json.dumps(results[-1]))
+
+    with open(args.output, 'w') as f:
+        json.dump({'benchmark': 'lambda4_digest', 'results': results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
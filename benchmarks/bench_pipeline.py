@@ -0,0 +1,214 @@
+"""
+End-to-end benchmark: run lambda-1 through lambda-4 on a synthetic extract against local stand-ins.
+
+Generates a synthetic extract (see synthetic_extract.py), loads it into a filesystem-backed
+S3 stand-in and runs each lambda's handler in pipeline order: lambda-1 screens the extract,
+lambda-2 renders its JSON to HTML, lambda-3 renders the PDF (native renderer unless --pdfkit)
+and lambda-4 builds the email digest. Per-stage time, peak RSS and row counts come from each
+lambda's RunMetrics; --trace-memory adds each stage's own Python heap peak (slower).
+--storage local (the default) runs the lambdas on STORAGE_BACKEND=local, which memory-maps
+the extract tables; --storage s3 goes through the S3 backend against the stand-in client.
+
+Results go to --output as JSON, tagged with the git commit. --baseline compares against an
+earlier results file and fails when a stage is more than --max-regression times slower.
+
+Usage: python benchmarks/bench_pipeline.py --reports 100000 --output bench_output.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from _lambdas import REPO_DIR, TEMPLATE_PATH, load_lambda
+from local_s3 import LocalLambdaClient, LocalS3Client, LocalSesClient, LocalSnsClient
+from synthetic_extract import TABLES, generate_extract
+
+INPUT_BUCKET = 'cvp-input'
+OUTPUT_BUCKET = 'cvp-output'
+EXTRACT_PREFIX = 'Input_data/report_id_database/'
+DRUG_NAMES_KEY = 'drug_names/drug_names.txt'
+LAMBDAS = ['lambda-1', 'lambda-2', 'lambda-3', 'lambda-4']
+
+
+def configure_environment(work_dir, storage_backend):
+    """Environment the lambdas read at import time; must be set before they are loaded."""
+    os.environ.update({
+        'STORAGE_BACKEND': storage_backend,
+        'STORAGE_ROOT': os.path.join(work_dir, 's3'),
+        'INPUT_BUCKET': INPUT_BUCKET,
+        'OUTPUT_BUCKET': OUTPUT_BUCKET,
+        'DRUG_NAMES_FILE_PATH': DRUG_NAMES_KEY,
+        'REPORT_DRUG_FILE_PATH': f"{EXTRACT_PREFIX}report_drug.txt",
+        'REPORTS_FILE_PATH': f"{EXTRACT_PREFIX}reports.txt",
+        'REACTIONS_FILE_PATH': f"{EXTRACT_PREFIX}reactions.txt",
+        'REPORT_LINKS_FILE_PATH': f"{EXTRACT_PREFIX}report_links.txt",
+        'REPORT_DRUG_INDICATION_FILE_PATH': f"{EXTRACT_PREFIX}report_drug_indication.txt",
+        'SNS_TOPIC_ARN': 'arn:aws:sns:local:000000000000:cvp2',
+        'DIRECTORY': 'report_output/',
+        'FUNCTION_TO_INVOKE': 'cvp2-email',
+        'RECORDS_BUCKET': OUTPUT_BUCKET,
+        'INPUT_HTML_PREFIX': 'input-html/',
+        'BUCKET_NAME': OUTPUT_BUCKET,
+        'FOLDER_PREFIX': 'report_output/',
+        'RENDER_CACHE_LOCAL_DIR': os.path.join(work_dir, 'render_cache'),
+        'METRICS_FORMAT': 'off'
+    })
+
+
+def load_extract(s3, extract_dir, watchlist):
+    for table in TABLES:
+        s3.upload_file(os.path.join(extract_dir, table), INPUT_BUCKET, f"{EXTRACT_PREFIX}{table}")
+    s3.put_object(Bucket=INPUT_BUCKET, Key=DRUG_NAMES_KEY, Body="\n".join(watchlist))
+
+
+def use_client(module, s3):
+    """Point a lambda at the stand-in S3 client (only used by the s3 storage backend)."""
+    module.s3_client = s3
+    module.storage = __import__('storage').get_storage(s3)
+
+
+def run_lambda_1(s3):
+    lambda_1 = load_lambda('lambda-1')
+    use_client(lambda_1, s3)
+    lambda_1.sns_client = LocalSnsClient()
+    logging.getLogger().setLevel(logging.WARNING)  # lambda-1 logs every report at INFO
+    return lambda_1.main('bench')
+
+
+def run_lambda_2(s3, work_dir):
+    lambda_2 = load_lambda('lambda-2')
+    use_client(lambda_2, s3)
+    lambda_2.lambda_client = LocalLambdaClient()
+    # lambda-2 reads template.html from next to itself
+    shutil.copyfile(TEMPLATE_PATH, os.path.join(work_dir, 'template.html'))
+    lambda_2.__file__ = os.path.join(work_dir, 'lambda-2.py')
+    os.environ['INPUT_BUCKET'] = OUTPUT_BUCKET  # lambda-1 wrote its JSON to the output bucket
+    return lambda_2.main('bench')
+
+
+def run_lambda_3(s3, renderer):
+    lambda_3 = load_lambda('lambda-3')
+    use_client(lambda_3, s3)
+    os.environ['INPUT_BUCKET'] = OUTPUT_BUCKET  # lambda-2 wrote its HTML to the output bucket
+    response = lambda_3.lambda_handler({'renderer': renderer, 'run_id': 'bench'}, None)
+    if response['statusCode'] != 200:
+        raise SystemExit(f"lambda-3 failed: {response['body']}")
+    return response['metrics']
+
+
+def run_lambda_4(s3):
+    lambda_4 = load_lambda('lambda-4')
+    use_client(lambda_4, s3)
+    lambda_4.ses_client = LocalSesClient()
+    return lambda_4.lambda_handler({}, SimpleNamespace(aws_request_id='bench'))['metrics']
+
+
+def stage_seconds(results):
+    """(lambda, stage) -> total seconds, summing stages that run more than once."""
+    totals = {}
+    for name, summary in results['lambdas'].items():
+        for stage in summary['stages']:
+            key = f"{name}/{stage['stage']}"
+            totals[key] = totals.get(key, 0) + stage['seconds']
+    return totals
+
+
+def compare(results, baseline, max_regression):
+    current, previous = stage_seconds(results), stage_seconds(baseline)
+    comparison = {}
+    for key in sorted(current.keys() & previous.keys()):
+        ratio = current[key] / previous[key] if previous[key] > 0.01 else 1.0  # Ignore sub-10 ms stages
+        comparison[key] = {'seconds': current[key], 'baseline_seconds': previous[key], 'ratio': round(ratio, 3),
+                           'regressed': ratio > max_regression}
+    return comparison
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reports', type=int, default=10000, help="Synthetic reports (10k to 10M)")
+    parser.add_argument('--extract-dir', help="Reuse an extract written by synthetic_extract.py")
+    parser.add_argument('--watchlist-ranks', default='0,3,10,40,150',
+                        help="Popularity ranks of the generated drug names put on the watchlist")
+    parser.add_argument('--lambdas', default=','.join(LAMBDAS))
+    parser.add_argument('--storage', choices=['local', 's3'], default='local')
+    parser.add_argument('--pdfkit', action='store_true', help="Render with wkhtmltopdf (WKHTMLTOPDF_PATH)")
+    parser.add_argument('--trace-memory', action='store_true')
+    parser.add_argument('--baseline', help="Earlier results file to compare stage times against")
+    parser.add_argument('--max-regression', type=float, default=1.5)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    selected = args.lambdas.split(',')
+    with tempfile.TemporaryDirectory() as work_dir:
+        configure_environment(work_dir, args.storage)
+        s3 = LocalS3Client(os.path.join(work_dir, 's3'))
+
+        start = time.perf_counter()
+        extract_dir = args.extract_dir or os.path.join(work_dir, 'extract')
+        counts, drugs = generate_extract(extract_dir, args.reports, args.seed)
+        generate_seconds = time.perf_counter() - start
+        watchlist = [drugs[int(rank)] for rank in args.watchlist_ranks.split(',') if int(rank) < len(drugs)]
+        load_extract(s3, extract_dir, watchlist + ['NOT A REAL DRUG'])
+
+        if args.trace_memory:
+            tracemalloc.start()
+        results = {
+            'benchmark': 'pipeline',
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'reports': args.reports,
+            'storage': args.storage,
+            'rows': counts,
+            'watchlist': watchlist,
+            'generate_seconds': round(generate_seconds, 3),
+            'lambdas': {}
+        }
+        runners = {
+            'lambda-1': lambda: run_lambda_1(s3),
+            'lambda-2': lambda: run_lambda_2(s3, work_dir),
+            'lambda-3': lambda: run_lambda_3(s3, 'pdfkit' if args.pdfkit else 'native'),
+            'lambda-4': lambda: run_lambda_4(s3)
+        }
+        for name in LAMBDAS:
+            if name in selected:
+                summary = runners[name]()
+                results['lambdas'][name] = {key: summary[key] for key in ('seconds', 'peak_rss_mb', 'stages')}
+                print(json.dumps({'lambda': name, 'seconds': summary['seconds'], 'peak_rss_mb': summary['peak_rss_mb']}))
+        if args.trace_memory:
+            tracemalloc.stop()
+
+        results['outputs'] = sorted(item['Key'] for item in s3.list_objects_v2(Bucket=OUTPUT_BUCKET).get('Contents', []))
+
+    failed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            results['comparison'] = compare(results, json.load(f), args.max_regression)
+        for key, row in results['comparison'].items():
+            print(json.dumps({'stage': key, **row}))
+        failed = any(row['regressed'] for row in results['comparison'].values())
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4)
+
+    if failed:
+        raise SystemExit(f"Stages regressed by more than {args.max_regression}x against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Benchmark time-to-alert of the priority lane against the batch digest.
+
+Runs the pipeline from bench_pipeline.py with PRIORITY_ALERTS=true on a synthetic extract.
+lambda-1 queues every new report with death, life_threatening or hospitalization = "Yes" as
+soon as it is assembled; with --queue local the in-process queue emails them from lambda-1,
+with --queue sqs they go through an SQS stand-in and lambda-4's queue handler. lambda-2 to
+lambda-4 then produce the usual batch digest. Both are timed from extract availability (the
+newest extract table's LastModified) to the email being sent. Fails unless every priority
+report in lambda-1's output got exactly one alert and the digest still lists every report.
+With --queue sqs and --sqs-fail-every N, the first send of every Nth alert fails; lambda-1
+must retry those sends and still queue every alert.
+
+Usage: python benchmarks/bench_priority_alerts.py --reports 100000 --queue local
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+
+from _lambdas import load_lambda
+from bench_pipeline import (OUTPUT_BUCKET, configure_environment, load_extract, run_lambda_2, run_lambda_3,
+                            use_client)
+from local_s3 import LocalS3Client, LocalSesClient, LocalSnsClient, LocalSqsClient
+from synthetic_extract import generate_extract
+
+PRIORITY_CRITERIA = ['death', 'life_threatening', 'hospitalization']
+
+
+class TimedSesClient(LocalSesClient):
+    """Records when each email was sent."""
+
+    def send_email(self, Source, Destination, Message):
+        response = super().send_email(Source, Destination, Message)
+        self.messages[-1]['sent_at'] = time.time()
+        return response
+
+
+class FlakySqsClient(LocalSqsClient):
+    """Fails the first send of every fail_every-th message, as a transient SQS error would."""
+
+    def __init__(self, fail_every):
+        super().__init__()
+        self.fail_every = fail_every
+        self.seen = set()
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        if MessageBody not in self.seen:
+            self.seen.add(MessageBody)
+            if self.fail_every and len(self.seen) % self.fail_every == 0:
+                raise Exception("Simulated SQS send failure")
+        return super().send_message(QueueUrl, MessageBody, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reports', type=int, default=20000)
+    parser.add_argument('--watchlist-ranks', default='0,3,10,40,150')
+    parser.add_argument('--queue', choices=['local', 'sqs'], default='local')
+    parser.add_argument('--sqs-fail-every', type=int, default=0, help="Fail every Nth SQS send (with --queue sqs)")
+    parser.add_argument('--storage', choices=['local', 's3'], default='local')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        configure_environment(work_dir, args.storage)
+        os.environ['PRIORITY_ALERTS'] = 'true'
+        s3 = LocalS3Client(os.path.join(work_dir, 's3'))
+        counts, drugs = generate_extract(os.path.join(work_dir, 'extract'), args.reports, args.seed)
+        watchlist = [drugs[int(rank)] for rank in args.watchlist_ranks.split(',') if int(rank) < len(drugs)]
+        load_extract(s3, os.path.join(work_dir, 'extract'), watchlist)
+
+        ses, sqs = TimedSesClient(), FlakySqsClient(args.sqs_fail_every)
+        lambda_1 = load_lambda('lambda-1')
+        use_client(lambda_1, s3)
+        lambda_1.sns_client, lambda_1.ses_client, lambda_1.sqs_client = LocalSnsClient(), ses, sqs
+        if args.queue == 'sqs':
+            __import__('priority_alerts').PRIORITY_ALERT_QUEUE_URL = 'https://sqs.local/000000000000/cvp2-priority'
+        logging.getLogger().setLevel(logging.WARNING)
+        extract_available_at = lambda_1.get_extract_available_at()
+        lambda_1.main('bench')
+
+        lambda_4 = load_lambda('lambda-4')
+        use_client(lambda_4, s3)
+        lambda_4.ses_client = ses
+        if args.queue == 'sqs':
+            response = lambda_4.lambda_handler(sqs.received_event(), SimpleNamespace(aws_request_id='bench'))
+            if response['batchItemFailures']:
+                raise SystemExit(f"{len(response['batchItemFailures'])} priority alerts failed")
+
+        run_lambda_2(s3, work_dir)
+        run_lambda_3(s3, 'native')
+        lambda_4.lambda_handler({}, SimpleNamespace(aws_request_id='bench'))
+
+        output_key = next(obj['Key'] for obj in lambda_1.storage.list(OUTPUT_BUCKET, 'report_output/')
+                          if obj['Key'].endswith('.json'))
+        records = json.loads(lambda_1.storage.read_bytes(OUTPUT_BUCKET, output_key))
+
+    expected = sorted(record['report_no'] for record in records
+                      if any(record.get(name) == 'Yes' for name in PRIORITY_CRITERIA))
+    priority = [message for message in ses.messages if message['subject'].startswith('Priority')]
+    digest = [message for message in ses.messages if not message['subject'].startswith('Priority')]
+    alerted = sorted(message['subject'].split(' - ', 1)[1].split(' ')[0] for message in priority)
+    alert_seconds = sorted(message['sent_at'] - extract_available_at for message in priority)
+    digest_seconds = max(message['sent_at'] for message in digest) - extract_available_at
+
+    result = {
+        'benchmark': 'priority_alerts',
+        'queue': args.queue,
+        'reports': args.reports,
+        'rows': counts,
+        'matched_reports': len(records),
+        'priority_reports': len(expected),
+        'priority_alerts_sent': len(priority),
+        'time_to_alert_first_seconds': round(alert_seconds[0], 3) if alert_seconds else None,
+        'time_to_alert_median_seconds': round(statistics.median(alert_seconds), 3) if alert_seconds else None,
+        'time_to_alert_last_seconds': round(alert_seconds[-1], 3) if alert_seconds else None,
+        'time_to_digest_seconds': round(digest_seconds, 3),
+        'digest_emails': len(digest)
+    }
+    print(json.dumps(result))
+
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=4)
+
+    if alerted != expected:
+        raise SystemExit(f"{len(alerted)} priority alerts sent for {len(expected)} priority reports")
+    if not digest:
+        raise SystemExit("The batch digest was not sent")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Check the on-demand profiling hook: near-zero overhead when off, complete artifacts when on.
+
+Times a trivial handler with and without the profiled() wrapper while profiling is disabled
+and fails if the per-call overhead exceeds --max-overhead-us. Then runs a small workload with
+"profile": "all" in the event and checks that the cProfile, tracemalloc and summary artifacts
+are written and loadable. Also checks that every lambda's handler carries the hook.
+
+Usage: python benchmarks/bench_profiling_overhead.py --calls 200000 --max-overhead-us 1.0
+"""
+import argparse
+import json
+import os
+import pstats
+import tempfile
+import time
+
+from _lambdas import load_lambda
+
+LAMBDAS = ['lambda-1', 'lambda-2', 'lambda-3', 'lambda-4']
+
+
+class Context:
+    aws_request_id = 'bench-request'
+
+
+def handler(event, context):
+    return event
+
+
+def workload(event, context):
+    rows = [str(i) * 10 for i in range(50000)]
+    return {'statusCode': 200, 'rows': len(sorted(rows))}
+
+
+def per_call_seconds(func, calls, event):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func(event, None)
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, default=200000)
+    parser.add_argument('--max-overhead-us', type=float, default=1.0)
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    hooked = {name: hasattr(load_lambda(name).lambda_handler, '__wrapped__') for name in LAMBDAS}
+    profiling = __import__('profiling')
+
+    wrapped = profiling.profiled('bench')(handler)
+    event = {'records': 1}
+    baseline = min(per_call_seconds(handler, args.calls, event) for _ in range(3))
+    disabled = min(per_call_seconds(wrapped, args.calls, event) for _ in range(3))
+    overhead_us = (disabled - baseline) * 1e6
+
+    with tempfile.TemporaryDirectory() as output:
+        profiled_workload = profiling.profiled('bench')(workload)
+        profiling.PROFILE_OUTPUT = output
+        start = time.perf_counter()
+        response = profiled_workload({'profile': 'all'}, Context())
+        enabled_seconds = time.perf_counter() - start
+
+        artifact_dir = os.path.join(output, 'bench', Context.aws_request_id)
+        artifacts = sorted(os.listdir(artifact_dir)) if os.path.isdir(artifact_dir) else []
+        with open(os.path.join(artifact_dir, 'summary.json')) as f:
+            summary = json.load(f)
+        profile_loads = bool(pstats.Stats(os.path.join(artifact_dir, 'profile.prof')).stats)
+
+    result = {
+        'benchmark': 'profiling_overhead',
+        'calls': args.calls,
+        'baseline_us': round(baseline * 1e6, 4),
+        'disabled_us': round(disabled * 1e6, 4),
+        'overhead_us': round(overhead_us, 4),
+        'max_overhead_us': args.max_overhead_us,
+        'enabled_seconds': round(enabled_seconds, 3),
+        'artifacts': artifacts,
+        'profile_loads': profile_loads,
+        'summary_has_hot_functions': bool(summary.get('top_cumulative')) and bool(summary.get('top_allocations')),
+        'handler_result_unchanged': response == workload({}, None),
+        'lambdas_hooked': hooked
+    }
+    print(json.dumps(result))
+
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=4)
+
+    if overhead_us > args.max_overhead_us:
+        raise SystemExit(f"Disabled profiling costs {overhead_us:.3f} us per call")
+    if not (profile_loads and result['summary_has_hot_functions'] and result['handler_result_unchanged']
+            and all(hooked.values())):
+        raise SystemExit("Profiling artifacts are incomplete or a handler is not hooked")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmark duplicate/linked report clustering over the full report_links table.
+
+Generates a synthetic extract for each --reports size and runs build_report_clusters on the
+whole report_links.txt (plus the reports.txt pass that resolves AER numbers). The clusters
+are checked against a breadth-first search of the same link graph, and the time per row
+read (links plus reports) is reported for every size so near-linear scaling can be read off.
+
+Usage: python benchmarks/bench_report_clusters.py --reports 100000,1000000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict, deque
+
+import _lambdas  # noqa: F401  (puts the lambda directory on sys.path)
+from report_clusters import build_report_clusters, clean_field
+from synthetic_extract import generate_extract
+
+
+def reference_clusters(report_links, reports):
+    """Connected components of the link graph by breadth-first search, as sorted AER lists."""
+    report_nos = {clean_field(line.split('$')[0]): clean_field(line.split('$')[1]) for line in reports}
+    graph = defaultdict(set)
+    for line in report_links:
+        fields = line.split('$')
+        source, target = report_nos[clean_field(fields[1])], clean_field(fields[4])
+        graph[source].add(target)
+        graph[target].add(source)
+
+    seen, components = set(), []
+    for start in graph:
+        if start in seen:
+            continue
+        seen.add(start)
+        component, queue = [], deque([start])
+        while queue:
+            node = queue.popleft()
+            component.append(node)
+            for neighbour in graph[node] - seen:
+                seen.add(neighbour)
+                queue.append(neighbour)
+        components.append(sorted(component))
+    return sorted(components)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reports', default='100000,1000000')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    results = []
+    for report_count in [int(size) for size in args.reports.split(',')]:
+        with tempfile.TemporaryDirectory() as extract_dir:
+            counts, _ = generate_extract(extract_dir, report_count, args.seed)
+            with open(os.path.join(extract_dir, 'report_links.txt'), encoding='utf-8') as f:
+                report_links = f.read().splitlines()
+            with open(os.path.join(extract_dir, 'reports.txt'), encoding='utf-8') as f:
+                reports = f.read().splitlines()
+
+        start = time.perf_counter()
+        clusters = build_report_clusters(report_links, reports)
+        seconds = time.perf_counter() - start
+
+        if sorted(clusters.members.values()) != reference_clusters(report_links, reports):
+            raise SystemExit(f"Clusters disagree with the breadth-first search at {report_count} reports")
+        sizes = [len(members) for members in clusters.members.values()]
+        result = {
+            'reports': report_count,
+            'link_rows': counts['report_links.txt'],
+            'clusters': len(sizes),
+            'clustered_reports': sum(sizes),
+            'largest_cluster': max(sizes, default=0),
+            'seconds': round(seconds, 3),
+            'us_per_row': round(seconds / (counts['report_links.txt'] + counts['reports.txt']) * 1e6, 2)
+        }
+        results.append(result)
+        print(json.dumps(result))
+
+    with open(args.output, 'w') as f:
+        json.dump({'benchmark': 'report_clusters', 'results': results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
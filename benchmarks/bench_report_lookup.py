@@ -0,0 +1,120 @@
+"""
+Benchmark single-report lookups through the report index against a full extract scan.
+
+Generates a synthetic extract, stores it on the local storage backend (or the S3 stand-in
+with --storage s3), builds the report index the way the ingest lambda does, then asks lambda-1
+for --lookups random reports by report_no. Each assembled record must equal the one
+extract_report_data builds from the full tables. Reports the lookup latency (index + range
+reads + assembly, excluding PDF rendering) and fails if its p95 exceeds --max-lookup-ms.
+
+Usage: python benchmarks/bench_report_lookup.py --reports 1000000 --lookups 50
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+
+from _lambdas import load_lambda
+from local_s3 import LocalS3Client
+from synthetic_extract import TABLES, generate_extract
+
+INPUT_BUCKET = 'cvp-input'
+OUTPUT_BUCKET = 'cvp-output'
+EXTRACT_PREFIX = 'Input_data/report_id_database/'
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reports', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=50)
+    parser.add_argument('--storage', choices=['local', 's3'], default='local')
+    parser.add_argument('--max-lookup-ms', type=float, default=1000)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        root = os.path.join(work_dir, 's3')
+        os.environ.update({'STORAGE_BACKEND': args.storage, 'STORAGE_ROOT': root, 'INPUT_BUCKET': INPUT_BUCKET,
+                           'OUTPUT_BUCKET': OUTPUT_BUCKET, 'METRICS_FORMAT': 'off'})
+        extract_dir = os.path.join(work_dir, 'extract')
+        counts, _ = generate_extract(extract_dir, args.reports, args.seed)
+
+        lambda_1 = load_lambda('lambda-1')
+        storage = __import__('storage')
+        if args.storage == 's3':
+            lambda_1.storage = storage.get_storage(LocalS3Client(root))
+        for table in TABLES:
+            lambda_1.storage.upload_file(os.path.join(extract_dir, table), INPUT_BUCKET, f"{EXTRACT_PREFIX}{table}")
+
+        report_index = __import__('report_index')
+        tables = {table[:-len('.txt')]: table for table in TABLES}
+        start = time.perf_counter()
+        manifest = report_index.build_report_index(
+            lambda_1.storage, INPUT_BUCKET, {name: os.path.join(extract_dir, table) for name, table in tables.items()},
+            {name: f"{EXTRACT_PREFIX}{table}" for name, table in tables.items()}, work_dir=work_dir)
+        index_seconds = time.perf_counter() - start
+
+        # Expected records from a full scan, as the batch pipeline would build them
+        rng = random.Random(args.seed)
+        sample_ids = [str(rng.randint(1, args.reports)) for _ in range(args.lookups)]
+        data = {name: open(os.path.join(extract_dir, table), encoding='utf-8').read().splitlines()
+                for name, table in tables.items()}
+        start = time.perf_counter()
+        expected = lambda_1.extract_report_data(set(sample_ids), data['reports'], data['reactions'],
+                                                data['report_drug_indication'], data['report_links'],
+                                                data['report_drug'])
+        scan_seconds = time.perf_counter() - start
+
+        lookup_seconds, total_seconds, mismatches = [], [], []
+        for report_id in sample_ids:
+            record = lambda_1.format_output_record(expected[report_id])
+            start = time.perf_counter()
+            actual, pdf_key, seconds = lambda_1.generate_single_report_pdf(record['report_no'])
+            total_seconds.append(time.perf_counter() - start)
+            lookup_seconds.append(seconds)
+            if actual != record or not lambda_1.storage.exists(OUTPUT_BUCKET, pdf_key):
+                mismatches.append(record['report_no'])
+
+        response = lambda_1.lambda_handler({'report_no': record['report_no']}, SimpleNamespace(aws_request_id='bench'))
+        missing = lambda_1.lambda_handler({'report_no': 'NOT-A-REPORT'}, SimpleNamespace(aws_request_id='bench'))
+
+    result = {
+        'benchmark': 'report_lookup',
+        'storage': args.storage,
+        'reports': args.reports,
+        'rows': counts,
+        'index_seconds': round(index_seconds, 3),
+        'index_reports': manifest['reports'],
+        'full_scan_seconds': round(scan_seconds, 3),
+        'lookups': args.lookups,
+        'lookup_ms_p50': round(statistics.median(lookup_seconds) * 1000, 2),
+        'lookup_ms_p95': round(percentile(lookup_seconds, 0.95) * 1000, 2),
+        'lookup_ms_max': round(max(lookup_seconds) * 1000, 2),
+        'with_render_ms_p50': round(statistics.median(total_seconds) * 1000, 2),
+        'mismatches': mismatches,
+        'handler_status': response['statusCode'],
+        'missing_report_status': missing['statusCode']
+    }
+    print(json.dumps(result))
+
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=4)
+
+    if mismatches or response['statusCode'] != 200 or missing['statusCode'] != 404:
+        raise SystemExit(f"Indexed lookups disagree with the full scan for {len(mismatches)} reports")
+    if result['lookup_ms_p95'] > args.max_lookup_ms:
+        raise SystemExit(f"Lookup p95 of {result['lookup_ms_p95']} ms is over {args.max_lookup_ms} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Filesystem-backed stand-in for the boto3 S3 client calls the lambdas make."""
+import io
+import shutil
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+from botocore.exceptions import ClientError
+from botocore.hooks import HierarchicalEmitter
+
+
+class LocalS3Client:
+    """
+    Stores s3://bucket/key as <root>/bucket/key. Implements the object, listing and multipart
+    calls used by the lambdas, with response shapes matching boto3's for the fields they read.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.meta = SimpleNamespace(events=HierarchicalEmitter())  # Lets RunMetrics.instrument() attach
+        self._uploads = {}
+
+    def _path(self, bucket, key):
+        return self.root / bucket / key
+
+    @staticmethod
+    def _not_found(operation, key):
+        return ClientError({'Error': {'Code': 'NoSuchKey', 'Message': f"{key} not found"}}, operation)
+
+    def get_object(self, Bucket, Key, Range=None):
+        path = self._path(Bucket, Key)
+        if not path.is_file():
+            raise self._not_found('GetObject', Key)
+        if Range:
+            start, _, end = Range[len('bytes='):].partition('-')
+            with open(path, 'rb') as f:
+                f.seek(int(start))
+                body = f.read(int(end) - int(start) + 1 if end else -1)
+            return {'Body': io.BytesIO(body), 'ContentLength': len(body)}
+        return {'Body': open(path, 'rb'), 'ContentLength': path.stat().st_size,
+                'LastModified': datetime.fromtimestamp(path.stat().st_mtime, timezone.utc)}
+
+    def head_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        if not path.is_file():
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        return {'ContentLength': path.stat().st_size}
+
+    def put_object(self, Bucket, Key, Body=b'', **kwargs):
+        path = self._path(Bucket, Key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        elif hasattr(Body, 'read'):
+            Body = Body.read()
+        path.write_bytes(Body)
+        return {'ETag': f'"{uuid.uuid4().hex}"'}
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(Filename, path)
+
+    def delete_object(self, Bucket, Key):
+        self._path(Bucket, Key).unlink(missing_ok=True)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix='', **kwargs):
+        bucket_dir = self.root / Bucket
+        contents = []
+        if bucket_dir.is_dir():
+            for path in sorted(bucket_dir.rglob('*')):
+                key = path.relative_to(bucket_dir).as_posix()
+                if path.is_file() and key.startswith(Prefix):
+                    stat = path.stat()
+                    contents.append({'Key': key, 'Size': stat.st_size,
+                                     'LastModified': datetime.fromtimestamp(stat.st_mtime_ns / 1e9, timezone.utc)})
+        return {'Contents': contents, 'KeyCount': len(contents)} if contents else {'KeyCount': 0}
+
+    def get_paginator(self, operation):
+        """Single-page paginator; listings are never truncated."""
+        return SimpleNamespace(paginate=lambda **kwargs: [getattr(self, operation)(**kwargs)])
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = uuid.uuid4().hex
+        self._uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self._uploads[UploadId][PartNumber] = bytes(Body)
+        return {'ETag': f'"{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self._uploads.pop(UploadId)
+        body = b''.join(parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+        return self.put_object(Bucket, Key, body)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self._uploads.pop(UploadId, None)
+        return {}
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn=3600):
+        return self._path(Params['Bucket'], Params['Key']).as_uri()
+
+
+class LocalSnsClient:
+    """Records SNS publish calls."""
+
+    def __init__(self):
+        self.meta = SimpleNamespace(events=HierarchicalEmitter())
+        self.messages = []
+
+    def publish(self, TopicArn, Message, Subject=None):
+        self.messages.append({'subject': Subject, 'message': Message})
+        return {'MessageId': f"local-{len(self.messages)}"}
+
+
+class LocalSesClient:
+    """Records SES send_email calls."""
+
+    def __init__(self):
+        self.meta = SimpleNamespace(events=HierarchicalEmitter())
+        self.messages = []
+
+    def send_email(self, Source, Destination, Message):
+        self.messages.append({'subject': Message['Subject']['Data'],
+                              'bytes': len(Message['Body']['Html']['Data'].encode('utf-8'))})
+        return {'MessageId': f"local-{len(self.messages)}"}
+
+
+class LocalSqsClient:
+    """Records SQS send_message calls; received_event() turns them into the event a queue trigger delivers."""
+
+    def __init__(self):
+        self.meta = SimpleNamespace(events=HierarchicalEmitter())
+        self.messages = []
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        self.messages.append(MessageBody)
+        return {'MessageId': f"local-{len(self.messages)}"}
+
+    def received_event(self):
+        return {'Records': [{'eventSource': 'aws:sqs', 'messageId': f"local-{idx}", 'body': body}
+                            for idx, body in enumerate(self.messages, start=1)]}
+
+
+class LocalLambdaClient:
+    """Records Lambda invoke calls without running anything."""
+
+    def __init__(self):
+        self.meta = SimpleNamespace(events=HierarchicalEmitter())
+        self.invocations = []
+
+    def invoke(self, FunctionName, InvocationType='RequestResponse', Payload=b''):
+        self.invocations.append({'function': FunctionName, 'type': InvocationType})
+        return {'StatusCode': 202, 'Payload': io.BytesIO(b'null')}
@@ -0,0 +1,211 @@
+"""
+Generate a synthetic Canada Vigilance extract in the real '$'-delimited, quoted format.
+
+Writes reports.txt, reactions.txt, report_links.txt, report_drug.txt and
+report_drug_indication.txt with the column layout lambda-1 reads. Categorical values,
+preferred terms, indications and drug names are seeded from the sample JSON files and
+extended with synthetic names; drug names and preferred terms follow a Zipf distribution and
+per-report drug, reaction and link counts follow the skewed shapes of the real extract.
+Output is streamed, so 10M-report extracts only need disk space.
+
+Usage: python benchmarks/synthetic_extract.py --reports 100000 --output-dir /tmp/extract
+"""
+import argparse
+import bisect
+import itertools
+import json
+import os
+import random
+import time
+from datetime import date, timedelta
+
+from _lambdas import REPO_DIR
+
+SAMPLE_DIR = REPO_DIR / "Samples" / "Reported Adverse Reaction .json samples"
+TABLES = ['reports.txt', 'reactions.txt', 'report_links.txt', 'report_drug.txt', 'report_drug_indication.txt']
+
+GENDERS = [('Female', 58), ('Male', 38), ('Unknown', 3), ('', 1)]
+AGE_UNITS = [('Years', 90), ('Months', 5), ('Days', 2), ('Decade', 1), ('', 2)]
+OUTCOMES = [('Recovered/resolved', 40), ('Unknown', 30), ('Recovering/resolving', 12),
+            ('Not recovered/not resolved', 12), ('Fatal', 4), ('Recovered with sequelae', 2)]
+SOURCES = [('Hospital', 30), ('Community', 45), ('MAH', 15), ('Clinical Study', 5), ('Other', 5)]
+REPORT_TYPES = [('Spontaneous', 92), ('Study', 6), ('Other', 2)]
+REPORTER_TYPES = [('Consumer/other non health professional', 35), ('Physician', 25),
+                  ('Other health professional', 20), ('Pharmacist', 12), ('Nurse', 6), ('', 2)]
+INVOLVEMENT = [('Suspect', 55), ('Concomitant', 45)]
+ROUTES = [('', 40), ('Oral', 30), ('Intravenous (not otherwise specified)', 15), ('Subcutaneous', 8),
+          ('Unknown', 5), ('Intramuscular', 2)]
+DOSAGE_FORMS = [('NOT SPECIFIED', 30), ('Tablets', 30), ('SOLUTION INTRAVENOUS', 15), ('Capsules', 10),
+                ('', 10), ('POWDER FOR SOLUTION INTRAVENOUS', 5)]
+DOSE_UNITS = [('', 45), ('Milligram', 30), ('Gram', 10), ('ml', 10), ('mg/kg', 5)]
+FREQUENCIES = [('', 60), ('1 every 1 Days', 20), ('Once', 10), ('1 every 4 Weeks', 5), ('Total', 5)]
+LINK_TYPES = [('Duplicate', 85), ('Linked', 15)]
+FLAG_RATES = {'death': 0.05, 'disability': 0.05, 'congenital_anomaly': 0.01, 'life_threatening': 0.08,
+              'hospitalization': 0.4, 'other_medically_imp_cond': 0.3}
+SYLLABLES = ['ab', 'ax', 'bel', 'cor', 'da', 'dex', 'fen', 'gal', 'hy', 'lo', 'mab', 'mel', 'nex', 'o',
+             'pan', 'pra', 'quin', 'ri', 'sol', 'tan', 'ta', 'vir', 'xa', 'zol']
+ORGANS = ['Cardiac', 'Renal', 'Hepatic', 'Pulmonary', 'Gastric', 'Cerebral', 'Skin', 'Muscle', 'Joint', 'Ocular',
+          'Vascular', 'Thyroid', 'Bone marrow', 'Pancreatic', 'Nerve']
+FINDINGS = ['pain', 'disorder', 'failure', 'haemorrhage', 'infection', 'inflammation', 'oedema', 'injury',
+            'neoplasm', 'dysfunction', 'enlargement', 'discomfort', 'necrosis', 'fibrosis']
+
+
+class WeightedChoice:
+    """random.choices with precomputed cumulative weights, for millions of draws."""
+
+    def __init__(self, values_and_weights):
+        self.values = [value for value, _ in values_and_weights]
+        self.cumulative = list(itertools.accumulate(weight for _, weight in values_and_weights))
+
+    def __call__(self, rng):
+        return self.values[bisect.bisect(self.cumulative, rng.random() * self.cumulative[-1])]
+
+
+def zipf_choice(values, exponent=1.1):
+    return WeightedChoice([(value, 1 / rank ** exponent) for rank, value in enumerate(values, start=1)])
+
+
+def sample_vocabulary():
+    """Distinct drug names, preferred terms and indications from the sample JSON files."""
+    drugs, pts, indications = set(), set(), set()
+    for path in sorted(SAMPLE_DIR.glob('*.json')):
+        for record in json.loads(path.read_text()):
+            drugs.update(value.strip() for value in record['drug_name'].split(', '))
+            pts.update(value.strip() for value in record['pt_name_eng'].split(', '))
+            indications.update(value.strip() for value in record['indication_eng'].split(', '))
+    return sorted(drugs - {''}), sorted(pts - {''}), sorted(indications - {''})
+
+
+def synthetic_names(rng, count, exclude):
+    names = []
+    seen = set(exclude)
+    while len(names) < count:
+        name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).upper()
+        if rng.random() < 0.3:
+            name += rng.choice([' XR', ' 10 MG', ' INJECTION', ' HCL'])
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+
+def quoted(value):
+    return f'"{value}"'
+
+
+def format_date(day):
+    return day.strftime('%d-%b-%y').upper()
+
+
+def generate_extract(output_dir, report_count, seed=7, drug_vocabulary=None, pt_vocabulary=None):
+    """
+    Write the five extract tables for report_count reports to output_dir.
+
+    :return: Dict of table name -> row count, plus the drug vocabulary (most frequent first)
+    """
+    rng = random.Random(seed)
+    sample_drugs, sample_pts, sample_indications = sample_vocabulary()
+    drug_vocabulary = drug_vocabulary or max(500, report_count // 20)
+    pt_vocabulary = pt_vocabulary or 2000
+    drugs = sample_drugs + synthetic_names(rng, max(0, drug_vocabulary - len(sample_drugs)), sample_drugs)
+    rng.shuffle(drugs)
+    pts = sample_pts + [f"{organ} {finding}" for organ in ORGANS for finding in FINDINGS]
+    pts += [f"{pt} {suffix}" for pt in pts for suffix in ('aggravated', 'acute', 'chronic')]
+    pts = pts[:pt_vocabulary]
+    rng.shuffle(pts)
+    indications = sample_indications + pts[:200]
+
+    pick = {name: WeightedChoice(values) for name, values in [
+        ('gender', GENDERS), ('age_unit', AGE_UNITS), ('outcome', OUTCOMES), ('source', SOURCES),
+        ('report_type', REPORT_TYPES), ('reporter_type', REPORTER_TYPES), ('involvement', INVOLVEMENT),
+        ('route', ROUTES), ('dosage_form', DOSAGE_FORMS), ('dose_unit', DOSE_UNITS),
+        ('frequency', FREQUENCIES), ('link_type', LINK_TYPES)]}
+    pick_drug, pick_pt, pick_indication = zipf_choice(drugs), zipf_choice(pts), zipf_choice(indications)
+    first_day = date(2015, 1, 1)
+
+    os.makedirs(output_dir, exist_ok=True)
+    files = {name: open(os.path.join(output_dir, name), 'w', encoding='utf-8', newline='\n') for name in TABLES}
+    counts = dict.fromkeys(TABLES, 0)
+    reaction_id = drug_id = link_id = 0
+    try:
+        for report_id in range(1, report_count + 1):
+            received = first_day + timedelta(days=rng.randrange(3650))
+            initial = received - timedelta(days=min(int(rng.expovariate(1 / 20)), 2000))
+            serious = rng.random() < 0.62
+            age_unit = pick['age_unit'](rng)
+            age = {'Years': max(0, int(rng.gauss(52, 20))), 'Months': rng.randint(1, 23), 'Days': rng.randint(1, 60),
+                   'Decade': rng.randint(1, 9), '': ''}[age_unit]
+            flags = [('1' if rng.random() < rate else '2') if serious else '' for rate in FLAG_RATES.values()]
+
+            fields = [''] * 40
+            fields[1:9] = [f"{report_id:09d}", str(rng.choice([0, 0, 0, 1, 2])), format_date(received),
+                           format_date(initial), f"E2B_{report_id:08d}" if rng.random() < 0.3 else '', '',
+                           pick['report_type'](rng), '']
+            fields[10], fields[12], fields[14] = pick['gender'](rng), str(age), age_unit
+            fields[17] = pick['outcome'](rng)
+            if rng.random() < 0.4:
+                fields[19:21] = [f"{rng.gauss(75, 15):.1f}", 'Kilogram']
+                fields[22:24] = [str(int(rng.gauss(168, 10))), 'Centimeter']
+            fields[26] = 'Serious' if serious else 'Not Serious'
+            fields[28:34] = flags
+            fields[34], fields[37] = pick['reporter_type'](rng), pick['source'](rng)
+            files['reports.txt'].write('$'.join([str(report_id)] + [quoted(value) for value in fields[1:]]) + '\n')
+            counts['reports.txt'] += 1
+
+            for _ in range(min(1 + int(rng.expovariate(1 / 1.5)), 30)):
+                reaction_id += 1
+                duration = str(rng.randint(1, 30)) if rng.random() < 0.2 else ''
+                files['reactions.txt'].write('$'.join([
+                    str(reaction_id), str(report_id), quoted(duration), quoted('Days' if duration else ''),
+                    quoted(''), quoted(pick_pt(rng)), quoted(''), quoted(''), quoted(''),
+                    quoted(f"v.{rng.choice([24, 25, 26, 27])}.{rng.choice([0, 1])}")]) + '\n')
+                counts['reactions.txt'] += 1
+
+            if rng.random() < 0.08:
+                for _ in range(rng.randint(1, 2)):
+                    link_id += 1
+                    files['report_links.txt'].write('$'.join([
+                        str(link_id), str(report_id), quoted(pick['link_type'](rng)), quoted(''),
+                        quoted(f"{rng.randint(1, report_count):09d}")]) + '\n')
+                    counts['report_links.txt'] += 1
+
+            for _ in range(min(1 + int(rng.expovariate(1 / 1.2)), 20)):
+                drug_id += 1
+                drug = pick_drug(rng)
+                drug_fields = [''] * 22
+                drug_fields[3], drug_fields[4] = drug, pick['involvement'](rng)
+                drug_fields[6], drug_fields[9] = pick['route'](rng), pick['dose_unit'](rng)
+                drug_fields[8] = str(rng.choice([1, 2, 5, 10, 20, 50, 100, 250, 500])) if drug_fields[9] else ''
+                drug_fields[15], drug_fields[20] = pick['frequency'](rng), pick['dosage_form'](rng)
+                if rng.random() < 0.15:
+                    drug_fields[17:19] = [str(rng.randint(1, 365)), 'Days']
+                files['report_drug.txt'].write('$'.join([str(drug_id), str(report_id), str(rng.randint(1, 99999))]
+                                                        + [quoted(value) for value in drug_fields[3:]]) + '\n')
+                counts['report_drug.txt'] += 1
+
+                if rng.random() < 0.7:
+                    files['report_drug_indication.txt'].write('$'.join([
+                        str(drug_id), str(report_id), str(rng.randint(1, 99999)), quoted(drug),
+                        quoted(pick_indication(rng)), quoted('')]) + '\n')
+                    counts['report_drug_indication.txt'] += 1
+    finally:
+        for f in files.values():
+            f.close()
+
+    return counts, drugs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reports', type=int, default=10000, help="Reports to generate (10k to 10M)")
+    parser.add_argument('--output-dir', required=True)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts, _ = generate_extract(args.output_dir, args.reports, args.seed)
+    print(json.dumps({'reports': args.reports, 'rows': counts, 'seconds': round(time.perf_counter() - start, 2)}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import csv
+import io
+
+import numpy as np
+import pandas as pd
+
+from drug_matcher import DrugNameMatcher
+
+# Columns of the extract tables used by the aggregates (same positions lambda-1 reads)
+REPORTS_COLUMNS = {0: 'report_id', 3: 'datreceived', 10: 'gender_eng', 12: 'age', 14: 'age_unit_eng',
+                   17: 'outcome_eng', 26: 'seriousness_eng'}
+REACTIONS_COLUMNS = {1: 'report_id', 5: 'pt_name_eng'}
+
+# Conversion of AGE_UNIT_ENG to years, and the age bands used for the summary
+AGE_UNIT_YEARS = {'years': 1.0, 'year': 1.0, 'decade': 10.0, 'months': 1 / 12, 'month': 1 / 12,
+                  'weeks': 1 / 52, 'week': 1 / 52, 'days': 1 / 365, 'day': 1 / 365, 'hours': 1 / 8760,
+                  'hour': 1 / 8760}
+AGE_BAND_EDGES = [0, 2, 12, 18, 65, 86, np.inf]
+AGE_BAND_LABELS = ['0-1', '2-11', '12-17', '18-64', '65-85', '86+']
+UNKNOWN = 'Unknown'
+TOP_PT_COUNT = 20
+
+
+def clean_column(values):
+    """
+    Vectorized clean_string plus strip(). Extract columns repeat a handful of values, so each
+    distinct value is cleaned once and the result broadcast back by its factorized code.
+    """
+    codes, uniques = pd.factorize(values)
+    cleaned = pd.Index(uniques).str.strip('"').str.replace('\\"', '', regex=False).str.strip()
+    return pd.Series(cleaned.take(codes), index=values.index)
+
+
+def read_table(lines, columns, report_ids=None):
+    """
+    Parse $-delimited extract lines into a DataFrame of the given columns, keeping only rows
+    whose report_id is in report_ids (every row if report_ids is None).
+
+    Fields are split on every '$' and cleaned like lambda-1's clean_string, so values match
+    the per-report JSON exactly. Short rows give empty strings and fields past the last
+    requested column are ignored, as with line.split('$'). The id column is cleaned and
+    filtered first so the other columns are only cleaned for matched rows.
+    """
+    frame = pd.read_csv(
+        io.StringIO("\n".join(lines)),
+        sep='$',
+        header=None,
+        names=range(max(columns) + 1),
+        usecols=list(columns),
+        index_col=False,
+        dtype=str,
+        quoting=csv.QUOTE_NONE,
+        keep_default_na=False,
+        on_bad_lines='skip',
+        engine='c'
+    )
+    frame = frame.rename(columns=columns)
+    frame['report_id'] = clean_column(frame['report_id'])
+    if report_ids is not None:
+        frame = frame[frame['report_id'].isin(report_ids)].copy()
+    for name in frame.columns.drop('report_id'):
+        frame[name] = clean_column(frame[name])
+    return frame
+
+
+def match_drugs(report_ids, drug_names, fuzzy_names=None):
+    """
+    Map each matched report to the watchlisted drug name(s) its report_drug rows matched.
+
+    :param report_ids: lambda-1's {REPORT_ID: [report_drug fields]} after source filtering
+    :param drug_names: The watchlist, lowercase
+    :param fuzzy_names: {DRUGNAME value: [watchlist names]} of lambda-1's fuzzy matches, if enabled
+    :return: DataFrame with columns report_id, drug
+    """
+    pairs = pd.DataFrame(
+        [(report_id, fields[3]) for report_id, rows in report_ids.items() for fields in rows],
+        columns=['report_id', 'drug_value']
+    )
+    pairs['drug_value'] = clean_column(pairs['drug_value']).str.lower()
+    pairs = pairs.merge(match_drug_values(pairs['drug_value'], drug_names, fuzzy_names), on='drug_value')
+    return pairs[['report_id', 'drug']].drop_duplicates()
+
+
+def match_drug_values(drug_values, drug_names, fuzzy_names=None):
+    """
+    Match each distinct (cleaned, lowercase) DRUGNAME value against the watchlist once.
+
+    :param fuzzy_names: {DRUGNAME value: [watchlist names]} of lambda-1's fuzzy matches, added to
+        the exact matches so reports lambda-1 matched fuzzily are counted too
+    :return: DataFrame with columns drug_value, drug; one row per (value, matched name)
+    """
+    matcher = DrugNameMatcher({'watchlist': drug_names})
+    watchlist = set(drug_names)
+    fuzzy_names = fuzzy_names or {}
+
+    def matched_names(value):
+        names = {name for _, name in matcher.match(value)}
+        names.update(name for name in fuzzy_names.get(value, ()) if name in watchlist)
+        return sorted(names)
+
+    distinct = pd.Series(drug_values.unique())
+    matched = pd.DataFrame({'drug_value': distinct, 'drug': distinct.map(matched_names)})
+    return matched.explode('drug').dropna()
+
+
+def add_age_band(reports):
+    unit_years = reports['age_unit_eng'].str.lower().map(AGE_UNIT_YEARS)
+    age_years = pd.to_numeric(reports['age'], errors='coerce') * unit_years
+    bands = pd.cut(age_years, bins=AGE_BAND_EDGES, labels=AGE_BAND_LABELS, right=False)
+    reports['age_band'] = bands.cat.add_categories([UNKNOWN]).fillna(UNKNOWN).astype(str)
+    return reports
+
+
+def add_month(reports):
+    # Parse each distinct date once; a release has a few thousand distinct DATRECEIVED values
+    codes, dates = pd.factorize(reports['datreceived'])
+    months = pd.to_datetime(pd.Index(dates), format='%d-%b-%y', errors='coerce').strftime('%Y-%m')
+    reports['month'] = pd.Index(months).fillna(UNKNOWN).take(codes)
+    return reports
+
+
+def count_by(frame, column):
+    """Return {drug: {value: count}} for one dimension."""
+    counts = frame.assign(**{column: frame[column].replace('', UNKNOWN)}).groupby(['drug', column]).size()
+    result = {}
+    for (drug, value), count in counts.items():
+        result.setdefault(drug, {})[value] = int(count)
+    return result
+
+
+def build_drug_aggregates(report_ids, drug_names, reports_content, reactions_content, top_pts=TOP_PT_COUNT,
+                          fuzzy_names=None):
+    """
+    Build per-drug aggregate tables over the matched reports.
+
+    :param report_ids: lambda-1's {REPORT_ID: [report_drug fields]} after source filtering
+    :param drug_names: The watchlist, lowercase
+    :param reports_content: Lines of reports.txt
+    :param reactions_content: Lines of reactions.txt
+    :param fuzzy_names: {DRUGNAME value: [watchlist names]} of lambda-1's fuzzy matches, if enabled
+    :return: Tuple of (summary dict keyed by drug, DataFrame in long form for CSV output)
+    """
+    drugs = match_drugs(report_ids, drug_names, fuzzy_names)
+    matched_ids = drugs['report_id'].unique()
+
+    reports = read_table(reports_content, REPORTS_COLUMNS, matched_ids).drop_duplicates('report_id', keep='last')
+    reports = add_month(add_age_band(reports))
+    reports = reports.merge(drugs, on='report_id')
+
+    reactions = read_table(reactions_content, REACTIONS_COLUMNS, matched_ids).merge(drugs, on='report_id')
+
+    report_counts = reports.groupby('drug')['report_id'].nunique()
+    dimensions = {
+        'seriousness_eng': count_by(reports, 'seriousness_eng'),
+        'outcome_eng': count_by(reports, 'outcome_eng'),
+        'gender_eng': count_by(reports, 'gender_eng'),
+        'age_band': count_by(reports, 'age_band'),
+        'reports_per_month': count_by(reports, 'month')
+    }
+
+    # Top preferred terms per drug, counted once per report
+    pt_counts = (reactions.drop_duplicates(['drug', 'report_id', 'pt_name_eng'])
+                 .groupby(['drug', 'pt_name_eng']).size().rename('count').reset_index()
+                 .sort_values(['drug', 'count', 'pt_name_eng'], ascending=[True, False, True]))
+    top_pt_table = pt_counts.groupby('drug').head(top_pts)
+
+    summary = {}
+    for drug in sorted(drugs['drug'].unique()):
+        summary[drug] = {'report_count': int(report_counts.get(drug, 0))}
+        for dimension, counts in dimensions.items():
+            summary[drug][dimension] = dict(sorted(counts.get(drug, {}).items()))
+        drug_pts = top_pt_table[top_pt_table['drug'] == drug]
+        summary[drug]['top_pt_name_eng'] = [{'pt_name_eng': pt, 'count': int(count)}
+                                            for pt, count in zip(drug_pts['pt_name_eng'], drug_pts['count'])]
+
+    # Long form for CSV: one row per (drug, dimension, value)
+    rows = []
+    for drug, tables in summary.items():
+        rows.append((drug, 'report_count', '', tables['report_count']))
+        for dimension in dimensions:
+            rows.extend((drug, dimension, value, count) for value, count in tables[dimension].items())
+        rows.extend((drug, 'top_pt_name_eng', pt['pt_name_eng'], pt['count']) for pt in tables['top_pt_name_eng'])
+    table = pd.DataFrame(rows, columns=['drug', 'dimension', 'value', 'count'])
+
+    return summary, table
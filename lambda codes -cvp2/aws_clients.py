@@ -0,0 +1,61 @@
+import os
+import threading
+
+# Connection settings for every AWS client, from environment variables
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv("AWS_MAX_POOL_CONNECTIONS", "32"))  # Covers the lambdas' thread pools
+AWS_CONNECT_TIMEOUT = int(os.getenv("AWS_CONNECT_TIMEOUT", "5"))
+AWS_RETRY_MODE = os.getenv("AWS_RETRY_MODE", "standard")
+
+# boto3's default session is not safe to build clients from concurrently
+_client_lock = threading.Lock()
+
+
+def make_client(service, **config):
+    """
+    Build a boto3 client with the shared connection settings.
+
+    :param config: botocore Config options that override the defaults, e.g. read_timeout
+    """
+    import boto3  # Imported on first use so init does not pay for it
+    from botocore.config import Config
+
+    settings = {
+        'max_pool_connections': AWS_MAX_POOL_CONNECTIONS,
+        'connect_timeout': AWS_CONNECT_TIMEOUT,
+        'retries': {'mode': AWS_RETRY_MODE},
+        'tcp_keepalive': True
+    }
+    settings.update(config)
+    with _client_lock:
+        return boto3.client(service, config=Config(**settings))
+
+
+class LazyClient:
+    """
+    Stands in for a boto3 client and builds it on first use, then keeps it for the life of the
+    container. Runs that never call a service never import boto3 or build its client.
+    """
+
+    def __init__(self, service, on_create=None, **config):
+        """
+        :param service: boto3 service name, e.g. 's3'
+        :param on_create: Called with the new client and returns the client to use (e.g. RunMetrics.instrument)
+        :param config: botocore Config overrides passed to make_client
+        """
+        self._service = service
+        self._on_create = on_create
+        self._config = config
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    client = make_client(self._service, **self._config)
+                    self._client = self._on_create(client) if self._on_create else client
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
@@ -0,0 +1,72 @@
+import json
+import logging
+import os
+import time
+
+# Checkpoint settings from environment variables. Checkpoints are off unless CHECKPOINTS=true: then
+# each lambda keeps its run's stage results under CHECKPOINT_PREFIX<function>/<run id>/ in its output
+# bucket (or CHECKPOINT_BUCKET), so a retried invocation with the same run id resumes after the last
+# completed stage, at the cost of writing those results to S3 on every run.
+CHECKPOINTS_ENABLED = os.getenv("CHECKPOINTS", "false").lower() == "true"
+CHECKPOINT_BUCKET = os.getenv("CHECKPOINT_BUCKET")
+CHECKPOINT_PREFIX = os.getenv("CHECKPOINT_PREFIX", "checkpoints/")
+
+
+class RunCheckpoints:
+    """
+    JSON checkpoints of one run's completed stages, written through the lambda's storage.
+
+    A stage's checkpoint is written only after the stage has finished, in one write (an S3
+    PUT, or a rename on local storage), so a run killed mid-stage leaves either the complete
+    checkpoint or none and the retry redoes just that stage.
+    """
+
+    def __init__(self, storage, bucket, function_name, run_id, prefix=CHECKPOINT_PREFIX):
+        self.storage = storage
+        self.bucket = bucket
+        self.function_name = function_name
+        self.run_id = run_id
+        self.prefix = f"{prefix}{function_name}/"
+        self.reused = []
+
+    def key(self, name):
+        """Key of a checkpoint (or of any other artifact the run keeps until it completes)."""
+        return f"{self.prefix}{self.run_id}/{name}"
+
+    def load(self, name):
+        """Return the checkpointed value of a stage, or None if the stage has not completed."""
+        key = self.key(f"{name}.json")
+        if not self.storage.exists(self.bucket, key):
+            return None
+        self.reused.append(name)
+        return json.loads(self.storage.read_bytes(self.bucket, key).decode('utf-8'))
+
+    def save(self, name, value):
+        self.storage.write(self.bucket, self.key(f"{name}.json"), json.dumps(value, separators=(',', ':')),
+                           'application/json')
+
+    def stage(self, name, compute):
+        """Return the stage's checkpointed value, or compute it and checkpoint the result."""
+        value = self.load(name)
+        if value is not None:
+            logging.info(f"Resuming run {self.run_id}: reusing the '{name}' checkpoint.")
+            return value
+        value = compute()
+        self.save(name, value)
+        return value
+
+    def run_timestamp(self):
+        """Timestamp of the run's first attempt, so retried runs write to the same output keys."""
+        return self.stage('run', lambda: {'timestamp': time.strftime('%d_%b_%Y_%H_%M_%S')})['timestamp']
+
+    def clear(self):
+        """Delete the run's checkpoints once it has completed."""
+        for obj in self.storage.list(self.bucket, f"{self.prefix}{self.run_id}/"):
+            self.storage.delete(self.bucket, obj['Key'])
+
+
+def open_checkpoints(storage, bucket, function_name, run_id):
+    """Return the RunCheckpoints of run_id, or None when checkpoints are off or the run has no id to resume by."""
+    if not CHECKPOINTS_ENABLED or not run_id:
+        return None
+    return RunCheckpoints(storage, CHECKPOINT_BUCKET or bucket, function_name, run_id)
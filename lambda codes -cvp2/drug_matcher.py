@@ -0,0 +1,69 @@
+from collections import deque
+
+
+class DrugNameMatcher:
+    """
+    Finds every watchlisted drug name that occurs as a substring of a DRUGNAME value.
+
+    All names from all watchlists are compiled into one Aho-Corasick automaton, so a value
+    is scanned once no matter how many names or tenants there are. Results are memoized
+    per distinct value, because report_drug.txt repeats the same DRUGNAME many times.
+    """
+
+    def __init__(self, watchlists):
+        """
+        :param watchlists: Dict of tenant -> iterable of lowercase drug names
+        """
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [set()]  # node -> set of (tenant, name) ending at that node
+        self._cache = {}
+
+        for tenant, names in watchlists.items():
+            for name in names:
+                self._add(name, (tenant, name))
+        self._build_failure_links()
+
+    def _add(self, name, tag):
+        node = 0
+        for char in name:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(set())
+            node = next_node
+        self._output[node].add(tag)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] |= self._output[self._fail[child]]
+
+    def match(self, value):
+        """Return a frozenset of (tenant, name) pairs whose name occurs in value."""
+        cached = self._cache.get(value)
+        if cached is not None:
+            return cached
+
+        found = set()
+        node = 0
+        for char in value:
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            if self._output[node]:
+                found |= self._output[node]
+
+        result = frozenset(found)
+        self._cache[value] = result
+        return result
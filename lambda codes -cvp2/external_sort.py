@@ -0,0 +1,91 @@
+import heapq
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+# Rough per-record overhead of a buffered (key, seq, values) tuple in CPython, in bytes
+RECORD_OVERHEAD_BYTES = 200
+# Maximum number of run files read at once; more runs are first merged into larger runs
+MAX_MERGE_FAN_IN = 64
+
+
+class SpillingSortBuffer:
+    """
+    Collects (key, seq, values) records and returns them sorted by (key, seq).
+
+    Records are kept in memory until their estimated size crosses memory_budget bytes; the
+    buffer is then sorted and written to a run file. merged() combines the run files and
+    whatever is still in memory with a k-way merge, so only one record per run is held at a time.
+    """
+
+    def __init__(self, memory_budget, spill_dir='/tmp'):
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.run_paths = []
+        self._records = []
+        self._size = 0
+        self._run_dir = None
+        self._run_count = 0
+
+    def add(self, key, seq, values):
+        self._records.append((key, seq, values))
+        self._size += RECORD_OVERHEAD_BYTES + len(key) + sum(len(value) for value in values)
+        if self._size > self.memory_budget:
+            self.spill()
+
+    def spill(self):
+        """Sort the in-memory records and write them to a new run file."""
+        if not self._records:
+            return
+        if self._run_dir is None:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self._run_dir = tempfile.mkdtemp(prefix='cvp_spill_', dir=self.spill_dir)
+
+        self._records.sort(key=lambda record: (record[0], record[1]))
+        path = self._write_run(self._records)
+        logging.info(f"Spilled {len(self._records)} records ({self._size} bytes) to {path}")
+
+        self.run_paths.append(path)
+        self._records = []
+        self._size = 0
+
+    def _write_run(self, records):
+        path = os.path.join(self._run_dir, f"run_{self._run_count:05d}.jsonl")
+        self._run_count += 1
+        with open(path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(',', ':')))
+                f.write('\n')
+        return path
+
+    @staticmethod
+    def _read_run(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                key, seq, values = json.loads(line)
+                yield key, seq, values
+
+    def merged(self):
+        """Yield every record in (key, seq) order."""
+        # Merge the oldest runs into larger ones until few enough remain to open together
+        while len(self.run_paths) > MAX_MERGE_FAN_IN:
+            batch, self.run_paths = self.run_paths[:MAX_MERGE_FAN_IN], self.run_paths[MAX_MERGE_FAN_IN:]
+            runs = [self._read_run(path) for path in batch]
+            self.run_paths.append(self._write_run(heapq.merge(*runs, key=lambda record: (record[0], record[1]))))
+            for path in batch:
+                os.remove(path)
+
+        self._records.sort(key=lambda record: (record[0], record[1]))
+        runs = [self._read_run(path) for path in self.run_paths] + [iter(self._records)]
+        yield from heapq.merge(*runs, key=lambda record: (record[0], record[1]))
+
+    def cleanup(self):
+        """Delete the run files."""
+        if self._run_dir is not None:
+            shutil.rmtree(self._run_dir, ignore_errors=True)
+            self._run_dir = None
+        self.run_paths = []
+        self._records = []
+        self._size = 0
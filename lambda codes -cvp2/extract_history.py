@@ -0,0 +1,306 @@
+import bisect
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from report_index import ID_COLUMNS, REPORT_INDEX_READ_WORKERS, ReportIndex, build_report_index, clean_id, \
+    coalesce_ranges
+
+# Extract history settings from environment variables. The first recorded extract is kept in full
+# (with a report index) under v00001/, every later one as per-table deltas under v<version>/.
+EXTRACT_HISTORY_PREFIX = os.getenv("EXTRACT_HISTORY_PREFIX", "Input_data/extract_history/")
+DIGEST_SIZE = 8  # Bytes of the blake2b digest kept per report and table to detect changed reports
+# Up to this many reports are range-read through the first version's report index; more are filtered
+# from a scan of the table, which is cheaper than loading most of the index shards
+EXTRACT_HISTORY_INDEXED_READ_MAX = int(os.getenv("EXTRACT_HISTORY_INDEXED_READ_MAX", "64"))
+
+
+def version_prefix(prefix, version):
+    return f"{prefix}v{version:05d}/"
+
+
+def iter_report_blocks(path, id_column):
+    """
+    Yield (report_id, rows) for the rows of a local extract table, where rows are the bytes of
+    consecutive rows of one report. Rows lambda-1 skips (fewer than two fields) are left out.
+    """
+    current, rows = None, []
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.rstrip(b'\r\n')
+            fields = line.split(b'$', id_column + 1)
+            if len(fields) <= max(id_column, 1):
+                continue
+            report_id = clean_id(fields[id_column].decode('utf-8'))
+            if report_id != current:
+                if current is not None:
+                    yield current, b''.join(rows)
+                current, rows = report_id, []
+            rows.append(line + b'\n')
+    if current is not None:
+        yield current, b''.join(rows)
+
+
+def table_digests(path, id_column):
+    """Return {report_id: digest of all its rows} for a local extract table."""
+    digests = {}
+    for report_id, rows in iter_report_blocks(path, id_column):
+        digests[report_id] = hashlib.blake2b(digests.get(report_id, b'') + rows, digest_size=DIGEST_SIZE).digest()
+    return digests
+
+
+def write_digests(storage, bucket, key, digests):
+    body = ''.join(f"{report_id}\t{digest.hex()}\n" for report_id, digest in digests.items())
+    storage.write(bucket, key, gzip.compress(body.encode('utf-8')), 'application/gzip')
+
+
+def read_digests(storage, bucket, key):
+    digests = {}
+    for line in gzip.decompress(storage.read_bytes(bucket, key)).decode('utf-8').splitlines():
+        report_id, digest = line.split('\t')
+        digests[report_id] = bytes.fromhex(digest)
+    return digests
+
+
+def load_manifest(storage, bucket, prefix=EXTRACT_HISTORY_PREFIX):
+    """Return the history manifest, {"versions": [...]}, or an empty one if nothing is recorded yet."""
+    key = f"{prefix}manifest.json"
+    if not storage.exists(bucket, key):
+        return {'versions': []}
+    return json.loads(storage.read_bytes(bucket, key).decode('utf-8'))
+
+
+def record_extract(storage, bucket, table_paths, extract_date, prefix=EXTRACT_HISTORY_PREFIX, work_dir=None):
+    """
+    Add an extract to the history as its next version.
+
+    The first version stores the tables in full, indexed with build_report_index. Later versions
+    store, per table, only the rows of reports that were added or changed since the previous
+    version, grouped by report, plus an index.json of {table: {"reports": {report_id: [start, end]},
+    "removed": [report_id, ...]}}. Changes are found by comparing per-report digests with those
+    kept for the previous version. manifest.json is written last, so a version is only visible
+    once complete, and an interrupted recording is simply redone.
+
+    :param table_paths: Dict of table name (see report_index.ID_COLUMNS) -> local path of the table
+    :param extract_date: Date of the extract, 'YYYY-MM-DD'
+    :return: The new version's manifest entry, or None if the history already has an extract this recent
+    """
+    record_start = time.time()
+    manifest = load_manifest(storage, bucket, prefix)
+    versions = manifest['versions']
+    if versions and versions[-1]['extract_date'] >= extract_date:
+        logging.info(f"The extract of {extract_date} is not newer than version {versions[-1]['version']}; "
+                     f"not recorded.")
+        return None
+
+    version = len(versions) + 1
+    current_prefix = version_prefix(prefix, version)
+    entry = {'version': version, 'extract_date': extract_date, 'tables': {}}
+
+    if version == 1:
+        table_keys = {table: f"{current_prefix}{table}.txt" for table in table_paths}
+        for table, path in table_paths.items():
+            storage.upload_file(path, bucket, table_keys[table])
+            digests = table_digests(path, ID_COLUMNS[table])
+            write_digests(storage, bucket, f"{current_prefix}digests/{table}.tsv.gz", digests)
+            entry['tables'][table] = {'reports': len(digests), 'bytes': os.path.getsize(path)}
+        build_report_index(storage, bucket, table_paths, table_keys, prefix=f"{current_prefix}index/",
+                           work_dir=work_dir)
+    else:
+        previous = versions[-1]
+        delta_index = {}
+        for table in previous['tables']:
+            digests_key = f"{version_prefix(prefix, previous['version'])}digests/{table}.tsv.gz"
+            path = table_paths.get(table)
+            if path is None:
+                # A table missing from this extract is kept as it was
+                storage.write(bucket, f"{current_prefix}digests/{table}.tsv.gz",
+                              storage.read_bytes(bucket, digests_key), 'application/gzip')
+                entry['tables'][table] = dict(previous['tables'][table], added=0, changed=0, removed=0, bytes=0)
+                continue
+            previous_digests = read_digests(storage, bucket, digests_key)
+            digests = table_digests(path, ID_COLUMNS[table])
+            changed = {report_id for report_id, digest in digests.items() if previous_digests.get(report_id) != digest}
+            removed = [report_id for report_id in previous_digests if report_id not in digests]
+
+            # Collect the changed reports' rows, grouped by report in order of first appearance
+            blocks = {}
+            for report_id, rows in iter_report_blocks(path, ID_COLUMNS[table]):
+                if report_id in changed:
+                    blocks.setdefault(report_id, []).append(rows)
+            reports, body, offset = {}, [], 0
+            for report_id, report_blocks in blocks.items():
+                rows = b''.join(report_blocks)
+                reports[report_id] = [offset, offset + len(rows)]
+                body.append(rows)
+                offset += len(rows)
+
+            storage.write(bucket, f"{current_prefix}{table}.delta.txt", b''.join(body), 'text/plain')
+            write_digests(storage, bucket, f"{current_prefix}digests/{table}.tsv.gz", digests)
+            delta_index[table] = {'reports': reports, 'removed': removed}
+            entry['tables'][table] = {
+                'reports': len(digests),
+                'added': sum(1 for report_id in changed if report_id not in previous_digests),
+                'changed': sum(1 for report_id in changed if report_id in previous_digests),
+                'removed': len(removed),
+                'bytes': offset
+            }
+        storage.write(bucket, f"{current_prefix}index.json", json.dumps(delta_index, separators=(',', ':')),
+                      'application/json')
+
+    entry['recorded_at'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    versions.append(entry)
+    storage.write(bucket, f"{prefix}manifest.json", json.dumps(manifest, indent=4), 'application/json')
+
+    # Only the latest version's digests are needed to record the next one
+    if version > 1:
+        for obj in storage.list(bucket, f"{version_prefix(prefix, version - 1)}digests/"):
+            storage.delete(bucket, obj['Key'])
+    logging.info(f"Recorded the extract of {extract_date} as version {version} "
+                 f"in {time.time() - record_start:.2f} seconds.")
+    return entry
+
+
+def resolve_version(versions, as_of):
+    """
+    Return the manifest entry of the extract in effect as of as_of: a version number, or a date
+    ('YYYY-MM-DD') for the latest extract dated on or before it.
+    """
+    as_of = str(as_of).strip()
+    if as_of.isdigit():
+        matching = [entry for entry in versions if entry['version'] == int(as_of)]
+    else:
+        matching = [entry for entry in versions if entry['extract_date'] <= as_of]
+    if not matching:
+        raise ValueError(f"No extract is recorded as of {as_of}")
+    return matching[-1]
+
+
+class ExtractSnapshot:
+    """
+    Reads the extract tables as they were in one recorded version of the history.
+
+    Rows come from the full first version, overlaid with the reports added, changed or removed
+    by every later version up to this one. The delta indexes up to this version are loaded up
+    front; delta rows and the first version's report index are read on first use.
+    """
+
+    def __init__(self, storage, bucket, as_of, prefix=EXTRACT_HISTORY_PREFIX):
+        self.storage = storage
+        self.bucket = bucket
+        self.prefix = prefix
+        self.entry = resolve_version(load_manifest(storage, bucket, prefix)['versions'], as_of)
+        self.version = self.entry['version']
+        self.extract_date = self.entry['extract_date']
+        self.fingerprint = f"v{self.version:05d}-{self.entry['recorded_at']}"
+
+        with ThreadPoolExecutor(max_workers=REPORT_INDEX_READ_WORKERS) as executor:
+            self.delta_indexes = dict(zip(range(2, self.version + 1), executor.map(
+                lambda version: json.loads(storage.read_bytes(
+                    bucket, f"{version_prefix(prefix, version)}index.json").decode('utf-8')),
+                range(2, self.version + 1))))
+        self._overlays = {}
+        self._deltas = {}
+        self._report_index = None
+        self._lock = threading.Lock()
+
+    def base_key(self, table):
+        return f"{version_prefix(self.prefix, 1)}{table}.txt"
+
+    def _overlay(self, table):
+        """{report_id: (version, [start, end]) or None if removed}, latest version winning, in order of first change."""
+        if table not in self._overlays:
+            overlay = {}
+            for version, delta_index in self.delta_indexes.items():
+                table_index = delta_index.get(table, {'reports': {}, 'removed': []})
+                for report_id in table_index['removed']:
+                    overlay[report_id] = None
+                for report_id, span in table_index['reports'].items():
+                    overlay[report_id] = (version, span)
+            self._overlays[table] = overlay
+        return self._overlays[table]
+
+    def _overlay_rows(self, table, change):
+        if change is None:
+            return []
+        version, (start, end) = change
+        if (version, table) not in self._deltas:
+            self._deltas[version, table] = self.storage.read_bytes(
+                self.bucket, f"{version_prefix(self.prefix, version)}{table}.delta.txt")
+        return self._deltas[version, table][start:end].decode('utf-8').splitlines()
+
+    def read_table(self, table):
+        """Return every line of table as of this version (the rows of a changed report are kept together)."""
+        return self._scan_table(table)
+
+    def _scan_table(self, table, wanted=None):
+        """Scan the first version's table, swapping in changed reports; only wanted reports' rows if given."""
+        base_lines = self.storage.read_lines(self.bucket, self.base_key(table))
+        overlay = self._overlay(table)
+        if not overlay and wanted is None:
+            return base_lines
+
+        id_column = ID_COLUMNS[table]
+        lines, seen = [], set()
+        for line in base_lines:
+            fields = line.split('$', id_column + 1)
+            report_id = clean_id(fields[id_column]) if len(fields) > max(id_column, 1) else None
+            if wanted is not None and report_id not in wanted:
+                continue
+            if report_id not in overlay:
+                lines.append(line)
+            elif report_id not in seen:
+                seen.add(report_id)
+                lines.extend(self._overlay_rows(table, overlay[report_id]))
+        # Reports that are not in the first version follow, in the order they were added
+        for report_id, change in overlay.items():
+            if report_id not in seen and (wanted is None or report_id in wanted):
+                lines.extend(self._overlay_rows(table, change))
+        return lines
+
+    def read_rows(self, table, report_ids):
+        """
+        Return only the lines of table that belong to report_ids, as of this version, in the
+        order read_table would return them. A few reports' rows of the first version are
+        range-read through its report index, with nearby ranges fetched together; for more
+        than EXTRACT_HISTORY_INDEXED_READ_MAX reports the table is scanned and filtered.
+        """
+        report_ids = set(report_ids)
+        if len(report_ids) > EXTRACT_HISTORY_INDEXED_READ_MAX:
+            return self._scan_table(table, report_ids)
+
+        with self._lock:
+            if self._report_index is None:
+                self._report_index = ReportIndex(self.storage, self.bucket, f"{version_prefix(self.prefix, 1)}index/")
+        overlay = self._overlay(table)
+        added_order = {report_id: position for position, report_id in enumerate(overlay)}
+
+        placed, base_reads = [], []
+        for report_id in report_ids:
+            base_ranges = (self._report_index.ranges(report_id) or {}).get(table)
+            position = (0, base_ranges[0][0]) if base_ranges else (1, added_order.get(report_id, 0))
+            if report_id in overlay:
+                placed.append((position, self._overlay_rows(table, overlay[report_id])))
+            elif base_ranges:
+                rows = []
+                placed.append((position, rows))
+                base_reads.append((base_ranges, rows))
+
+        spans = coalesce_ranges([span for ranges, _ in base_reads for span in ranges])
+        key = self.base_key(table)
+        with ThreadPoolExecutor(max_workers=REPORT_INDEX_READ_WORKERS) as executor:
+            bodies = list(executor.map(lambda span: self.storage.read_range(self.bucket, key, *span), spans))
+        span_starts = [span[0] for span in spans]
+        for ranges, rows in base_reads:
+            for start, end in ranges:
+                span_index = bisect.bisect_right(span_starts, start) - 1
+                offset = spans[span_index][0]
+                rows.extend(bodies[span_index][start - offset:end - offset].decode('utf-8').splitlines())
+
+        placed.sort(key=lambda item: item[0])
+        return [line for _, rows in placed for line in rows]
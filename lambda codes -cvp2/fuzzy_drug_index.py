@@ -0,0 +1,123 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+
+# Fuzzy matching settings from environment variables
+FUZZY_MATCH_THRESHOLD = float(os.getenv("FUZZY_MATCH_THRESHOLD", "0.85"))  # Verified score a hit needs
+# Share of a watchlist name's trigrams a DRUGNAME must contain to be verified at all
+FUZZY_CANDIDATE_THRESHOLD = float(os.getenv("FUZZY_CANDIDATE_THRESHOLD", "0.5"))
+
+# Salt and hydrate words dropped before comparing, so "metformin hcl" meets "METFORMIN HYDROCHLORIDE"
+SALT_WORDS = {
+    'hydrochloride', 'hcl', 'dihydrochloride', 'hydrobromide', 'hbr', 'sodium', 'disodium', 'potassium',
+    'calcium', 'magnesium', 'sulfate', 'sulphate', 'maleate', 'mesylate', 'besylate', 'tartrate', 'citrate',
+    'acetate', 'phosphate', 'succinate', 'fumarate', 'bromide', 'hyclate', 'monohydrate', 'dihydrate', 'trihydrate'
+}
+NON_ALNUM = re.compile(r'[^0-9a-z]+')
+
+
+def normalize_drug_name(value):
+    """Lowercase, turn punctuation runs into single spaces and drop salt words (unless nothing else is left)."""
+    words = NON_ALNUM.sub(' ', value.lower()).split()
+    kept = [word for word in words if word not in SALT_WORDS]
+    return ' '.join(kept or words)
+
+
+def trigrams(text):
+    """Distinct trigrams of text padded with a space on each side, so word boundaries count."""
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_similarity(a, b):
+    """1 - (edits to turn a into b) / longer length, where an edit inserts, deletes, substitutes or swaps adjacent letters."""
+    if a == b:
+        return 1.0
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+    return 1 - current[-1] / max(len(a), len(b))
+
+
+def similarity(query, name):
+    """
+    Score how well query (a normalized watchlist name) occurs in name (a normalized DRUGNAME), 0 to 1.
+
+    Compares the query with every run of words in name that is one word shorter, as long or one
+    word longer, both as written and with the spaces removed, and returns the best edit_similarity.
+    """
+    query_words, words = query.split(), name.split()
+    spaceless = query.replace(' ', '')
+    best = 0.0
+    for size in range(max(1, len(query_words) - 1), len(query_words) + 2):
+        for start in range(max(1, len(words) - size + 1)):
+            window = words[start:start + size]
+            best = max(best, edit_similarity(query, ' '.join(window)), edit_similarity(spaceless, ''.join(window)))
+            if best == 1.0:
+                return best
+    return best
+
+
+class FuzzyDrugIndex:
+    """
+    Trigram index over the distinct DRUGNAME values of one extract.
+
+    Distinct values are few compared with report_drug.txt rows and are grouped by their
+    normalized form, so a lookup only touches the posting lists of the query's trigrams
+    and never the rows. Candidates sharing enough trigrams are verified with similarity().
+    """
+
+    def __init__(self, names, values):
+        """
+        :param names: Distinct normalized names
+        :param values: For each name, the DRUGNAME values (as lambda-1 lowercases them) that normalize to it
+        """
+        self.names = names
+        self.values = values
+        self.postings = {}
+        for name_id, name in enumerate(names):
+            for gram in trigrams(name):
+                self.postings.setdefault(gram, []).append(name_id)
+
+    @classmethod
+    def build(cls, drug_values):
+        """Build the index from an iterable of DRUGNAME values (duplicates are fine)."""
+        grouped = {}
+        for value in set(drug_values):
+            grouped.setdefault(normalize_drug_name(value), []).append(value)
+        names = sorted(grouped)
+        return cls(names, [sorted(grouped[name]) for name in names])
+
+    def to_json(self):
+        return json.dumps({'names': self.names, 'values': self.values}, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, body):
+        data = json.loads(body)
+        return cls(data['names'], data['values'])
+
+    def lookup(self, name, threshold=FUZZY_MATCH_THRESHOLD, candidate_threshold=FUZZY_CANDIDATE_THRESHOLD):
+        """
+        Return [(DRUGNAME value, score)] for every value that fuzzily contains name, best first.
+        """
+        query = normalize_drug_name(name)
+        grams = trigrams(query)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+
+        needed = math.ceil(candidate_threshold * len(grams))
+        hits = []
+        for name_id, count in shared.items():
+            if count < needed:
+                continue
+            score = similarity(query, self.names[name_id])
+            if score >= threshold:
+                hits.extend((value, round(score, 3)) for value in self.values[name_id])
+        return sorted(hits, key=lambda hit: (-hit[1], hit[0]))
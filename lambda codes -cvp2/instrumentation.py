@@ -0,0 +1,180 @@
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Metric settings from environment variables
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "CVP2")
+# 'emf' prints CloudWatch embedded metric format records, 'json' plain JSON lines, 'off' nothing.
+# Inside Lambda the default is 'emf', so CloudWatch turns the log lines into metrics.
+METRICS_FORMAT = os.getenv("METRICS_FORMAT", "emf" if os.getenv("AWS_LAMBDA_FUNCTION_NAME") else "json")
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2 ** 20 if sys.platform == 'darwin' else 1024), 1)  # bytes on macOS, KiB on Linux
+
+
+def metric_unit(name):
+    if name.endswith('seconds'):
+        return 'Seconds'
+    if name.startswith('bytes'):
+        return 'Bytes'
+    if name.endswith('_mb'):
+        return 'Megabytes'
+    return 'Count'
+
+
+def request_size(body):
+    """Length of a request Body: bytes, str, or a seekable file object (botocore wraps bytes in one)."""
+    if isinstance(body, str):
+        return len(body.encode('utf-8'))
+    if isinstance(body, (bytes, bytearray)):
+        return len(body)
+    try:
+        position = body.tell()
+        body.seek(0, os.SEEK_END)
+        size = body.tell() - position
+        body.seek(position)
+        return size
+    except (AttributeError, OSError, TypeError, ValueError):
+        return 0
+
+
+def rounded(values):
+    return {name: round(value, 4) if isinstance(value, float) else value for name, value in values.items()}
+
+
+class Stage:
+    """Counters for one timed stage; extra values are added with add()."""
+
+    def __init__(self, name, counters):
+        self.name = name
+        self.counters = dict(counters)
+
+    def add(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+
+class RunMetrics:
+    """
+    Per-run performance metrics for one Lambda function.
+
+    Stages are timed with `with metrics.stage(name, rows_in=...) as stage:` and record rows
+    in/out, bytes read/written, peak RSS and the AWS calls made while they ran. Clients passed
+    to instrument() are counted automatically, including S3 object bytes. Every stage is
+    emitted as one metric record when it ends; emit_summary() emits the run totals and returns
+    them as a dict for the handler's response.
+    """
+
+    def __init__(self, function_name, namespace=METRICS_NAMESPACE, output_format=METRICS_FORMAT):
+        self.function_name = function_name
+        self.namespace = namespace
+        self.output_format = output_format
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, run_id=None):
+        """Start a new run; warm Lambda containers reuse the module-level instance."""
+        self.run_id = run_id
+        self.stages = []
+        self.totals = {}
+        self.aws_calls = {}
+        self._active = None
+        self._start = time.perf_counter()
+
+    def add(self, name, value):
+        """Add to a counter of the active stage (if any) and of the run."""
+        with self._lock:
+            if self._active is not None:
+                self._active.add(name, value)
+            self.totals[name] = self.totals.get(name, 0) + value
+
+    @contextmanager
+    def stage(self, name, **counters):
+        stage = Stage(name, counters)
+        previous, self._active = self._active, stage
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            self._active = previous
+            stage.counters['seconds'] = round(time.perf_counter() - start, 4)
+            stage.counters['peak_rss_mb'] = peak_rss_mb()
+            if tracemalloc.is_tracing():
+                # Python heap peak of this stage alone; only when a benchmark or profile traces memory
+                stage.counters['traced_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+            self.stages.append({'stage': name, **rounded(stage.counters)})
+            self.emit(name, stage.counters)
+
+    def instrument(self, client):
+        """Count calls, latency and S3 object bytes for a boto3 client. Returns the client."""
+        events = client.meta.events
+        events.register('before-parameter-build', self._before_parameter_build)
+        events.register_first('before-call', self._before_call)
+        events.register('after-call', self._after_call)
+        return client
+
+    def _before_parameter_build(self, params, model, **kwargs):
+        if model.name in ('PutObject', 'UploadPart'):
+            self.add('bytes_written', request_size(params.get('Body')))
+
+    def _before_call(self, context, **kwargs):
+        context['metrics_start'] = time.perf_counter()
+
+    def _after_call(self, parsed, model, context, **kwargs):
+        start = context.get('metrics_start')
+        seconds = time.perf_counter() - start if start is not None else 0.0
+        service = model.service_model.service_name
+        with self._lock:
+            call = self.aws_calls.setdefault(f"{service}.{model.name}", {'calls': 0, 'seconds': 0.0})
+            call['calls'] += 1
+            call['seconds'] += seconds
+        self.add(f'{service}_calls', 1)
+        self.add(f'{service}_seconds', seconds)
+        if model.name == 'GetObject':
+            self.add('bytes_read', parsed.get('ContentLength') or 0)
+
+    def emit(self, stage_name, values):
+        """Print one metric record: EMF for CloudWatch, or a plain JSON line."""
+        if self.output_format == 'off':
+            return
+        values = rounded(values)
+        record = {'Function': self.function_name, 'Stage': stage_name, 'RunId': self.run_id, **values}
+        if self.output_format == 'emf':
+            record['_aws'] = {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['Function', 'Stage']],
+                    'Metrics': [{'Name': name, 'Unit': metric_unit(name)} for name in values]
+                }]
+            }
+        print(json.dumps(record), flush=True)
+
+    def summary(self):
+        """Run totals, per-stage records and per-operation AWS call stats."""
+        totals = rounded(self.totals)
+        return {
+            'function': self.function_name,
+            'run_id': self.run_id,
+            'seconds': round(time.perf_counter() - self._start, 4),
+            'peak_rss_mb': peak_rss_mb(),
+            'totals': totals,
+            'stages': self.stages,
+            'aws_calls': {operation: {'calls': call['calls'], 'seconds': round(call['seconds'], 4)}
+                          for operation, call in sorted(self.aws_calls.items())}
+        }
+
+    def emit_summary(self):
+        """Emit the run totals as a 'run' record and return the summary."""
+        summary = self.summary()
+        self.emit('run', {'seconds': summary['seconds'], 'peak_rss_mb': summary['peak_rss_mb'], **summary['totals']})
+        return summary
@@ -1,4 +1,3 @@
-import boto3
 import json
 import logging
 from collections import defaultdict
@@ -6,15 +5,29 @@ import time
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import io
+import itertools
 import os
+from aws_clients import LazyClient
+from checkpoints import open_checkpoints
+from drug_matcher import DrugNameMatcher
+from external_sort import SpillingSortBuffer
+from instrumentation import RunMetrics
+from profiling import profiled
+from storage import get_storage
 
 # Initialize logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Initialize S3 client
-s3_client = boto3.client('s3')
-# Initialize SNS client
-sns_client = boto3.client('sns')
+# Stage timings, row/byte counts and S3 call stats for each run
+metrics = RunMetrics('lambda-1')
+# S3 and SNS clients, built on first use (SNS only when a drug name is missing)
+s3_client = LazyClient('s3', on_create=metrics.instrument)
+sns_client = LazyClient('sns', on_create=metrics.instrument)
+# SQS and SES clients for the priority alert lane, built only when a priority alert is queued
+sqs_client = LazyClient('sqs', on_create=metrics.instrument)
+ses_client = LazyClient('ses', on_create=metrics.instrument)
+# S3, or the local filesystem when STORAGE_BACKEND=local
+storage = get_storage(s3_client)
 # SNS topic ARN (replace with your actual topic ARN)
 sns_topic_arn = os.getenv("SNS_TOPIC_ARN")
 
@@ -29,15 +42,51 @@ reports_file = os.getenv("REPORTS_FILE_PATH")
 reactions_file = os.getenv("REACTIONS_FILE_PATH")
 report_links_file = os.getenv("REPORT_LINKS_FILE_PATH")
 report_drug_indication_file = os.getenv("REPORT_DRUG_INDICATION_FILE_PATH")
+# Multi-tenant mode: S3 key of a JSON manifest mapping tenant name -> watchlist file path.
+# When set, all watchlists are screened in a single pass and every tenant gets its own
+# report_output/<tenant>/ folder, dedup history and missing-drug notification.
+watchlist_manifest_file = os.getenv("WATCHLIST_MANIFEST_PATH")
+
+DEFAULT_TENANT = "default"
+DEFAULT_OUTPUT_PREFIX = "report_output/"
+# Keys of the data read_input_files returns
+READ_INPUT_KEYS = ['drug_names', 'report_drug', 'reports', 'reactions', 'report_links', 'report_drug_indication']
+
+# Per-drug aggregate summary (needs pandas/numpy, e.g. from a Lambda layer), written next to the report output
+aggregate_output_enabled = os.getenv("AGGREGATE_OUTPUT", "false").lower() == "true"
+aggregate_output_prefix = os.getenv("AGGREGATE_OUTPUT_PREFIX", "aggregate_output/")
+# Ranked PRR/ROR disproportionality signals per watchlisted drug (needs pandas/numpy/scipy)
+signal_output_enabled = os.getenv("SIGNAL_OUTPUT", "false").lower() == "true"
+signal_output_prefix = os.getenv("SIGNAL_OUTPUT_PREFIX", "signal_output/")
+# On-demand PDFs of single reports ({"report_no": ...} events), located through the report index built at ingest
+report_pdf_prefix = os.getenv("REPORT_PDF_PREFIX", "report_pdf/")
+report_index = None  # Loaded on the first single-report request and reused while the container is warm
+# Priority lane: new reports meeting PRIORITY_ALERT_CRITERIA (death, life threatening, hospitalization by
+# default) are queued for an immediate alert as soon as they are assembled, ahead of the batch digest
+priority_alerts_enabled = os.getenv("PRIORITY_ALERTS", "false").lower() == "true"
+# Trigram-indexed fuzzy matching of watchlist names against the extract's distinct DRUGNAME values, on top
+# of the exact substring match. The index is cached per extract in the output bucket and in warm containers.
+fuzzy_match_enabled = os.getenv("FUZZY_MATCH", "false").lower() == "true"
+fuzzy_index_prefix = os.getenv("FUZZY_INDEX_PREFIX", "fuzzy_index/")
+fuzzy_match_output_prefix = os.getenv("FUZZY_MATCH_OUTPUT_PREFIX", "fuzzy_match_output/")
+fuzzy_indexes = {}  # Extract fingerprint -> FuzzyDrugIndex
+# Tag each report with its duplicate/linked cluster from the full report_links.txt graph
+report_clusters_enabled = os.getenv("REPORT_CLUSTERS", "true").lower() == "true"
+# Screen the extract as it was on an earlier date (or history version) instead of the current one, materialized
+# from the extract history zip-lambda keeps. Also set per run with {"as_of": ...}. Output goes to
+# <as_of_output_prefix><extract date>/ so it neither reads nor feeds the live report_output/ history.
+extract_as_of = os.getenv("EXTRACT_AS_OF")
+as_of_output_prefix = os.getenv("AS_OF_OUTPUT_PREFIX", "as_of_output/")
+extract_snapshot = None  # ExtractSnapshot of the current as-of run, None when screening the current extract
 
 
 # Function to read files from S3
 def read_s3_file(bucket, key):
     try:
         logging.info(f"Attempting to read S3 file {key} from bucket {bucket}...")
-        response = s3_client.get_object(Bucket=bucket, Key=key)
+        lines = storage.read_lines(bucket, key)
         logging.info(f"Successfully read S3 file {key} from bucket {bucket}.")
-        return response['Body'].read().decode('utf-8').splitlines()
+        return lines
     except Exception as e:
         logging.error(f"Error reading S3 file {key} from bucket {bucket}: {e}")
         return []
@@ -82,50 +131,146 @@ def parse_drug_names(file_content):
     return list(drug_names)  # Convert back to list if needed
 
 # Step 2: Locate REPORT_IDs corresponding to drug names
-def find_report_ids(drug_names, report_drug_content):
+def find_report_ids(drug_names, report_drug_content, fuzzy_matches=None):
     logging.info(f"Finding REPORT_IDs for {len(drug_names)} drug names...")
-    report_ids = defaultdict(list)
-    missing_drug_names = set(drug_names)  # Start by assuming all drug names are missing
+    report_ids_by_tenant, missing_by_tenant = find_report_ids_by_tenant({DEFAULT_TENANT: drug_names},
+                                                                         report_drug_content, fuzzy_matches)
+    report_ids = report_ids_by_tenant[DEFAULT_TENANT]
+    missing_drug_names = missing_by_tenant[DEFAULT_TENANT]
 
-    # Convert the list of drug names to a set for faster lookup
-    drug_names_set = set(drug_names)
+    logging.info(f"Found {len(report_ids)} report IDs matching the drug names.")
+
+    # If there are missing drugs, send SNS notification
+    if missing_drug_names:
+        send_missing_drug_notification(missing_drug_names)
+
+    return report_ids
+
+
+def find_report_ids_by_tenant(watchlists, report_drug_content, fuzzy_matches=None):
+    """
+    Match every tenant's drug names against report_drug.txt in a single pass.
+
+    Returns a dict of tenant -> {REPORT_ID: [matching report_drug rows]} and a dict of
+    tenant -> set of drug names that matched no row.
+
+    :param fuzzy_matches: find_fuzzy_drug_matches(watchlists, ...) if the caller already has it
+    """
+    # One combined matcher for all tenants; each distinct DRUGNAME is only matched once
+    matcher = DrugNameMatcher(watchlists)
+    # DRUGNAME -> (tenant, name) pairs it fuzzily matches, from the trigram index (if enabled)
+    if fuzzy_matches is None:
+        fuzzy_matches = find_fuzzy_drug_matches(watchlists, report_drug_content) if fuzzy_match_enabled else {}
+    report_ids = {tenant: defaultdict(list) for tenant in watchlists}
+    tenants_by_match = {}
+    found = set()
 
     # Process each line in the report
     for line in report_drug_content:
         fields = line.split('$')
         if len(fields) > 1:
             drug_name = clean_string(fields[3]).strip().lower()  # Normalize drug name to lowercase
+
+            # Every watchlisted name that is a substring of the field (fields[3]), tagged by tenant
+            matches = matcher.match(drug_name)
+            if drug_name in fuzzy_matches:
+                matches = matches | fuzzy_matches[drug_name]
+            if not matches:
+                continue
+
             report_id = clean_string(fields[1]).strip()
+            tenants = tenants_by_match.get(matches)
+            if tenants is None:
+                found |= matches
+                tenants = tenants_by_match[matches] = {tenant for tenant, _ in matches}
+            for tenant in tenants:
+                report_ids[tenant][report_id].append(fields)
+
+    missing = {tenant: set(names) - {name for found_tenant, name in found if found_tenant == tenant}
+               for tenant, names in watchlists.items()}
+    return report_ids, missing
+
+def get_extract_fingerprint():
+    """Identify the current extract by report_drug.txt's size and write time (or the as-of extract by its version)."""
+    if extract_snapshot is not None:
+        return f"history-{extract_snapshot.fingerprint}"
+    for obj in storage.list(input_bucket, report_drug_file):
+        if obj['Key'] == report_drug_file:
+            return f"{obj['Size']}-{int(obj['LastModified'].timestamp())}"
+    return None
+
+
+def load_fuzzy_index(report_drug_content):
+    """
+    Return the FuzzyDrugIndex of the current extract: from this container, from the output bucket,
+    or built from the distinct DRUGNAME values of report_drug_content and saved for later runs.
+    """
+    from fuzzy_drug_index import FuzzyDrugIndex  # Only needed when fuzzy matching is enabled
 
-            # Check if any drug name is a substring in the field (fields[3])
-            for name in drug_names_set:
-                if name.lower() in drug_name:  # Check if the drug name is a substring of fields[3]
-                    report_ids[report_id].append(fields)
-                    # If this drug name matches, remove it from the missing list
-                    if name in missing_drug_names:
-                        missing_drug_names.remove(name)
-                    break  # Stop checking other drug names if a match is found
+    fingerprint = get_extract_fingerprint()
+    if fingerprint in fuzzy_indexes:
+        return fuzzy_indexes[fingerprint]
 
-    logging.info(f"Found {len(report_ids)} report IDs matching the drug names.")
+    index_key = f"{fuzzy_index_prefix}{fingerprint}.json"
+    if fingerprint and storage.exists(output_bucket, index_key):
+        index = FuzzyDrugIndex.from_json(storage.read_bytes(output_bucket, index_key).decode('utf-8'))
+        logging.info(f"Loaded the fuzzy drug name index {index_key}.")
+    else:
+        index = FuzzyDrugIndex.build(clean_string(line.split('$')[3]).strip().lower()
+                                     for line in report_drug_content if line.count('$') > 3)
+        logging.info(f"Indexed {len(index.names)} distinct drug names for fuzzy matching.")
+        if fingerprint:
+            storage.write(output_bucket, index_key, index.to_json(), 'application/json')
+    fuzzy_indexes[fingerprint] = index
+    return index
 
-    # If there are missing drugs, send SNS notification
-    if missing_drug_names:
-        send_missing_drug_notification(missing_drug_names)
 
-    return report_ids
+def find_fuzzy_drug_matches(watchlists, report_drug_content):
+    """
+    Look every watchlisted name up in the extract's fuzzy index and upload the scored hits.
+    Returns a dict of DRUGNAME -> frozenset of (tenant, name) pairs it matches.
+    """
+    with metrics.stage('fuzzy_match') as stage:
+        index = load_fuzzy_index(report_drug_content)
+        matches, hits = defaultdict(set), []
+        for tenant, names in watchlists.items():
+            for name in names:
+                for drug_name, score in index.lookup(name):
+                    matches[drug_name].add((tenant, name))
+                    if name not in drug_name:  # Exact substring matches are found anyway
+                        hits.append({'tenant': tenant, 'watchlist_name': name, 'drug_name': drug_name, 'score': score})
+        stage.add('rows_out', len(hits))
+
+    logging.info(f"Fuzzy matching found {len(hits)} drug names the exact match misses.")
+    if hits:
+        try:
+            timestamp = time.strftime('%d_%b_%Y_%H_%M_%S')
+            output_key = f"{fuzzy_match_output_prefix}fuzzy_drug_matches_{timestamp}.json"
+            storage.write(output_bucket, output_key, json.dumps(hits, indent=4), 'application/json')
+            logging.info(f"Successfully uploaded fuzzy match scores to S3: {output_key}")
+        except Exception as e:
+            logging.error(f"Error uploading fuzzy match scores: {e}")
+    return {drug_name: frozenset(pairs) for drug_name, pairs in matches.items()}
+
+
+def fuzzy_drug_names(fuzzy_matches):
+    """DRUGNAME -> sorted watchlist names it fuzzily matches, for the aggregates and signals to match the same reports."""
+    return {drug_name: sorted({name for _, name in pairs}) for drug_name, pairs in fuzzy_matches.items()}
+
 
 # Function to send SNS notification about missing drugs
-def send_missing_drug_notification(missing_drug_names):
+def send_missing_drug_notification(missing_drug_names, tenant=None):
     # Create the message body
     header_message = "The following drugs from the provided list were not found in the report data:\n\n"
     missing_drug_message = header_message + "\n".join(missing_drug_names)
-    
+    subject = "Missing Drug Names Notification" if tenant is None else f"Missing Drug Names Notification - {tenant}"
+
     try:
         # Publish to SNS
         response = sns_client.publish(
             TopicArn=sns_topic_arn,
             Message=missing_drug_message,
-            Subject="Missing Drug Names Notification"
+            Subject=subject
         )
         logging.info(f"SNS Notification sent successfully. Message ID: {response['MessageId']}")
     except Exception as e:
@@ -159,11 +304,39 @@ def filter_report_ids_by_source(report_ids, reports_content):
     return filtered_report_ids
 
 
-def extract_report_data(report_ids, reports_content, reactions_content, report_drug_indication_content,
-                        report_links_content, report_drug_content):
-    logging.info("Extracting report data from reference files...")
-    report_data = {}
+# Steps of extract_report_data, in the order the reference files are processed
+REPORT_STEP, REACTION_STEP, LINK_STEP, LINK_DEFAULT_STEP, DRUG_STEP, INDICATION_STEP = range(6)
 
+# Fields taken from reports.txt: (output key, column, convert 1/2 to Yes/No)
+REPORT_FIELDS = [
+    ('report_no', 1, None), ('version_no', 2, None), ('datreceived', 3, convert_date_format),
+    ('datintreceived', 4, convert_date_format), ('mah_no', 5, None), ('report_type_eng', 7, None),
+    ('gender_eng', 10, None), ('age', 12, None), ('age_unit_eng', 14, None), ('outcome_eng', 17, None),
+    ('weight', 19, None), ('weight_unit_eng', 20, None), ('height', 22, None), ('height_unit_eng', 23, None),
+    ('seriousness_eng', 26, None), ('death', 28, convert_to_yes_no), ('disability', 29, convert_to_yes_no),
+    ('congenital_anomaly', 30, convert_to_yes_no), ('life_threatening', 31, convert_to_yes_no),
+    ('hospitalization', 32, convert_to_yes_no), ('other_medically_imp_cond', 33, convert_to_yes_no),
+    ('reporter_type_eng', 34, None), ('source_eng', 37, None)
+]
+REACTION_KEYS = ['pt_name_eng', 'meddra_version', 'duration', 'duration_unit_eng']
+DRUG_KEYS = ['drug_name', 'drug_involvement', 'route_admin', 'unit_dose_qty', 'dose_unit_eng',
+             'freq_time_unit_eng', 'therapy_duration', 'therapy_duration_unit_eng', 'dosageform_eng']
+
+# Steps that create a report's entry; the others only add to an existing one
+CREATING_STEPS = {REPORT_STEP, LINK_STEP, LINK_DEFAULT_STEP, DRUG_STEP}
+
+# Memory budget for extract_report_data; when set, partial report state spills to /tmp and main streams the
+# joined reports into the JSON output instead of holding them (and does not checkpoint the join)
+report_data_memory_budget_mb = float(os.getenv("REPORT_DATA_MEMORY_BUDGET_MB", "0"))
+spill_dir = os.getenv("SPILL_DIR", "/tmp")
+
+
+def iter_report_data_events(report_ids, reports_content, reactions_content, report_drug_indication_content,
+                            report_links_content, report_drug_content):
+    """
+    Yield (report_id, step, values) for every reference-file row that belongs to one of
+    report_ids, in the order extract_report_data applies them.
+    """
     # Step 1: Process reports.txt first
     for line in reports_content:
         fields = line.split('$')
@@ -171,31 +344,8 @@ def extract_report_data(report_ids, reports_content, reactions_content, report_d
             report_id = clean_string(fields[0]).strip()
             if report_id not in report_ids:
                 continue  # Skip if the report_id is not in the report_ids
-            report_data[report_id] = {
-                'report_no': clean_string(fields[1]),
-                'version_no': clean_string(fields[2]),
-                'datreceived': convert_date_format(clean_string(fields[3])),
-                'datintreceived': convert_date_format(clean_string(fields[4])),
-                'mah_no': clean_string(fields[5]),
-                'report_type_eng': clean_string(fields[7]),
-                'gender_eng': clean_string(fields[10]),
-                'age': clean_string(fields[12]),
-                'age_unit_eng': clean_string(fields[14]),
-                'outcome_eng': clean_string(fields[17]),
-                'weight': clean_string(fields[19]),
-                'weight_unit_eng': clean_string(fields[20]),
-                'height': clean_string(fields[22]),
-                'height_unit_eng': clean_string(fields[23]),
-                'seriousness_eng': clean_string(fields[26]),
-                'death': convert_to_yes_no(clean_string(fields[28])),
-                'disability': convert_to_yes_no(clean_string(fields[29])),
-                'congenital_anomaly': convert_to_yes_no(clean_string(fields[30])),
-                'life_threatening': convert_to_yes_no(clean_string(fields[31])),
-                'hospitalization': convert_to_yes_no(clean_string(fields[32])),
-                'other_medically_imp_cond': convert_to_yes_no(clean_string(fields[33])),
-                'reporter_type_eng': clean_string(fields[34]),
-                'source_eng': clean_string(fields[37])
-            }
+            yield report_id, REPORT_STEP, [convert(clean_string(fields[column])) if convert else clean_string(fields[column])
+                                           for _, column, convert in REPORT_FIELDS]
 
     # Step 2: Process reactions.txt
     for line in reactions_content:
@@ -203,20 +353,9 @@ def extract_report_data(report_ids, reports_content, reactions_content, report_d
         report_id = clean_string(fields[1]).strip()
         if report_id not in report_ids:
             continue  # Skip if the report_id is not in the report_ids
-        pt_name_eng = clean_string(fields[5])
-        meddra_version = clean_string(fields[9])
-        duration = clean_string(fields[2])
-        duration_unit_eng = clean_string(fields[3])
-        if 'pt_name_eng' in report_data[report_id]:
-            report_data[report_id]['pt_name_eng'] += ', ' + pt_name_eng
-            report_data[report_id]['meddra_version'] += ', ' + meddra_version
-            report_data[report_id]['duration'] += ', ' + duration
-            report_data[report_id]['duration_unit_eng'] += ', ' + duration_unit_eng
-        else:
-            report_data[report_id]['pt_name_eng'] = pt_name_eng
-            report_data[report_id]['meddra_version'] = meddra_version
-            report_data[report_id]['duration'] = duration
-            report_data[report_id]['duration_unit_eng'] = duration_unit_eng
+        # pt_name_eng, meddra_version, duration, duration_unit_eng
+        yield report_id, REACTION_STEP, [clean_string(fields[5]), clean_string(fields[9]),
+                                         clean_string(fields[2]), clean_string(fields[3])]
 
     # Step 3: Process report_links.txt
     matched_ids = set()  # To track report_ids found in report_links.txt
@@ -229,13 +368,7 @@ def extract_report_data(report_ids, reports_content, reactions_content, report_d
 
         # Process only if the report_id is in report_ids
         if report_id in report_ids:
-            # Initialize the report_data entry if it's not already present
-            if report_id not in report_data:
-                report_data[report_id] = {}
-
-            # Assign values from the line
-            report_data[report_id]['record_type_eng'] = record_type_eng
-            report_data[report_id]['report_link_no'] = report_link_no
+            yield report_id, LINK_STEP, [record_type_eng, report_link_no]
 
             # Mark this report_id as matched
             matched_ids.add(report_id)
@@ -243,138 +376,192 @@ def extract_report_data(report_ids, reports_content, reactions_content, report_d
     # Handle report_ids that were not matched
     for report_id in report_ids:
         if report_id not in matched_ids:
-            # Ensure only missing fields are updated without overwriting existing data
-            if report_id not in report_data:
-                report_data[report_id] = {}  # Initialize if not present
-            report_data[report_id].setdefault('record_type_eng', 'No duplicate or linked report')
-            report_data[report_id].setdefault('report_link_no', 'No duplicate or linked report')
+            yield report_id, LINK_DEFAULT_STEP, []
 
     # Step 4: Process report_drug.txt
-    drug_names_dict = {}
     for line in report_drug_content:
         fields = line.split('$')
         if len(fields) > 1:
             report_id = clean_string(fields[1]).strip()
             if report_id not in report_ids:
                 continue  # Skip if the report_id is not in the report_ids
-            drug_name = clean_string(fields[3])
-            drug_involvement = clean_string(fields[4])
-            route_admin = clean_string(fields[6])
-            unit_dose_qty = clean_string(fields[8])
-            dose_unit_eng = clean_string(fields[9])
-            freq_time_unit_eng = clean_string(fields[15])
-            therapy_duration = clean_string(fields[17])
-            therapy_duration_unit_eng = clean_string(fields[18])
-            dosageform_eng = clean_string(fields[20])
-
-            # Initialize drug_names_dict and report_data
-            if report_id not in drug_names_dict:
-                drug_names_dict[report_id] = []
-            drug_names_dict[report_id].append(drug_name)  # Add drug name to the list for this report_id
-
-            if report_id not in report_data:
-                report_data[report_id] = {}
-            if 'drug_name' in report_data[report_id]:
-                report_data[report_id]['drug_name'] += ', ' + drug_name
-            else:
-                report_data[report_id]['drug_name'] = drug_name
+            yield report_id, DRUG_STEP, [clean_string(fields[column]) for column in (3, 4, 6, 8, 9, 15, 17, 18, 20)]
 
-            # Append or initialize for 'drug_involvement'
-            if 'drug_involvement' in report_data[report_id]:
-                report_data[report_id]['drug_involvement'] += ', ' + drug_involvement
-            else:
-                report_data[report_id]['drug_involvement'] = drug_involvement
+    # Step 5: Process report_drug_indication.txt after all other files
+    for line in report_drug_indication_content:
+        fields = line.split('$')
+        if len(fields) > 4:
+            report_id = clean_string(fields[1]).strip()
+            drug_name_eng = clean_string(fields[3]).strip().lower()
+            indication = clean_string(fields[4]).strip()
 
-            # Append or initialize for 'route_admin'
-            if 'route_admin' in report_data[report_id]:
-                report_data[report_id]['route_admin'] += ', ' + route_admin
-            else:
-                report_data[report_id]['route_admin'] = route_admin
+            if report_id not in report_ids:
+                continue
 
-            # Append or initialize for 'unit_dose_qty'
-            if 'unit_dose_qty' in report_data[report_id]:
-                report_data[report_id]['unit_dose_qty'] += ', ' + unit_dose_qty
-            else:
-                report_data[report_id]['unit_dose_qty'] = unit_dose_qty
+            yield report_id, INDICATION_STEP, [drug_name_eng, indication]
 
-            # Append or initialize for 'dose_unit_eng'
-            if 'dose_unit_eng' in report_data[report_id]:
-                report_data[report_id]['dose_unit_eng'] += ', ' + dose_unit_eng
-            else:
-                report_data[report_id]['dose_unit_eng'] = dose_unit_eng
 
-            # Append or initialize for 'freq_time_unit_eng'
-            if 'freq_time_unit_eng' in report_data[report_id]:
-                report_data[report_id]['freq_time_unit_eng'] += ', ' + freq_time_unit_eng
-            else:
-                report_data[report_id]['freq_time_unit_eng'] = freq_time_unit_eng
+def apply_report_data_event(report_data, drug_names_dict, report_id, step, values):
+    """Apply one row from iter_report_data_events to the report_data entry for report_id."""
+    if step == REPORT_STEP:
+        report_data[report_id] = {key: value for (key, _, _), value in zip(REPORT_FIELDS, values)}
 
-            # Append or initialize for 'therapy_duration'
-            if 'therapy_duration' in report_data[report_id]:
-                report_data[report_id]['therapy_duration'] += ', ' + therapy_duration
+    elif step == REACTION_STEP:
+        seen_reaction = 'pt_name_eng' in report_data[report_id]
+        for key, value in zip(REACTION_KEYS, values):
+            if seen_reaction:
+                report_data[report_id][key] += ', ' + value
             else:
-                report_data[report_id]['therapy_duration'] = therapy_duration
+                report_data[report_id][key] = value
 
-            # Append or initialize for 'therapy_duration_unit_eng'
-            if 'therapy_duration_unit_eng' in report_data[report_id]:
-                report_data[report_id]['therapy_duration_unit_eng'] += ', ' + therapy_duration_unit_eng
-            else:
-                report_data[report_id]['therapy_duration_unit_eng'] = therapy_duration_unit_eng
+    elif step == LINK_STEP:
+        # Initialize the report_data entry if it's not already present
+        if report_id not in report_data:
+            report_data[report_id] = {}
 
-            # Append or initialize for 'therapy_duration_unit_eng'
-            if 'dosageform_eng' in report_data[report_id]:
-                report_data[report_id]['dosageform_eng'] += ', ' + dosageform_eng
+        # Keep every link of the report, not only the last one
+        for key, value in zip(('record_type_eng', 'report_link_no'), values):
+            if key in report_data[report_id]:
+                report_data[report_id][key] += ', ' + value
+            else:
+                report_data[report_id][key] = value
+
+    elif step == LINK_DEFAULT_STEP:
+        # Ensure only missing fields are updated without overwriting existing data
+        if report_id not in report_data:
+            report_data[report_id] = {}  # Initialize if not present
+        report_data[report_id].setdefault('record_type_eng', 'No duplicate or linked report')
+        report_data[report_id].setdefault('report_link_no', 'No duplicate or linked report')
+
+    elif step == DRUG_STEP:
+        # Initialize drug_names_dict and report_data
+        if report_id not in drug_names_dict:
+            drug_names_dict[report_id] = []
+        drug_names_dict[report_id].append(values[0])  # Add drug name to the list for this report_id
+
+        if report_id not in report_data:
+            report_data[report_id] = {}
+
+        # Append or initialize each drug field
+        for key, value in zip(DRUG_KEYS, values):
+            if key in report_data[report_id]:
+                report_data[report_id][key] += ', ' + value
             else:
-                report_data[report_id]['dosageform_eng'] = dosageform_eng
+                report_data[report_id][key] = value
 
-    # Step 5: Process report_drug_indication.txt after all other files
-    for line in report_drug_indication_content:
-        fields = line.split('$')
-        if len(fields) > 4:
-            report_id = clean_string(fields[1]).strip()
-            drug_name_eng = clean_string(fields[3]).strip().lower()
-            indication = clean_string(fields[4]).strip()
+    elif step == INDICATION_STEP:
+        drug_name_eng, indication = values
 
-            if report_id not in report_ids:
-                continue
+        # Get the list of drug names for the current report_id
+        drug_names_for_report = drug_names_dict.get(report_id, [])
+
+        # Initialize indication_eng if it doesn't exist
+        if 'indication_eng' not in report_data[report_id]:
+            # Placeholder for each drug: a space separated by commas
+            report_data[report_id]['indication_eng'] = ' , ' * (len(drug_names_for_report) - 1) + ' '
+
+        # Find the drug index and assign the correct indication to that index
+        for index, drug_name in enumerate(drug_names_for_report):
+            # Match the drug name with its indication if it exists
+            if drug_name_eng == drug_name.lower():
+                indication_list = report_data[report_id]['indication_eng'].split(', ')
+                indication_list[index] = indication.strip()  # Assign the indication to the correct drug
+                report_data[report_id]['indication_eng'] = ', '.join(indication_list)
 
-            # Get the list of drug names for the current report_id
-            drug_names_for_report = drug_names_dict.get(report_id, [])
 
-            # Initialize indication_eng if it doesn't exist
-            if 'indication_eng' not in report_data[report_id]:
-                # Placeholder for each drug: a space separated by commas
-                report_data[report_id]['indication_eng'] = ' , ' * (len(drug_names_for_report) - 1) + ' '
+def extract_report_data(report_ids, reports_content, reactions_content, report_drug_indication_content,
+                        report_links_content, report_drug_content, on_report=None):
+    """
+    Join the reference files for report_ids into one report_data entry per report.
 
-            # Find the drug index and assign the correct indication to that index
-            for index, drug_name in enumerate(drug_names_for_report):
-                # Match the drug name with its indication if it exists
-                if drug_name_eng == drug_name.lower():
-                    indication_list = report_data[report_id]['indication_eng'].split(', ')
-                    indication_list[index] = indication.strip()  # Assign the indication to the correct drug
-                    report_data[report_id]['indication_eng'] = ', '.join(indication_list)
+    :param on_report: Optional callback given (report_id, data) as soon as each report is fully assembled
+    """
+    logging.info("Extracting report data from reference files...")
+    if report_data_memory_budget_mb > 0:
+        return dict(extract_report_data_spilling(report_ids, reports_content, reactions_content,
+                                                 report_drug_indication_content, report_links_content,
+                                                 report_drug_content, int(report_data_memory_budget_mb * 1024 * 1024),
+                                                 on_report))
 
+    report_data = {}
+    drug_names_dict = {}
+    for report_id, step, values in iter_report_data_events(report_ids, reports_content, reactions_content,
+                                                           report_drug_indication_content, report_links_content,
+                                                           report_drug_content):
+        apply_report_data_event(report_data, drug_names_dict, report_id, step, values)
+
+    # Every report is complete once the last reference file has been scanned
+    if on_report:
+        for report_id, data in report_data.items():
+            on_report(report_id, data)
     return report_data
 
 
-def get_existing_report_ids_from_s3():
+def extract_report_data_spilling(report_ids, reports_content, reactions_content, report_drug_indication_content,
+                                 report_links_content, report_drug_content, memory_budget, on_report=None):
+    """
+    Memory-budgeted version of extract_report_data: yields the same (report_id, data) pairs in the
+    same order, holding about memory_budget bytes of rows or reports at a time.
+
+    Matched rows are buffered as (report_id, seq, step, values) and spilled to sorted run files
+    in spill_dir whenever the buffer crosses memory_budget bytes. The runs are then merged by
+    report_id and each report is rebuilt by replaying its rows in their original order, so
+    on_report sees each report as soon as it is rebuilt. Rebuilt reports go through a second
+    spilling buffer keyed by the row that created them, which restores the in-memory path's order.
+    """
+    rows = SpillingSortBuffer(memory_budget, spill_dir)
+    reports = SpillingSortBuffer(memory_budget, spill_dir)
+
+    def rebuilt(report_id, data, first_seq):
+        if on_report:
+            on_report(report_id, data)
+        reports.add(f"{first_seq:012d}", 0, [report_id, json.dumps(data, separators=(',', ':'))])
+
+    try:
+        events = iter_report_data_events(report_ids, reports_content, reactions_content,
+                                         report_drug_indication_content, report_links_content, report_drug_content)
+        for seq, (report_id, step, values) in enumerate(events):
+            rows.add(report_id, seq, [str(step)] + values)
+        if rows.run_paths:
+            logging.info(f"Merging {len(rows.run_paths)} spilled runs...")
+
+        # Rebuild one report at a time; remember when the in-memory path would have created it
+        current_id, entry, drug_names_dict, first_seq = None, None, None, None
+        for report_id, seq, values in rows.merged():
+            if report_id != current_id:
+                if current_id is not None:
+                    rebuilt(current_id, entry[current_id], first_seq)
+                current_id, entry, drug_names_dict, first_seq = report_id, {}, {}, None
+            step = int(values[0])
+            if first_seq is None and step in CREATING_STEPS:
+                first_seq = seq
+            apply_report_data_event(entry, drug_names_dict, report_id, step, values[1:])
+        if current_id is not None:
+            rebuilt(current_id, entry[current_id], first_seq)
+        rows.cleanup()
+
+        for _, _, (report_id, data) in reports.merged():
+            yield report_id, json.loads(data)
+    finally:
+        rows.cleanup()
+        reports.cleanup()
+
+
+def get_existing_report_ids_from_s3(output_prefix=DEFAULT_OUTPUT_PREFIX):
     existing_report_ids = set()
 
     try:
         # List all objects in the 'report_output/' folder
-        response = s3_client.list_objects_v2(Bucket=output_bucket, Prefix='report_output/')
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                file_key = obj['Key']
-                if file_key.endswith('.json'):
-                    # Read the JSON file
-                    file_obj = s3_client.get_object(Bucket=output_bucket, Key=file_key)
-                    file_data = json.loads(file_obj['Body'].read().decode('utf-8'))
-
-                    # Extract report numbers from the JSON file
-                    for record in file_data:
-                        if 'report_no' in record:
-                            existing_report_ids.add(str(record['report_no']).strip().lower())  # Normalize to string (strip spaces, lowercase)
+        for obj in storage.list(output_bucket, output_prefix):
+            file_key = obj['Key']
+            if file_key.endswith('.json'):
+                # Read the JSON file
+                file_data = json.loads(storage.read_bytes(output_bucket, file_key).decode('utf-8'))
+
+                # Extract report numbers from the JSON file
+                for record in file_data:
+                    if 'report_no' in record:
+                        existing_report_ids.add(str(record['report_no']).strip().lower())  # Normalize to string (strip spaces, lowercase)
 
         logging.info(f"Existing report numbers from S3: {existing_report_ids}")
 
@@ -384,145 +571,634 @@ def get_existing_report_ids_from_s3():
     return existing_report_ids
 
 
-def filter_new_report_data(report_data, existing_report_ids):
-    new_report_data = {}
-
+def iter_new_reports(reports, existing_report_ids):
+    """Yield the (report_id, data) pairs of reports whose report_no is not in existing_report_ids."""
     # Iterate over the report data and check if the report_no is already in the existing reports
-    for report_id, data in report_data.items():
+    for report_id, data in reports:
         report_no = str(data.get('report_no', '')).strip().lower()  # Normalize report_no to string (strip spaces, lowercase)
 
         if report_no not in existing_report_ids:
-            new_report_data[report_id] = data  # Add this report to new report data if it's not in the existing reports
             logging.info(f"New report found: {report_no}")  # Log the new report number
+            yield report_id, data  # Keep this report if it's not in the existing reports
         else:
             logging.info(f"Duplicate report found: {report_no}")  # Log duplicate report number
 
+
+def filter_new_report_data(report_data, existing_report_ids):
+    new_report_data = dict(iter_new_reports(report_data.items(), existing_report_ids))
+
     logging.info(f"New report data: {new_report_data.keys()}")  # Log keys of new reports
 
     return new_report_data
 
 
 
-def generate_json_output(report_data):
+def format_output_record(data):
+    """Map one report_data entry to the record written to the JSON output."""
+    return {
+        "report_no": data.get('report_no', ''),
+        "version_no": data.get('version_no', ''),
+        "datintreceived": data.get('datintreceived', ''),
+        "datreceived": data.get('datreceived', ''),
+        "source_eng": data.get('source_eng', ''),
+        "mah_no": data.get('mah_no', ''),
+        "report_type_eng": data.get('report_type_eng', ''),
+        "reporter_type_eng": data.get('reporter_type_eng', ''),
+        "seriousness_eng": data.get('seriousness_eng', ''),
+        "death": data.get('death', ''),
+        "disability": data.get('disability', ''),
+        "congenital_anomaly": data.get('congenital_anomaly', ''),
+        "life_threatening": data.get('life_threatening', ''),
+        "hospitalization": data.get('hospitalization', ''),
+        "other_medically_imp_cond": data.get('other_medically_imp_cond', ''),
+        "age": data.get('age', ''),
+        "age_unit_eng": data.get('age_unit_eng', ''),
+        "gender_eng": data.get('gender_eng', ''),
+        "height": data.get('height', ''),
+        "height_unit_eng": data.get('height_unit_eng', ''),
+        "weight": data.get('weight', ''),
+        "weight_unit_eng": data.get('weight_unit_eng', ''),
+        "outcome_eng": data.get('outcome_eng', ''),
+        "record_type_eng": data.get('record_type_eng', ''),
+        "report_link_no": data.get('report_link_no', ''),
+        "drug_name": data.get('drug_name', ''),
+        "drug_involvement": data.get('drug_involvement', ''),
+        "dosage_form_eng": data.get('dosageform_eng', ''),
+        "route_admin": data.get('route_admin', ''),
+        "unit_dose_qty": data.get('unit_dose_qty', ''),
+        "dose_unit_eng": data.get('dose_unit_eng', ''),
+        "freq_time_unit_eng": data.get('freq_time_unit_eng', ''),
+        "therapy_duration": data.get('therapy_duration', ''),
+        "therapy_duration_unit_eng": data.get('therapy_duration_unit_eng', ''),
+        "indication_eng": data.get('indication_eng', ''),
+        "pt_name_eng": data.get('pt_name_eng', ''),
+        "meddra_version": data.get('meddra_version', ''),
+        "duration": data.get('duration', ''),
+        "duration_unit_eng": data.get('duration_unit_eng', ''),
+        "cluster_id": data.get('cluster_id', ''),
+        "cluster_report_nos": data.get('cluster_report_nos', '')
+    }
+
+
+def assign_report_clusters(report_data, data):
     """
-    Generate and upload the final JSON output to S3.
+    Tag every report with its duplicate/linked cluster: the canonical cluster id (smallest AER
+    number in the cluster) and every other AER number linked to it, directly or not.
+    """
+    clusters = build_clusters(data)
+    for entry in report_data.values():
+        tag_report_cluster(entry, clusters)
+    return clusters
+
+
+def assign_report_clusters_streaming(reports, data):
+    """assign_report_clusters for a stream of (report_id, entry) pairs; tags and yields each one."""
+    clusters = None
+    for report_id, entry in reports:
+        if clusters is None:
+            clusters = build_clusters(data)
+        tag_report_cluster(entry, clusters)
+        yield report_id, entry
+
+
+def build_clusters(data):
+    from report_clusters import build_report_clusters
+
+    clusters = build_report_clusters(data['report_links'], data['reports'])
+    logging.info(f"Built {len(clusters.members)} linked report clusters covering {len(clusters.cluster_ids)} reports.")
+    return clusters
+
+
+def tag_report_cluster(entry, clusters):
+    report_no = entry.get('report_no', '')
+    entry['cluster_id'] = clusters.cluster_id(report_no)
+    entry['cluster_report_nos'] = ', '.join(clusters.linked_report_nos(report_no))
+
+
+def generate_json_output(report_data, output_prefix=DEFAULT_OUTPUT_PREFIX, timestamp=None):
+    """
+    Generate and upload the final JSON output to S3, writing one record at a time.
     Only proceeds if there are new reports to upload.
+
+    :param report_data: report_data dict, or an iterable of (report_id, data) pairs (e.g. the spilling join)
+    :param timestamp: Timestamp for the file name (default: now); a resumed run passes the one of its first attempt
+    :return: Number of reports written
     """
-    if not report_data:
+    reports = iter(report_data.items() if isinstance(report_data, dict) else report_data)
+    first = next(reports, None)
+    if first is None:
         logging.info("No new reports found. Skipping JSON generation and upload.")
-        return
+        return 0
 
     logging.info("Generating JSON output...")
-    final_data = []
-    for report_id, data in report_data.items():
-        final_data.append({
-            "report_no": data.get('report_no', ''),
-            "version_no": data.get('version_no', ''),
-            "datintreceived": data.get('datintreceived', ''),
-            "datreceived": data.get('datreceived', ''),
-            "source_eng": data.get('source_eng', ''),
-            "mah_no": data.get('mah_no', ''),
-            "report_type_eng": data.get('report_type_eng', ''),
-            "reporter_type_eng": data.get('reporter_type_eng', ''),
-            "seriousness_eng": data.get('seriousness_eng', ''),
-            "death": data.get('death', ''),
-            "disability": data.get('disability', ''),
-            "congenital_anomaly": data.get('congenital_anomaly', ''),
-            "life_threatening": data.get('life_threatening', ''),
-            "hospitalization": data.get('hospitalization', ''),
-            "other_medically_imp_cond": data.get('other_medically_imp_cond', ''),
-            "age": data.get('age', ''),
-            "age_unit_eng": data.get('age_unit_eng', ''),
-            "gender_eng": data.get('gender_eng', ''),
-            "height": data.get('height', ''),
-            "height_unit_eng": data.get('height_unit_eng', ''),
-            "weight": data.get('weight', ''),
-            "weight_unit_eng": data.get('weight_unit_eng', ''),
-            "outcome_eng": data.get('outcome_eng', ''),
-            "record_type_eng": data.get('record_type_eng', ''),
-            "report_link_no": data.get('report_link_no', ''),
-            "drug_name": data.get('drug_name', ''),
-            "drug_involvement": data.get('drug_involvement', ''),
-            "dosage_form_eng": data.get('dosageform_eng', ''),
-            "route_admin": data.get('route_admin', ''),
-            "unit_dose_qty": data.get('unit_dose_qty', ''),
-            "dose_unit_eng": data.get('dose_unit_eng', ''),
-            "freq_time_unit_eng": data.get('freq_time_unit_eng', ''),
-            "therapy_duration": data.get('therapy_duration', ''),
-            "therapy_duration_unit_eng": data.get('therapy_duration_unit_eng', ''),
-            "indication_eng": data.get('indication_eng', ''),
-            "pt_name_eng": data.get('pt_name_eng', ''),
-            "meddra_version": data.get('meddra_version', ''),
-            "duration": data.get('duration', ''),
-            "duration_unit_eng": data.get('duration_unit_eng', '')
-        })
-
+    timestamp = timestamp or time.strftime('%d_%b_%Y_%H_%M_%S')
+    output_file = f"{output_prefix}reported_adverse_reaction_{timestamp}.json"
+    written = 0
+    writer = None
     try:
-        json_data = json.dumps(final_data, indent=4)
-        timestamp = time.strftime('%d_%b_%Y_%H_%M_%S')
-        output_file = f"report_output/reported_adverse_reaction_{timestamp}.json"
-        s3_client.put_object(Bucket=output_bucket, Key=output_file, Body=json_data)
+        # Same bytes as json.dumps(list of records, indent=4)
+        writer = storage.open_writer(output_bucket, output_file)
+        for report_id, data in itertools.chain([first], reports):
+            record = json.dumps(format_output_record(data), indent=4).replace('\n', '\n    ')
+            writer.write(f"{',' if written else '['}\n    {record}".encode('utf-8'))
+            written += 1
+        writer.write(b"\n]")
+        writer.close()
         logging.info(f"Successfully uploaded JSON file to S3: {output_file}")
     except Exception as e:
+        if writer is not None:
+            writer.abort()
         logging.error(f"Error generating or uploading JSON output: {e}")
+    return written
 
 
-def main():
-    logging.info("Starting script execution...")
-    start_time = time.time()
+def generate_aggregate_output(report_ids, drug_names, data, output_prefix=aggregate_output_prefix,
+                              fuzzy_names=None):
+    """
+    Build per-drug aggregate tables over the matched reports and upload them as JSON and CSV.
+    Covers every matched report, not only the new ones, so each summary is a full snapshot.
+
+    :param fuzzy_names: fuzzy_drug_names() of the fuzzy matches find_report_ids used, if any
+    """
+    if not report_ids:
+        logging.info("No matching reports. Skipping aggregate output.")
+        return
+
+    from aggregates import build_drug_aggregates  # pandas is only needed when aggregates are enabled
+
+    try:
+        aggregate_start = time.time()
+        summary, table = build_drug_aggregates(report_ids, drug_names, data['reports'], data['reactions'],
+                                               fuzzy_names=fuzzy_names)
+        logging.info(f"Built aggregates for {len(summary)} drugs in {time.time() - aggregate_start:.2f} seconds.")
+
+        timestamp = time.strftime('%d_%b_%Y_%H_%M_%S')
+        output_key = f"{output_prefix}drug_aggregates_{timestamp}"
+        storage.write(output_bucket, f"{output_key}.json", json.dumps(summary, indent=4), 'application/json')
+        storage.write(output_bucket, f"{output_key}.csv", table.to_csv(index=False), 'text/csv')
+        logging.info(f"Successfully uploaded aggregate output to S3: {output_key}.json / .csv")
+    except Exception as e:
+        logging.error(f"Error generating or uploading aggregate output: {e}")
 
-    # Step 1: Retrieve existing report IDs from previous output files
-    existing_report_ids = get_existing_report_ids_from_s3()
 
-    # Step 2: Read input files in parallel using ThreadPoolExecutor
+def detect_signals(drug_names, data, fuzzy_names=None):
+    """
+    Compute ranked disproportionality signals for drug_names against the whole extract.
+    Returns (ranked signals, total reports), or None if the computation failed.
+
+    :param fuzzy_names: fuzzy_drug_names() of the fuzzy matches find_report_ids used, if any
+    """
+    from signal_detection import compute_signals  # scipy is only needed when signals are enabled
+
+    try:
+        signal_start = time.time()
+        ranked, total_reports = compute_signals(drug_names, data['report_drug'], data['reactions'],
+                                                fuzzy_names=fuzzy_names)
+        logging.info(f"Computed {len(ranked)} ranked drug/PT pairs over {total_reports} reports "
+                     f"in {time.time() - signal_start:.2f} seconds.")
+        return ranked, total_reports
+    except Exception as e:
+        logging.error(f"Error computing disproportionality signals: {e}")
+        return None
+
+
+def generate_signal_output(ranked, total_reports, drug_names, output_prefix=signal_output_prefix):
+    """Upload the ranked signals for drug_names as JSON and CSV."""
+    from signal_detection import signals_summary
+
+    try:
+        summary = signals_summary(ranked, total_reports, drug_names)
+        timestamp = time.strftime('%d_%b_%Y_%H_%M_%S')
+        output_key = f"{output_prefix}drug_signals_{timestamp}"
+        storage.write(output_bucket, f"{output_key}.json", json.dumps(summary, indent=4), 'application/json')
+        csv_body = ranked[ranked['drug'].isin(list(drug_names))].to_csv(index=False)
+        storage.write(output_bucket, f"{output_key}.csv", csv_body, 'text/csv')
+        logging.info(f"Successfully uploaded signal output to S3: {output_key}.json / .csv")
+    except Exception as e:
+        logging.error(f"Error generating or uploading signal output: {e}")
+
+
+def get_extract_available_at():
+    """Epoch seconds when the newest extract table was written, i.e. when this extract became available."""
+    written = []
+    for key in (reports_file, reactions_file, report_links_file, report_drug_file, report_drug_indication_file):
+        written.extend(obj['LastModified'].timestamp() for obj in storage.list(input_bucket, key) if obj['Key'] == key)
+    return max(written, default=time.time())
+
+
+def open_priority_alerts(existing_report_ids, run_id=None):
+    """
+    Start the priority alert lane. Returns the alert queue and the on_report callback that queues
+    every new report meeting the priority criteria; reports in earlier output were alerted before.
+    """
+    from priority_alerts import build_alert_message, get_alert_queue, priority_criteria_met
+
+    extract_available_at = get_extract_available_at()
+    alert_queue = get_alert_queue(sqs_client, ses_client)
+
+    def on_report(report_id, data):
+        record = format_output_record(data)
+        if str(record['report_no']).strip().lower() in existing_report_ids:
+            return
+        criteria_met = priority_criteria_met(record)
+        if criteria_met:
+            alert_queue.put(build_alert_message(record, criteria_met, extract_available_at, run_id))
+
+    return alert_queue, on_report
+
+
+def close_priority_alerts(alert_queue):
+    """Wait for locally sent alerts and record how long after extract availability they went out."""
+    with metrics.stage('priority_alerts', rows_in=alert_queue.queued) as stage:
+        times_to_alert = sorted(alert_queue.close())
+        stage.add('rows_out', len(times_to_alert))
+        stage.add('failed', len(alert_queue.failed))
+        if times_to_alert:
+            stage.add('time_to_alert_first_seconds', times_to_alert[0])
+            stage.add('time_to_alert_last_seconds', times_to_alert[-1])
+    logging.info(f"Queued {alert_queue.queued} priority alerts.")
+    if alert_queue.failed:
+        logging.error(f"{len(alert_queue.failed)} priority alerts could not be sent: "
+                      f"{[message['record'].get('report_no') for message in alert_queue.failed]}")
+
+
+def load_watchlists(manifest_key):
+    """Read the tenant manifest and every tenant's drug name file, returning tenant -> drug names."""
+    manifest = json.loads("\n".join(read_s3_file(input_bucket, manifest_key)) or "{}")
     with ThreadPoolExecutor() as executor:
-        # Submit S3 read tasks
-        futures = {
-            'drug_names': executor.submit(read_s3_file, input_bucket, drug_names_file),
-            'report_drug': executor.submit(read_s3_file, input_bucket, report_drug_file),
-            'reports': executor.submit(read_s3_file, input_bucket, reports_file),
-            'reactions': executor.submit(read_s3_file, input_bucket, reactions_file),
-            'report_links': executor.submit(read_s3_file, input_bucket, report_links_file),
-            'report_drug_indication': executor.submit(read_s3_file, input_bucket, report_drug_indication_file)
-        }
+        futures = {tenant: executor.submit(read_s3_file, input_bucket, key) for tenant, key in manifest.items()}
+        return {tenant: parse_drug_names(future.result()) for tenant, future in futures.items()}
+
+
+def process_tenants(watchlists, data):
+    """Screen every tenant's watchlist with one pass over each extract table and write per-tenant outputs."""
+    logging.info(f"Screening {len(watchlists)} tenant watchlists in a single pass...")
+    with metrics.stage('find_report_ids', rows_in=len(data['report_drug'])) as stage:
+        fuzzy_matches = find_fuzzy_drug_matches(watchlists, data['report_drug']) if fuzzy_match_enabled else {}
+        report_ids_by_tenant, missing_by_tenant = find_report_ids_by_tenant(watchlists, data['report_drug'],
+                                                                            fuzzy_matches)
+        stage.add('rows_out', sum(len(report_ids) for report_ids in report_ids_by_tenant.values()))
+
+    # Filter and join the union of all tenants' reports once
+    all_report_ids = {}
+    for report_ids in report_ids_by_tenant.values():
+        all_report_ids.update(report_ids)
+    with metrics.stage('filter_by_source', rows_in=len(all_report_ids)) as stage:
+        all_report_ids = filter_report_ids_by_source(all_report_ids, data['reports'])
+        stage.add('rows_out', len(all_report_ids))
+    with metrics.stage('extract_report_data', rows_in=len(all_report_ids)) as stage:
+        report_data = extract_report_data(all_report_ids, data['reports'], data['reactions'],
+                                          data['report_drug_indication'], data['report_links'], data['report_drug'])
+        stage.add('rows_out', len(report_data))
+    if report_clusters_enabled and report_data:
+        with metrics.stage('cluster_reports', rows_in=len(data['report_links'])):
+            assign_report_clusters(report_data, data)
+
+    # Signals are computed once for the union of all watchlists and sliced per tenant
+    signals = None
+    if signal_output_enabled:
+        with metrics.stage('detect_signals'):
+            signals = detect_signals(set().union(*watchlists.values()), data, fuzzy_drug_names(fuzzy_matches))
+
+    # Fan the joined records out to each tenant
+    for tenant, report_ids in report_ids_by_tenant.items():
+        logging.info(f"Tenant {tenant}: {len(report_ids)} matching REPORT_IDs before source filtering.")
+        if missing_by_tenant[tenant]:
+            send_missing_drug_notification(missing_by_tenant[tenant], tenant)
+
+        output_prefix = f"{DEFAULT_OUTPUT_PREFIX}{tenant}/"
+        tenant_data = {rid: report_data[rid] for rid in report_ids if rid in all_report_ids}
+        with metrics.stage('write_output', rows_in=len(tenant_data)) as stage:
+            existing_report_ids = get_existing_report_ids_from_s3(output_prefix)
+            new_report_data = filter_new_report_data(tenant_data, existing_report_ids)
+            generate_json_output(new_report_data, output_prefix)
+            stage.add('rows_out', len(new_report_data))
+
+        if aggregate_output_enabled:
+            tenant_report_ids = {rid: all_report_ids[rid] for rid in report_ids if rid in all_report_ids}
+            with metrics.stage('aggregates', rows_in=len(tenant_report_ids)):
+                generate_aggregate_output(tenant_report_ids, watchlists[tenant], data,
+                                          f"{aggregate_output_prefix}{tenant}/", fuzzy_drug_names(fuzzy_matches))
+
+        if signals is not None:
+            generate_signal_output(*signals, watchlists[tenant], f"{signal_output_prefix}{tenant}/")
+
+
+def read_extract_table(table, report_ids=None):
+    """Read an extract table as of extract_snapshot, only the rows of report_ids if given."""
+    try:
+        if report_ids is not None:
+            return extract_snapshot.read_rows(table, report_ids)
+        return extract_snapshot.read_table(table)
+    except Exception as e:
+        logging.error(f"Error reading {table} as of version {extract_snapshot.version}: {e}")
+        return []
+
+
+def read_input_files(keys=None, report_ids=None):
+    """
+    Read the drug name file and the extract tables in parallel.
 
-        # Wait for all read tasks to finish
-        data = {key: future.result() for key, future in futures.items()}
+    :param keys: Data keys to read (default: all of them)
+    :param report_ids: In an as-of run, only materialize the rows of these REPORT_IDs
+    """
+    files = {
+        'drug_names': drug_names_file,
+        'report_drug': report_drug_file,
+        'reports': reports_file,
+        'reactions': reactions_file,
+        'report_links': report_links_file,
+        'report_drug_indication': report_drug_indication_file
+    }
+    with metrics.stage('read_inputs') as stage:
+        with ThreadPoolExecutor() as executor:
+            # Submit S3 read tasks; an as-of run reads the tables from the extract history
+            futures = {
+                key: executor.submit(read_s3_file, input_bucket, files[key])
+                if extract_snapshot is None or key == 'drug_names'
+                else executor.submit(read_extract_table, key, report_ids)
+                for key in keys or READ_INPUT_KEYS
+            }
 
-    # Step 3: Parse drug names
-    logging.info("Starting parsing drugnames...")
-    drug_names = parse_drug_names(data['drug_names'])
+            # Wait for all read tasks to finish
+            data = {key: future.result() for key, future in futures.items()}
+        stage.add('rows_out', sum(len(lines) for lines in data.values()))
+    return data
 
-    # Step 4: Find report IDs corresponding to drug names
-    filter_report_ids = find_report_ids(drug_names, data['report_drug'])
 
-    report_ids = filter_report_ids_by_source(filter_report_ids, data['reports'])
+def open_extract_snapshot(as_of):
+    """Return the ExtractSnapshot of the extract in effect as of a date ('YYYY-MM-DD') or history version."""
+    from extract_history import ExtractSnapshot  # Only needed for as-of runs
 
-    # Step 5: Extract data based on report IDs
-    report_data = extract_report_data(report_ids, data['reports'], data['reactions'], data['report_drug_indication'],
-                                      data['report_links'], data['report_drug'])
+    with metrics.stage('open_snapshot'):
+        snapshot = ExtractSnapshot(storage, input_bucket, as_of)
+    logging.info(f"Screening the extract of {snapshot.extract_date} (history version {snapshot.version}) "
+                 f"as of {as_of}.")
+    return snapshot
 
-    # Step 6: Filter new report data that is not already in existing reports
-    new_report_data = filter_new_report_data(report_data, existing_report_ids)
 
-    # Step 7: Generate and save the JSON output to S3 (if there are new reports)
-    generate_json_output(new_report_data)
+def main(run_id=None, as_of=None):
+    global extract_snapshot
+    logging.info("Starting script execution...")
+    start_time = time.time()
+    metrics.reset(run_id)
+
+    if watchlist_manifest_file:
+        if as_of or extract_as_of:
+            logging.warning("As-of runs are not supported with WATCHLIST_MANIFEST_PATH; screening the current extract.")
+        main_multi_tenant()
+        logging.info(f"Script execution completed in {time.time() - start_time:.2f} seconds.")
+        return metrics.emit_summary()
+
+    # An as-of run screens an earlier extract and writes under its own prefix
+    as_of = as_of or extract_as_of
+    extract_snapshot = open_extract_snapshot(as_of) if as_of else None
+    run_prefix = f"{as_of_output_prefix}{extract_snapshot.extract_date}/" if extract_snapshot else ""
+    output_prefix = f"{run_prefix}{DEFAULT_OUTPUT_PREFIX}"
+
+    # Completed stages of an earlier attempt of this run (same run id) are reused instead of redone
+    checkpoints = open_checkpoints(storage, output_bucket, 'lambda-1', run_id)
+    checkpointed = checkpoints.stage if checkpoints else (lambda name, compute: compute())
+    timestamp = checkpoints.run_timestamp() if checkpoints else None
+
+    # Step 1: Retrieve existing report IDs from previous output files (as they were before this run)
+    with metrics.stage('load_existing_reports') as stage:
+        existing_report_ids = set(checkpointed('existing_report_ids',
+                                               lambda: sorted(get_existing_report_ids_from_s3(output_prefix))))
+        stage.add('rows_out', len(existing_report_ids))
+
+    # Step 2: Read input files in parallel, once a stage that still has to run needs them. An as-of run
+    # materializes reactions and indications only for the matched reports, unless the aggregates or
+    # signals need the whole tables.
+    data = {}
+    deferred = [] if extract_snapshot is None or aggregate_output_enabled or signal_output_enabled \
+        else ['reactions', 'report_drug_indication']
+
+    def inputs(matched_report_ids=None):
+        if not data:
+            data.update(read_input_files([key for key in READ_INPUT_KEYS if key not in deferred]))
+        if deferred and matched_report_ids is not None and deferred[0] not in data:
+            data.update(read_input_files(deferred, matched_report_ids))
+        return data
+
+    # Steps 3-4: Parse drug names and find the REPORT_IDs matching them
+    def match_reports():
+        logging.info("Starting parsing drugnames...")
+        drug_names = parse_drug_names(inputs()['drug_names'])
+
+        # The aggregates and signals count the fuzzy-only matches too
+        fuzzy_matches = find_fuzzy_drug_matches({DEFAULT_TENANT: drug_names}, data['report_drug']) \
+            if fuzzy_match_enabled else {}
+        with metrics.stage('find_report_ids', rows_in=len(data['report_drug'])) as stage:
+            filter_report_ids = find_report_ids(drug_names, data['report_drug'], fuzzy_matches)
+            stage.add('rows_out', len(filter_report_ids))
+
+        with metrics.stage('filter_by_source', rows_in=len(filter_report_ids)) as stage:
+            report_ids = filter_report_ids_by_source(filter_report_ids, data['reports'])
+            stage.add('rows_out', len(report_ids))
+        return {'drug_names': drug_names, 'report_ids': report_ids, 'fuzzy_names': fuzzy_drug_names(fuzzy_matches)}
+
+    matched = checkpointed('matched_reports', match_reports)
+    drug_names, report_ids, fuzzy_names = matched['drug_names'], matched['report_ids'], matched['fuzzy_names']
+
+    # Step 5: Extract data based on report IDs, queueing priority alerts as reports are assembled
+    # (if enabled; never for an earlier extract, nor again once an earlier attempt has sent them)
+    alerts_sent = checkpoints is not None and checkpoints.load('priority_alerts') is not None
+    alert_queue, on_report = open_priority_alerts(existing_report_ids, run_id) \
+        if priority_alerts_enabled and extract_snapshot is None and not alerts_sent else (None, None)
+
+    if report_data_memory_budget_mb > 0:
+        # Steps 5-7 as one stream: the spilling join yields each report through the clusters and the
+        # filter into the JSON output, so only about the memory budget of them is held (not checkpointed)
+        with metrics.stage('extract_and_write_output', rows_in=len(report_ids)) as stage:
+            memory_budget = int(report_data_memory_budget_mb * 1024 * 1024)
+            reports = extract_report_data_spilling(report_ids, inputs(report_ids)['reports'], data['reactions'],
+                                                   data['report_drug_indication'], data['report_links'],
+                                                   data['report_drug'], memory_budget, on_report)
+            if report_clusters_enabled:
+                reports = assign_report_clusters_streaming(reports, data)
+            stage.add('rows_out', generate_json_output(iter_new_reports(reports, existing_report_ids), output_prefix,
+                                                       timestamp))
+    else:
+        def join_reports():
+            with metrics.stage('extract_report_data', rows_in=len(report_ids)) as stage:
+                report_data = extract_report_data(report_ids, inputs(report_ids)['reports'], data['reactions'],
+                                                  data['report_drug_indication'], data['report_links'],
+                                                  data['report_drug'], on_report)
+                stage.add('rows_out', len(report_data))
+
+            # Step 5b: Group duplicate and linked reports into clusters (if enabled)
+            if report_clusters_enabled and report_data:
+                with metrics.stage('cluster_reports', rows_in=len(data['report_links'])):
+                    assign_report_clusters(report_data, data)
+            return report_data
+
+        report_data = checkpointed('joined_reports', join_reports)
+        if on_report and checkpoints and 'joined_reports' in checkpoints.reused:
+            # The join was restored, so no report was assembled: screen the restored reports instead. Alerts
+            # an earlier attempt sent before it was killed are sent again rather than risk losing any.
+            for report_id, joined in report_data.items():
+                on_report(report_id, joined)
+
+        # Step 6: Filter new report data that is not already in existing reports
+        new_report_data = filter_new_report_data(report_data, existing_report_ids)
+
+        # Step 7: Generate and save the JSON output to S3 (if there are new reports); a resumed run rewrites
+        # the same key
+        with metrics.stage('write_output', rows_in=len(new_report_data)):
+            generate_json_output(new_report_data, output_prefix, timestamp)
+
+    # Step 8: Per-drug aggregate summary over all matching reports (if enabled)
+    if aggregate_output_enabled:
+        with metrics.stage('aggregates', rows_in=len(report_ids)):
+            generate_aggregate_output(report_ids, drug_names, inputs(), f"{run_prefix}{aggregate_output_prefix}",
+                                      fuzzy_names)
+
+    # Step 9: Ranked PRR/ROR signals for the watchlist against the whole extract (if enabled)
+    if signal_output_enabled:
+        with metrics.stage('detect_signals'):
+            signals = detect_signals(drug_names, inputs(), fuzzy_names)
+            if signals is not None:
+                generate_signal_output(*signals, drug_names, f"{run_prefix}{signal_output_prefix}")
+
+    # Step 10: Wait for the priority alerts sent while the batch output was written
+    if alert_queue is not None:
+        close_priority_alerts(alert_queue)
+        if checkpoints:
+            checkpoints.save('priority_alerts', {'queued': alert_queue.queued})
+
+    # The run is complete; a new invocation with the same id starts over
+    if checkpoints:
+        logging.info(f"Run {run_id} reused checkpoints: {checkpoints.reused}")
+        checkpoints.clear()
 
     logging.info(f"Script execution completed in {time.time() - start_time:.2f} seconds.")
+    return metrics.emit_summary()
+
+
+def main_multi_tenant():
+    # Read the extract tables and the tenant watchlists in parallel
+    with metrics.stage('read_inputs') as stage:
+        with ThreadPoolExecutor() as executor:
+            futures = {
+                'report_drug': executor.submit(read_s3_file, input_bucket, report_drug_file),
+                'reports': executor.submit(read_s3_file, input_bucket, reports_file),
+                'reactions': executor.submit(read_s3_file, input_bucket, reactions_file),
+                'report_links': executor.submit(read_s3_file, input_bucket, report_links_file),
+                'report_drug_indication': executor.submit(read_s3_file, input_bucket, report_drug_indication_file)
+            }
+            watchlists = load_watchlists(watchlist_manifest_file)
+            data = {key: future.result() for key, future in futures.items()}
+        stage.add('rows_out', sum(len(lines) for lines in data.values()))
+
+    process_tenants(watchlists, data)
+
+
+def read_single_report_rows(report_no=None, report_id=None):
+    """
+    Find one report by report_no (or REPORT_ID) in the report index and range-read its rows.
+    Returns (REPORT_ID, {table: lines}), or (None, None) if the report is not in the index.
+    """
+    global report_index
+    from report_index import ReportIndex  # Only needed for single-report requests
+
+    # A cached index may predate the latest ingest; reload it once before giving up
+    for refresh in (False, True):
+        if report_index is None or refresh:
+            report_index = ReportIndex(storage, input_bucket)
+        try:
+            found_id = report_id or report_index.find_report_id(report_no)
+            ranges = report_index.ranges(found_id) if found_id else None
+            if ranges is not None:
+                return found_id, report_index.read_rows(found_id, ranges)
+        except ValueError as e:
+            if refresh:
+                raise
+            logging.warning(f"{e}; reloading the report index.")
+    return None, None
+
+
+def generate_single_report_pdf(report_no=None, report_id=None):
+    """
+    Assemble one report from its indexed rows with the extract_report_data field mapping and
+    render it with lambda-3's native renderer, which follows the lambda-2 template layout.
+    Returns (record, PDF key, seconds spent before rendering), or None if the report is unknown.
+    """
+    from native_pdf import render_reports_pdf  # Only needed for single-report requests
+
+    lookup_start = time.perf_counter()
+    with metrics.stage('read_report_rows') as stage:
+        report_id, rows = read_single_report_rows(report_no, report_id)
+        stage.add('rows_out', sum(len(lines) for lines in rows.values()) if rows else 0)
+    if rows is None:
+        return None
+
+    with metrics.stage('extract_report_data', rows_in=1):
+        report_data = extract_report_data({report_id}, *(rows.get(table, []) for table in (
+            'reports', 'reactions', 'report_drug_indication', 'report_links', 'report_drug')))
+    if report_id not in report_data:
+        # Indexed, but without a usable reports.txt row (e.g. a stale index)
+        logging.warning(f"Report {report_id} is in the report index but could not be assembled.")
+        return None
+    record = format_output_record(report_data[report_id])
+    lookup_seconds = time.perf_counter() - lookup_start
+
+    with metrics.stage('render_pdf', rows_in=1):
+        pdf = render_reports_pdf([record])
+    pdf_key = f"{report_pdf_prefix}{record['report_no'] or report_id}.pdf"
+    with metrics.stage('write_pdf'):
+        storage.write(output_bucket, pdf_key, pdf, 'application/pdf')
+    return record, pdf_key, lookup_seconds
+
+
+def single_report_handler(event, context):
+    """Render the PDF of the report named by event['report_no'] (or event['report_id'])."""
+    metrics.reset(getattr(context, 'aws_request_id', None))
+    report_no, report_id = event.get('report_no'), event.get('report_id')
+    result = generate_single_report_pdf(str(report_no).strip() if report_no else None,
+                                        str(report_id).strip() if report_id else None)
+    if result is None:
+        return {
+            'statusCode': 404,
+            'body': json.dumps(f"Report {report_no or report_id} is not in the current extract."),
+            'metrics': metrics.emit_summary()
+        }
+
+    record, pdf_key, lookup_seconds = result
+    logging.info(f"Report {record['report_no']} assembled in {lookup_seconds:.3f} seconds and written to {pdf_key}.")
+    return {
+        'statusCode': 200,
+        'report_no': record['report_no'],
+        'pdf_key': pdf_key,
+        'pdf_url': storage.url(output_bucket, pdf_key),
+        'lookup_seconds': round(lookup_seconds, 4),
+        'metrics': metrics.emit_summary()
+    }
 
 
 # Lambda handler (can be used in AWS Lambda environment)
+@profiled('lambda-1', storage)
 def lambda_handler(event, context):
     logging.info("Lambda function started.")
 
-    # Simulate parallel S3 reading in AWS Lambda by calling main function (in a single thread for Lambda)
-    main()
+    # {"report_no": ...} re-renders one report from the indexed extract instead of screening it
+    if isinstance(event, dict) and (event.get('report_no') or event.get('report_id')):
+        return single_report_handler(event, context)
+
+    # Simulate parallel S3 reading in AWS Lambda by calling main function (in a single thread for Lambda).
+    # Lambda retries an asynchronous invocation with the same request id, so a retry resumes from the
+    # run's checkpoints; {"run_id": ...} resumes a run explicitly.
+    # {"as_of": "YYYY-MM-DD"} (or a history version number) screens the extract of that date.
+    run_id = event.get('run_id') if isinstance(event, dict) else None
+    as_of = event.get('as_of') if isinstance(event, dict) else None
+    run_metrics = main(run_id or getattr(context, 'aws_request_id', None), as_of)
 
     return {
         'statusCode': 200,
-        'body': json.dumps('Processing completed successfully.')
+        'body': json.dumps('Processing completed successfully.'),
+        'metrics': run_metrics
     }
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    profiled('lambda-1', storage)(main)()  # PROFILE=true profiles local runs
@@ -1,16 +1,34 @@
 import json
-import boto3
 import os
 import time
 from datetime import datetime
 import logging
+from aws_clients import LazyClient
+from checkpoints import open_checkpoints
+from instrumentation import RunMetrics
+from profiling import profiled
+from render_cache import RenderCache, hash_bytes, make_cache_key
+from report_format import format_data
+from storage import get_storage
 
 
-# Initialize the Lambda client to invoke other functions
-lambda_client = boto3.client('lambda')
+logger = logging.getLogger(__name__)
+
+# Stage timings, row/byte counts and AWS call stats for each run
+metrics = RunMetrics('lambda-2')
+
+# Lambda client to invoke other functions and S3 client, built on first use and reused across calls
+lambda_client = LazyClient('lambda', on_create=metrics.instrument)
+s3_client = LazyClient('s3', on_create=metrics.instrument)
+# S3, or the local filesystem when STORAGE_BACKEND=local
+storage = get_storage(s3_client)
+
+class ChainingError(Exception):
+    """The email Lambda could not be invoked; the run's checkpoints are kept so a retry only re-invokes it."""
+
 
 def invoke_cvp2_email_lambda():
-    """Invoke the CVP2_EMAIL Lambda function."""
+    """Invoke the CVP2_EMAIL Lambda function. Returns True if the invocation was accepted."""
     try:
         # You can pass an event or data to the second Lambda if required, modify as necessary
         response = lambda_client.invoke(
@@ -21,18 +39,17 @@ def invoke_cvp2_email_lambda():
 
         # Log the response from Lambda invocation
         print(f"Successfully invoked CVP2_EMAIL Lambda: {response}")
+        return True
     except Exception as e:
         print(f"Error invoking CVP2_EMAIL Lambda: {str(e)}")
+        return False
 
 
 def load_json_from_s3(bucket_name, directory):
     """Fetch the latest JSON file from the specified S3 directory."""
-    s3_client = boto3.client('s3')
-
     try:
         # List all objects in the given directory
-        response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=directory)
-        files = response.get('Contents', [])
+        files = storage.list(bucket_name, directory)
 
         if not files:
             print(f"No files found in {directory}.")
@@ -46,8 +63,7 @@ def load_json_from_s3(bucket_name, directory):
         print(f"Latest file: {latest_file}")
 
         # Fetch the latest file from S3
-        file_obj = s3_client.get_object(Bucket=bucket_name, Key=latest_file)
-        file_content = file_obj['Body'].read().decode('utf-8')
+        file_content = storage.read_bytes(bucket_name, latest_file).decode('utf-8')
 
         # Parse JSON content
         json_data = json.loads(file_content)
@@ -58,22 +74,6 @@ def load_json_from_s3(bucket_name, directory):
         return None
 
 
-def split_comma_values(value):
-    """Helper function to split comma-separated values and remove placeholders."""
-    placeholders = ["{{health_product_role}}", "{{dosage_form}}", "{{route_of_administration}}",
-                    "{{dose}}", "{{frequency}}", "{{therapy_duration}}", "{{indication}}",
-                    "{{meddra_version}}", "{{reaction_duration}}"]
-    values = [v.strip() for v in value.split(',') if v.strip() not in placeholders]
-    
-
-    return values
-
-
-def format_combined_values(quantity, unit):
-    """Combine quantity and unit into a single string."""
-    return f"{quantity} {unit}" if quantity and unit else ""
-
-
 def generate_html_from_template(item, formatted_data, template_html):
     """Generate HTML content for one report using the provided template."""
     # Replace placeholders in the HTML template with dynamic values
@@ -147,46 +147,26 @@ def generate_html_from_template(item, formatted_data, template_html):
         return ""
 
 
-def format_data(item):
-    """Formats the data and handles comma-separated values."""
-    fields = {
-        'drug_name': split_comma_values(item.get('drug_name', '')),
-        'drug_involvement': split_comma_values(item.get('drug_involvement', '')),
-        'dosage_form': split_comma_values(item.get('dosage_form_eng', '')),
-        'route': split_comma_values(item.get('route_admin', '')),
-        'unit_dose': split_comma_values(item.get('unit_dose_qty', '')),
-        'dose_unit': split_comma_values(item.get('dose_unit_eng', '')),
-        'freq_time': split_comma_values(item.get('freq_time_unit_eng', '')),
-        'therapy_duration': split_comma_values(item.get('therapy_duration', '')),
-        'therapy_unit': split_comma_values(item.get('therapy_duration_unit_eng', '')),
-        'indication': split_comma_values(item.get('indication_eng', '')),
-        'pt_name': split_comma_values(item.get('pt_name_eng', '')),
-        'meddra_version': split_comma_values(item.get('meddra_version', '')),
-        'duration': split_comma_values(item.get('duration', '')),
-        'duration_unit': split_comma_values(item.get('duration_unit_eng', '')),
-    }
-
-    fields['dose'] = [format_combined_values(qty, unit) for qty, unit in zip(fields['unit_dose'], fields['dose_unit'])]
-    fields['therapy_duration'] = [format_combined_values(dur, unit) for dur, unit in
-                                  zip(fields['therapy_duration'], fields['therapy_unit'])]
-    
-   
-    # Ensure that drug names are sorted alphabetically
-    fields['drug_name'] = sorted(fields['drug_name'])
-    fields['pt_name'] = sorted(fields['pt_name'])
-    return fields
-
-
-def generate_input_html(json_data, template_html):
+def render_report_html(item, template_html):
+    """Render the HTML for a single report."""
+    formatted_data = format_data(item)
+    return generate_html_from_template(item, formatted_data, template_html)
+
+
+def generate_input_html(json_data, template_html, render_cache=None):
     """Generate the complete input.html file that contains all reports."""
     report_htmls = []
+    template_hash = hash_bytes(template_html)
 
     for index, item in enumerate(json_data):
-        formatted_data = format_data(item)
-        report_html = generate_html_from_template(item, formatted_data, template_html)
+        if render_cache:
+            # Reports already rendered with this exact template are served from the cache
+            cache_key = make_cache_key('html', item, template_hash)
+            report_html = render_cache.get_or_render(
+                cache_key, lambda: render_report_html(item, template_html)).decode('utf-8')
+        else:
+            report_html = render_report_html(item, template_html)
 
-        # Wrap each report in <html></html> tags individually
-        report_html = report_html
         report_htmls.append(report_html)
 
     # Join all reports and return
@@ -196,49 +176,82 @@ def generate_input_html(json_data, template_html):
 
 def upload_html_to_s3(html_content, bucket_name, file_name):
     """Upload the generated HTML content to S3 bucket."""
-    s3_client = boto3.client('s3')
-    s3_client.put_object(Body=html_content, Bucket=bucket_name, Key=file_name, ContentType='text/html')
+    storage.write(bucket_name, file_name, html_content, 'text/html')
 
 
-def main():
+def main(run_id=None):
+    metrics.reset(run_id)
     try:
         # S3 bucket details
         input_bucket = os.getenv("INPUT_BUCKET")  # Bucket containing the report_output directory
         output_bucket = os.getenv("OUTPUT_BUCKET")  # Bucket to upload the generated HTML
         directory = os.getenv("DIRECTORY") # Directory in the input bucket containing the JSON files
-        timestamp = time.strftime('%d_%b_%Y_%H_%M_%S')
+        # A retried run (same run id) resumes after its last completed stage and keeps its output key
+        checkpoints = open_checkpoints(storage, output_bucket, 'lambda-2', run_id)
+        timestamp = checkpoints.run_timestamp() if checkpoints else time.strftime('%d_%b_%Y_%H_%M_%S')
         output_html_file_key = f'input-html/reported_adverse_reaction_{timestamp}.html'  # Path in the output bucket where the file will be uploaded
 
         # Load the latest JSON data from S3
-        json_data = load_json_from_s3(input_bucket, directory)
+        with metrics.stage('load_json') as stage:
+            json_data = load_json_from_s3(input_bucket, directory)
+            stage.add('rows_out', len(json_data or []))
 
-        if json_data:
+        if json_data and checkpoints and checkpoints.load('html_uploaded'):
+            print(f"Resuming run {run_id}: {output_html_file_key} was already uploaded.")
+        elif json_data:
             # Dynamically load the HTML template from the current script's directory
             template_path = os.path.join(os.path.dirname(__file__), 'template.html')
             with open(template_path, 'r') as file:
                 template_html = file.read()
 
-            # Generate the input HTML
-            input_html = generate_input_html(json_data, template_html)
+            # Generate the input HTML, reusing per-report fragments rendered by earlier runs
+            # (the cache's S3 tier is skipped when storage is local)
+            render_cache = RenderCache(s3_client=storage.s3_client)
+            with metrics.stage('render_html', rows_in=len(json_data)) as stage:
+                input_html = generate_input_html(json_data, template_html, render_cache)
+                stage.add('rows_out', len(json_data))
+            print(f"Render cache stats: {json.dumps(render_cache.stats())}")
 
             # Upload the HTML file to S3
-            upload_html_to_s3(input_html, output_bucket, output_html_file_key)
+            with metrics.stage('upload_html'):
+                upload_html_to_s3(input_html, output_bucket, output_html_file_key)
+                if checkpoints:
+                    checkpoints.save('html_uploaded', {'key': output_html_file_key})
             print(f"HTML content successfully uploaded to {output_bucket}/{output_html_file_key}")
+
+        if json_data:
             # Now invoke the CVP2_EMAIL Lambda after successfully completing the tasks
-            invoke_cvp2_email_lambda()  # Trigger the second Lambda function
+            with metrics.stage('invoke_email'):
+                invoked = invoke_cvp2_email_lambda()  # Trigger the second Lambda function
+            if not invoked and checkpoints:
+                raise ChainingError(f"Email Lambda not invoked; run {run_id} can be retried")
+            if not invoked:
+                # Without checkpoints a retry would render and upload the HTML again, so the run carries on
+                print("Email Lambda not invoked; the HTML was uploaded but no email will be sent for it.")
+            elif checkpoints:
+                checkpoints.clear()
 
         else:
             print("Failed to load JSON data from S3.")
 
+    except ChainingError:
+        raise
     except Exception as e:
         print(f"Error during execution: {e}")
 
+    return metrics.emit_summary()
+
 
+@profiled('lambda-2', storage)
 def lambda_handler(event, context):
     """Lambda handler function."""
     try:
-        result = main()
-        return result
+        # Lambda retries a failed asynchronous invocation with the same request id, which resumes the run
+        run_id = (event or {}).get('run_id') or getattr(context, 'aws_request_id', None)
+        run_metrics = main(run_id)
+        return {'statusCode': 200, 'body': 'HTML generation completed.', 'metrics': run_metrics}
+    except ChainingError:
+        raise  # Fail the invocation so Lambda retries it
     except Exception as e:
         logger.error(f"Error in lambda handler: {e}")
         return {'statusCode': 500, 'body': f"Error: {str(e)}"}
@@ -1,15 +1,54 @@
 import json
-import boto3
-import pdfkit
-import PyPDF2
-from concurrent.futures import ThreadPoolExecutor
-from io import BytesIO
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 import time
-from datetime import datetime
-import logging
 import os
-# Initialize the S3 client
-s3_client = boto3.client('s3')
+import re
+from aws_clients import LazyClient
+from checkpoints import open_checkpoints
+from render_cache import RenderCache, hash_bytes, make_cache_key
+from pdf_fanout import PDF_CHUNK_SIZE, LambdaChunkDispatcher, LocalChunkDispatcher, plan_chunks, run_chunks
+from native_pdf import render_reports_pdf
+from instrumentation import RunMetrics
+from profiling import profiled
+from storage import get_storage
+# Stage timings, row/byte counts and AWS call stats for each run
+metrics = RunMetrics('lambda-3')
+# S3 client, built on first use
+s3_client = LazyClient('s3', on_create=metrics.instrument)
+# S3, or the local filesystem when STORAGE_BACKEND=local
+storage = get_storage(s3_client)
+# Lambda client used to invoke chunk workers; synchronous invokes can run up to the 15 minute limit
+lambda_client = LazyClient('lambda', on_create=metrics.instrument, read_timeout=900, retries={'max_attempts': 0})
+
+# Path to the wkhtmltopdf binary
+WKHTMLTOPDF_PATH = os.getenv("WKHTMLTOPDF_PATH")  # Adjust this path as needed (use Lambda Layer for wkhtmltopdf)
+PDF_OPTIONS = {
+    'orientation': 'Landscape',
+    'page-size': 'A4'
+}
+# 'off' renders everything in this invocation, 'lambda' fans chunks out to worker invocations,
+# 'local' fans them out to a local process pool
+PDF_FANOUT = os.getenv("PDF_FANOUT", "off")
+# 'pdfkit' renders lambda-2's HTML with wkhtmltopdf; 'native' draws the template layout straight
+# from lambda-1's JSON records in RECORDS_BUCKET/RECORDS_PREFIX without spawning any process
+PDF_RENDERER = os.getenv("PDF_RENDERER", "pdfkit")
+RECORDS_BUCKET = os.getenv("RECORDS_BUCKET") or os.getenv("INPUT_BUCKET")
+RECORDS_PREFIX = os.getenv("RECORDS_PREFIX", "report_output/")
+NATIVE_BATCH_SIZE = 100  # Reports per natively rendered PDF segment
+# Reports per checkpointed segment when rendering in this invocation; a retried run re-renders
+# only the segments its earlier attempt had not finished
+CHECKPOINT_SEGMENT_SIZE = int(os.getenv("PDF_CHECKPOINT_SEGMENT_SIZE", "200"))
+
+# PDF rendering settings. PDF_BATCH_SIZE / PDF_MAX_WORKERS override the values derived from
+# the CPU count and the Lambda memory size; PDF_RENDER_MODE=single renders one report per process.
+PDF_RENDER_MODE = os.getenv("PDF_RENDER_MODE", "batched")
+PDF_BATCH_SIZE = os.getenv("PDF_BATCH_SIZE")
+PDF_MAX_WORKERS = os.getenv("PDF_MAX_WORKERS")
+WKHTMLTOPDF_PROCESS_MB = 120  # Approximate resident memory of one idle wkhtmltopdf process
+REPORT_MEMORY_MB = 6  # Approximate extra memory per report rendered inside one wkhtmltopdf process
+MAX_BATCH_SIZE = 50
+PAGE_BREAK_HTML = '<div style="page-break-after: always;"></div>'
 
 def get_latest_file_from_s3(bucket_name, prefix):
     """
@@ -21,14 +60,14 @@ def get_latest_file_from_s3(bucket_name, prefix):
     """
     try:
         # List objects in the S3 bucket with the specified prefix (directory)
-        response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
+        objects = storage.list(bucket_name, prefix)
 
         # Check if there are any files in the directory
-        if 'Contents' not in response or len(response['Contents']) == 0:
+        if not objects:
             raise Exception("No files found in the specified directory.")
 
         # Sort the files by 'LastModified' in descending order (most recent first)
-        files = sorted(response['Contents'], key=lambda x: x['LastModified'], reverse=True)
+        files = sorted(objects, key=lambda x: x['LastModified'], reverse=True)
 
         # Get the most recently modified file's key
         latest_file_key = files[0]['Key']
@@ -38,7 +77,372 @@ def get_latest_file_from_s3(bucket_name, prefix):
         print(f"Error retrieving the latest file: {str(e)}")
         return None
 
+def get_render_settings(part_count):
+    """
+    Choose the batch size and worker count for rendering.
+
+    :param part_count: Number of single-report HTML documents to render
+    :return: Tuple of (batch_size, max_workers)
+    """
+    cpu_count = os.cpu_count() or 1
+    memory_mb = int(os.getenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", "1024"))
+
+    # wkhtmltopdf is mostly CPU bound, so run about one process per vCPU as long as they fit in memory
+    if PDF_MAX_WORKERS:
+        max_workers = int(PDF_MAX_WORKERS)
+    else:
+        max_workers = max(1, min(cpu_count + 1, memory_mb // (2 * WKHTMLTOPDF_PROCESS_MB)))
+
+    if PDF_RENDER_MODE == 'single':
+        batch_size = 1
+    elif PDF_BATCH_SIZE:
+        batch_size = int(PDF_BATCH_SIZE)
+    else:
+        # Cap the batch so each worker's process stays within its share of memory, but keep
+        # batches small enough that every worker gets at least one
+        memory_per_worker = memory_mb // max_workers - WKHTMLTOPDF_PROCESS_MB
+        memory_cap = max(1, memory_per_worker // REPORT_MEMORY_MB)
+        spread_cap = -(-part_count // max_workers) if part_count else 1
+        batch_size = max(1, min(MAX_BATCH_SIZE, memory_cap, spread_cap))
+
+    return batch_size, max_workers
+
+
+def combine_html_parts(html_parts):
+    """
+    Combine several single-report HTML documents into one document.
+
+    Every report starts on a new page, exactly as if it had been rendered on its own.
+
+    :param html_parts: List of complete HTML documents generated from template.html
+    :return: A single HTML document string
+    """
+    if len(html_parts) == 1:
+        return html_parts[0]
+
+    # All reports come from the same template, so the first report's <head> serves every page
+    head_match = re.search(r'<head>.*?</head>', html_parts[0], re.DOTALL)
+    head = head_match.group(0) if head_match else ''
+
+    bodies = []
+    for part in html_parts:
+        body_match = re.search(r'<body[^>]*>(.*)</body>', part, re.DOTALL)
+        bodies.append(body_match.group(1) if body_match else part)
+
+    return f"<html>{head}<body>{PAGE_BREAK_HTML.join(bodies)}</body></html>"
+
+
+def render_pdf_parts(html_parts, config, options, render_cache=None, batch_size=1, max_workers=5, window=None):
+    """
+    Render HTML documents to PDF, sending batch_size reports to each wkhtmltopdf invocation.
+
+    PDFs are yielded in output order as they finish. At most `window` batches are rendered or
+    waiting to be consumed at any time, which bounds the memory held by finished parts.
+
+    With a render cache, every report is looked up under its own single-report key first and
+    only the misses are batched. A batch of one is stored back under its report's key; larger
+    batches are not cached because the merged PDF cannot be split back into reports, so run with
+    PDF_RENDER_MODE=single to fill the cache.
+
+    :param html_parts: List of single-report HTML documents, in output order
+    :param config: pdfkit configuration pointing at the wkhtmltopdf binary
+    :param options: wkhtmltopdf options
+    :param render_cache: Optional RenderCache consulted for each report before it is rendered
+    :param batch_size: Number of reports per wkhtmltopdf invocation
+    :param max_workers: Number of concurrent wkhtmltopdf processes
+    :param window: Maximum number of batches in flight (defaults to twice max_workers)
+    :return: Generator of PDF byte strings, one per batch or cached report, in output order
+    """
+    import pdfkit  # Only needed by the pdfkit renderer
+
+    window = window or 2 * max_workers
+
+    def generate_pdf_from_html(batch):
+        html_string = combine_html_parts(batch)
+        if render_cache and len(batch) == 1:
+            cache_key = make_cache_key('pdf', batch[0], options=options)
+            render_start = time.perf_counter()
+            pdf = pdfkit.from_string(html_string, False, configuration=config, options=options)
+            if pdf:
+                render_cache.put(cache_key, pdf, time.perf_counter() - render_start)
+            return pdf
+        return pdfkit.from_string(html_string, False, configuration=config, options=options)
+
+    def cached_parts():
+        """Yield ready PDF bytes for cache hits and lists of reports still to render for misses."""
+        misses = []
+        for part in html_parts:
+            pdf = render_cache.get(make_cache_key('pdf', part, options=options)) if render_cache else None
+            if pdf is None:
+                misses.append(part)
+                if len(misses) == batch_size:
+                    yield misses
+                    misses = []
+                continue
+            if misses:
+                yield misses
+                misses = []
+            yield pdf
+        if misses:
+            yield misses
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = deque()
+        for item in cached_parts():
+            if isinstance(item, list):
+                in_flight.append(executor.submit(generate_pdf_from_html, item))
+            else:
+                hit = Future()
+                hit.set_result(item)
+                in_flight.append(hit)
+            if len(in_flight) >= window:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def load_html_parts(bucket_name, html_key):
+    """
+    Fetch the HTML generated by lambda-2 and split it into single-report documents.
+
+    :param bucket_name: The name of the S3 bucket
+    :param html_key: The key of the HTML file
+    :return: List of HTML documents, one per report
+    """
+    html_content = storage.read_bytes(bucket_name, html_key).decode('utf-8')  # Decode the content to string
+
+    # Split the HTML content wherever a new <html> tag appears
+    html_parts = html_content.split('<html>')
+
+    # Ensure each part is reconstructed properly
+    return [f"<html>{part.strip()}" for part in html_parts if part.strip()]
+
+
+def load_records(bucket_name, json_key):
+    """
+    Fetch a JSON report file written by lambda-1.
+
+    :param bucket_name: The name of the S3 bucket
+    :param json_key: The key of the JSON file
+    :return: List of report dicts
+    """
+    return json.loads(storage.read_bytes(bucket_name, json_key).decode('utf-8'))
+
+
+def load_render_inputs(renderer, bucket_name, key):
+    """Load the per-report inputs for a renderer: HTML documents for pdfkit, records for native."""
+    if renderer == 'native':
+        return load_records(bucket_name, key)
+    return load_html_parts(bucket_name, key)
+
+
+def render_native_pdf_parts(records, batch_size=NATIVE_BATCH_SIZE):
+    """
+    Render report records directly to PDF, batch_size reports per yielded PDF.
+
+    :param records: List of report dicts, in output order
+    :return: Generator of PDF byte strings, in output order
+    """
+    for start in range(0, len(records), batch_size):
+        yield render_reports_pdf(records[start:start + batch_size])
+
+
+def write_merged_pdf(pdf_parts, bucket_name, pdf_key):
+    """
+    Merge PDFs in order and stream the result to S3.
+
+    Each part is appended as soon as it is ready and the merged bytes go up through a
+    multipart upload, so the whole file is never held in memory.
+
+    :param pdf_parts: Iterable of PDF byte strings, in output order
+    :param bucket_name: The name of the S3 bucket
+    :param pdf_key: The key of the merged PDF
+    """
+    from pdf_stream_merge import StreamingPdfMerger  # Imports PyPDF2, which only merging needs
+
+    pdf_writer = storage.open_writer(bucket_name, pdf_key, 'application/pdf')
+    try:
+        pdf_merger = StreamingPdfMerger(pdf_writer)
+        for pdf_part in pdf_parts:
+            pdf_merger.append(pdf_part)
+        pdf_merger.close()
+        pdf_writer.close()
+    except Exception:
+        pdf_writer.abort()
+        raise
+
+
+def render_and_upload(html_parts, bucket_name, pdf_key, renderer='pdfkit'):
+    """
+    Render reports to one merged PDF in S3.
+
+    :param html_parts: HTML documents (pdfkit renderer) or report records (native renderer)
+    :return: Render cache statistics for this call
+    """
+    if renderer == 'native':
+        print(f"Rendering {len(html_parts)} reports with the native renderer")
+        write_merged_pdf(render_native_pdf_parts(html_parts), bucket_name, pdf_key)
+        return {}
+
+    import pdfkit  # Only needed by the pdfkit renderer
+
+    # Specify the wkhtmltopdf executable in pdfkit configuration
+    config = pdfkit.configuration(wkhtmltopdf=WKHTMLTOPDF_PATH)
+
+    # Rendered PDFs are cached by the hash of their HTML and the renderer options;
+    # the HTML itself is derived from the record and template.html by lambda-2
+    render_cache = RenderCache(s3_client=storage.s3_client)
+
+    # Render several reports per wkhtmltopdf process to amortize WebKit start-up
+    batch_size, max_workers = get_render_settings(len(html_parts))
+    print(f"Rendering {len(html_parts)} reports in batches of {batch_size} with {max_workers} workers")
+    pdf_parts = render_pdf_parts(html_parts, config, PDF_OPTIONS, render_cache,
+                                 batch_size=batch_size, max_workers=max_workers)
+    write_merged_pdf(pdf_parts, bucket_name, pdf_key)
+
+    cache_stats = render_cache.stats()
+    print(f"Render cache stats: {json.dumps(cache_stats)}")
+    return cache_stats
+
+
+def render_with_checkpoints(html_parts, bucket_name, pdf_key, checkpoints, renderer='pdfkit'):
+    """
+    Render reports to one merged PDF in S3 through segment PDFs kept with the run's checkpoints.
+
+    Each segment is written in one atomic upload, so a segment that exists is complete and a
+    retried run renders only the missing ones before merging them all in order.
+
+    :param checkpoints: RunCheckpoints of this run
+    :return: Render cache statistics summed over the segments rendered by this call
+    """
+    segments = plan_chunks(len(html_parts), checkpoints.run_id, {}, chunk_size=CHECKPOINT_SEGMENT_SIZE,
+                           chunk_prefix=checkpoints.key('segments/'))
+    cache_stats = {}
+    reused = 0
+    for segment in segments:
+        if s3_object_exists(checkpoints.bucket, segment['output_key']):
+            reused += 1
+            continue
+        segment_stats = render_and_upload(html_parts[segment['start']:segment['end']], checkpoints.bucket,
+                                          segment['output_key'], renderer)
+        for name in ('hits', 'misses', 'time_saved_seconds'):
+            if name in segment_stats:
+                cache_stats[name] = round(cache_stats.get(name, 0) + segment_stats[name], 3)
+    if cache_stats:
+        lookups = cache_stats['hits'] + cache_stats['misses']
+        cache_stats['hit_ratio'] = round(cache_stats['hits'] / lookups, 4) if lookups else 0.0
+    print(f"Rendered {len(segments) - reused} of {len(segments)} segments ({reused} reused from an earlier attempt)")
+
+    segment_keys = [segment['output_key'] for segment in segments]
+    write_merged_pdf(read_s3_objects(checkpoints.bucket, segment_keys), bucket_name, pdf_key)
+    return cache_stats
+
+
+def render_chunk(event):
+    """
+    Worker entry point: render one chunk of reports to its own PDF in S3.
+
+    :param event: Chunk event created by pdf_fanout.plan_chunks
+    :return: Response with the chunk's timing
+    """
+    start_time = time.perf_counter()
+    renderer = event.get('renderer', 'pdfkit')
+    with metrics.stage('load_inputs') as stage:
+        html_parts = load_render_inputs(renderer, event['input_bucket'], event['input_key'])[event['start']:event['end']]
+        stage.add('rows_out', len(html_parts))
+    with metrics.stage('render', rows_in=len(html_parts)):
+        cache_stats = render_and_upload(html_parts, event['output_bucket'], event['output_key'], renderer)
+    seconds = time.perf_counter() - start_time
+    print(f"Chunk {event['chunk_index']} ({len(html_parts)} reports) rendered in {seconds:.2f} seconds")
+
+    return {
+        'statusCode': 200,
+        'chunk_index': event['chunk_index'],
+        'output_key': event['output_key'],
+        'reports': len(html_parts),
+        'seconds': round(seconds, 3),
+        'render_cache': cache_stats,
+        'metrics': metrics.emit_summary()
+    }
+
+
+def s3_object_exists(bucket_name, key):
+    """Return True if the key exists in the bucket."""
+    return storage.exists(bucket_name, key)
+
+
+def read_s3_objects(bucket_name, keys):
+    """Yield the body of each key in turn, holding only one in memory at a time."""
+    for key in keys:
+        yield storage.read_bytes(bucket_name, key)
+
+
+def get_chunk_dispatcher(context):
+    """Return the dispatcher for PDF_FANOUT: 'lambda' invokes worker Lambdas, 'local' uses a process pool."""
+    if PDF_FANOUT == 'local':
+        return LocalChunkDispatcher(render_chunk)
+    function_name = os.getenv("PDF_WORKER_FUNCTION") or getattr(context, 'function_name', None)
+    return LambdaChunkDispatcher(lambda_client, function_name)
+
+
+def coordinate_chunks(html_parts, input_bucket_name, input_key, output_bucket_name, output_pdf_key,
+                      dispatcher, run_id, renderer='pdfkit'):
+    """
+    Fan the reports out to workers in chunks, then merge the chunk PDFs in order.
+
+    :return: List of per-chunk timing dicts
+    """
+    base_event = {
+        'input_bucket': input_bucket_name,
+        'input_key': input_key,
+        'output_bucket': output_bucket_name,
+        'renderer': renderer
+    }
+    chunk_events = plan_chunks(len(html_parts), run_id, base_event)
+    chunk_timings = run_chunks(chunk_events, dispatcher,
+                               lambda key: s3_object_exists(output_bucket_name, key))
+    for timing in chunk_timings:
+        print(f"Chunk timing: {json.dumps(timing)}")
+
+    # Final ordered merge of the chunk PDFs; the chunks are only needed until it has succeeded
+    chunk_keys = [chunk_event['output_key'] for chunk_event in chunk_events]
+    write_merged_pdf(read_s3_objects(output_bucket_name, chunk_keys), output_bucket_name, output_pdf_key)
+    for chunk_key in chunk_keys:
+        storage.delete(output_bucket_name, chunk_key)
+    return chunk_timings
+
+
+def get_run_id(input_key, renderer):
+    """
+    Run id of rendering input_key: the same input, renderer and render settings give the same id,
+    so a retry reuses finished chunks but a re-render with other settings does not.
+    """
+    settings = {
+        'input_key': input_key,
+        'renderer': renderer,
+        'pdf_options': PDF_OPTIONS,
+        'render_mode': PDF_RENDER_MODE,
+        'native_batch_size': NATIVE_BATCH_SIZE
+    }
+    return hash_bytes(json.dumps(settings, sort_keys=True).encode('utf-8'))[:16]
+
+
+@profiled('lambda-3', storage)
 def lambda_handler(event, context):
+    event = event or {}
+    metrics.reset(event.get('run_id') or getattr(context, 'aws_request_id', None))
+
+    # Worker invocations dispatched by a coordinator render a single chunk
+    if event.get('mode') == 'render_chunk':
+        try:
+            return render_chunk(event)
+        except Exception as e:
+            return {
+                'statusCode': 500,
+                'chunk_index': event.get('chunk_index'),
+                'body': json.dumps(f"Error rendering chunk: {str(e)}")
+            }
+
     # Source S3 bucket and key for the input HTML
     input_bucket_name = os.getenv("INPUT_BUCKET")  # Replace with your input bucket name
     input_html_prefix = os.getenv("INPUT_HTML_PREFIX")  # Directory or folder in the S3 bucket
@@ -47,12 +451,15 @@ def lambda_handler(event, context):
     output_bucket_name = os.getenv("OUTPUT_BUCKET")  # Replace with your output bucket name
     output_pdf_key = f'output-pdf/reported_adverse_reaction_{timestamp}.pdf'  # Path in the bucket where the PDF will be stored
 
-    # Path to the wkhtmltopdf binary
-    wkhtmltopdf_path = os.getenv("WKHTMLTOPDF_PATH")  # Adjust this path as needed (use Lambda Layer for wkhtmltopdf)
+    renderer = event.get('renderer', PDF_RENDERER)
+    if renderer == 'native':
+        # The native renderer works from lambda-1's JSON records instead of lambda-2's HTML
+        input_bucket_name, input_html_prefix = RECORDS_BUCKET, RECORDS_PREFIX
 
     try:
-        # Get the key of the latest HTML file in the specified directory
-        input_html_key = get_latest_file_from_s3(input_bucket_name, input_html_prefix)
+        # Get the key of the latest HTML (or JSON) file in the specified directory
+        with metrics.stage('find_input'):
+            input_html_key = get_latest_file_from_s3(input_bucket_name, input_html_prefix)
 
         # If no file is found, return an error
         if not input_html_key:
@@ -60,61 +467,47 @@ def lambda_handler(event, context):
                 'statusCode': 500,
                 'body': json.dumps("No files found in the specified S3 folder.")
             }
-        # Fetch the HTML file from the S3 bucket
-        response = s3_client.get_object(Bucket=input_bucket_name, Key=input_html_key)
-        html_content = response['Body'].read().decode('utf-8')  # Decode the content to string
-
-        # Split the HTML content wherever a new <html> tag appears
-        html_parts = html_content.split('<html>')
-
-        # Ensure each part is reconstructed properly
-        formatted_html_parts = [f"<html>{part.strip()}" for part in html_parts if part.strip()]
-
-        # Add page breaks between parts
-        html_with_page_breaks = "<html>".join(
-            [f'{part}<div style="page-break-after: always;"></div>' for part in formatted_html_parts]
-        )
-        # Specify the wkhtmltopdf executable in pdfkit configuration
-        config = pdfkit.configuration(wkhtmltopdf=wkhtmltopdf_path)
-
-        options = {
-            'orientation': 'Landscape',
-            'page-size': 'A4'
-            
-        }
-
-        # Function to generate PDF from a string (HTML)
-        def generate_pdf_from_html(html_string):
-            return pdfkit.from_string(html_string, False, configuration=config, options=options)
+        # Retried invocations on the same input share a run id, reuse the chunks or segments that
+        # already succeeded and write the PDF to the key of their first attempt
+        run_id = event.get('run_id') or get_run_id(input_html_key, renderer)
+        checkpoints = open_checkpoints(storage, output_bucket_name, 'lambda-3', run_id)
+        if checkpoints:
+            output_pdf_key = f'output-pdf/reported_adverse_reaction_{checkpoints.run_timestamp()}.pdf'
 
-        # Use ThreadPoolExecutor to handle HTML parts concurrently
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            pdf_parts = list(executor.map(generate_pdf_from_html, formatted_html_parts))
+        # Fetch the file from the S3 bucket and split it into single reports
+        with metrics.stage('load_inputs') as stage:
+            formatted_html_parts = load_render_inputs(renderer, input_bucket_name, input_html_key)
+            stage.add('rows_out', len(formatted_html_parts))
 
-        # Initialize PyPDF2 PdfMerger
-        pdf_merger = PyPDF2.PdfMerger()
+        if PDF_FANOUT != 'off' and len(formatted_html_parts) > PDF_CHUNK_SIZE:
+            with metrics.stage('fan_out', rows_in=len(formatted_html_parts)):
+                chunk_timings = coordinate_chunks(formatted_html_parts, input_bucket_name, input_html_key,
+                                                  output_bucket_name, output_pdf_key,
+                                                  get_chunk_dispatcher(context), run_id, renderer)
+            if checkpoints:
+                checkpoints.clear()
+            return {
+                'statusCode': 200,
+                'body': json.dumps(f"PDF generated and uploaded to S3 at {output_pdf_key}"),
+                'run_id': run_id,
+                'chunks': chunk_timings,
+                'metrics': metrics.emit_summary()
+            }
 
-        # Merge each PDF part into the final PDF
-        for pdf_part in pdf_parts:
-            pdf_reader = PyPDF2.PdfReader(BytesIO(pdf_part))
-            pdf_merger.append(pdf_reader)
-
-        # Write the combined PDF to a BytesIO object
-        combined_pdf = BytesIO()
-        pdf_merger.write(combined_pdf)
-        combined_pdf.seek(0)  # Reset the stream position
-
-        # Upload the merged PDF to the S3 bucket
-        s3_client.put_object(
-            Bucket=output_bucket_name,
-            Key=output_pdf_key,
-            Body=combined_pdf,
-            ContentType='application/pdf'
-        )
+        with metrics.stage('render', rows_in=len(formatted_html_parts)):
+            if checkpoints:
+                cache_stats = render_with_checkpoints(formatted_html_parts, output_bucket_name, output_pdf_key,
+                                                      checkpoints, renderer)
+                checkpoints.clear()
+            else:
+                cache_stats = render_and_upload(formatted_html_parts, output_bucket_name, output_pdf_key, renderer)
 
         return {
             'statusCode': 200,
-            'body': json.dumps(f"PDF generated and uploaded to S3 at {output_pdf_key}")
+            'body': json.dumps(f"PDF generated and uploaded to S3 at {output_pdf_key}"),
+            'run_id': run_id,
+            'render_cache': cache_stats,
+            'metrics': metrics.emit_summary()
         }
 
     except Exception as e:
@@ -1,12 +1,21 @@
 import os
+import io
+import csv
 import json
-import boto3
-from botocore.exceptions import ClientError
 from datetime import datetime
+from aws_clients import LazyClient
+from instrumentation import RunMetrics
+from profiling import profiled
+from storage import get_storage
 
-# Initialize Boto3 clients
-s3_client = boto3.client('s3')
-ses_client = boto3.client('ses')  # Specify the AWS region from environment variable
+# Stage timings, row/byte counts and AWS call stats for each run
+metrics = RunMetrics('lambda-4')
+
+# Boto3 clients, built on first use
+s3_client = LazyClient('s3', on_create=metrics.instrument)
+ses_client = LazyClient('ses', on_create=metrics.instrument)  # Specify the AWS region from environment variable
+# S3, or the local filesystem when STORAGE_BACKEND=local
+storage = get_storage(s3_client)
 
 # Email settings from environment variables
 SENDER_EMAIL = os.getenv("SENDER_EMAIL")
@@ -16,69 +25,209 @@ RECIPIENT_EMAIL = os.getenv("RECIPIENT_EMAIL")
 BUCKET_NAME = os.getenv('BUCKET_NAME')
 FOLDER_PREFIX = os.getenv('FOLDER_PREFIX')  # 'Adverse_reaction_reports/report_details_output_'
 
+# Digest size settings. SES rejects messages over 10 MB after MIME encoding, so keep the
+# raw HTML well below that. EMAIL_OVERFLOW_MODE decides what happens to a digest that does
+# not fit in one email: 'split' sends numbered emails, 'summary' sends one email with a CSV link.
+EMAIL_BYTE_BUDGET = int(os.getenv('EMAIL_BYTE_BUDGET', str(7 * 1024 * 1024)))
+EMAIL_OVERFLOW_MODE = os.getenv('EMAIL_OVERFLOW_MODE', 'split')
+DIGEST_CSV_PREFIX = os.getenv('DIGEST_CSV_PREFIX', 'email_digest/')
+CSV_LINK_EXPIRY_SECONDS = 7 * 24 * 3600
+# List each duplicate/linked report cluster (lambda-1's cluster_id) once in the digest
+DIGEST_COLLAPSE_LINKED = os.getenv('DIGEST_COLLAPSE_LINKED', 'false').lower() == 'true'
+CSV_COLUMNS = ['sl_no', 'report_no', 'mah_no', 'datintreceived', 'source_eng', 'age', 'age_unit_eng',
+               'gender_eng', 'drug_name', 'pt_name_eng']
+
 def fetch_s3_file(bucket_name, file_key):
     """Fetches JSON file from S3 bucket and parses it."""
     try:
-        response = s3_client.get_object(Bucket=bucket_name, Key=file_key)
-        body_content = response['Body'].read().decode('utf-8')
+        body_content = storage.read_bytes(bucket_name, file_key).decode('utf-8')
 
         if not body_content:
             print(f"Warning: Empty content retrieved from {file_key}.")
             return None
 
         return json.loads(body_content)
-    except ClientError as e:
-        print(f"Error fetching the file: {e}")
-        return None
     except json.JSONDecodeError as e:
         print(f"JSONDecodeError: {e}. Content: {body_content}")
         return None
+    except Exception as e:  # botocore's ClientError, or OSError on local storage
+        print(f"Error fetching the file: {e}")
+        return None
 
-def generate_email_body(data, sent_date):
-    """Generates HTML email body with a single table including all entries."""
-    html_body = f"""
-    <html>
-    <body>
-        <h2 style="color: black; text-align: center; font-size: 24px;">Adverse Reaction Report - Alert</h2>
-        <p style="color: black;">This email contains the results from the extraction of Adverse Reaction Report.</p>
-        <p style="color: black;">The alert results cover the screening period up to <strong>{sent_date}</strong>.</p>
-        <table border="1" cellpadding="5" cellspacing="0">
-            <tr>
-                <th style="color: black;">Sl.No</th>
-                <th style="color: black;">Adverse Reaction Report Number</th>
-                <th style="color: black;">Market Authorization Holder AER Number</th>
-                <th style="color: black;">Initial Received Date</th>
-                <th style="color: black;">Source of Report</th>
-                <th style="color: black;">Age</th>
-                <th style="color: black;">Gender</th>
-                <th style="color: black;">Suspected Product Brand Name</th>
-                <th style="color: black; width: 300px; padding-left: 10px; padding-right: 10px;">Adverse Reaction Terms</th>  <!-- Increased width and padding -->
-            </tr>
-    """
+DIGEST_STYLE = """
+        <style>
+            h2 { color: black; text-align: center; font-size: 24px; }
+            p, th, td { color: black; }
+            th.reactions { width: 300px; padding-left: 10px; padding-right: 10px; }
+        </style>
+"""
 
-    # Add each report as a row
-    for idx, report in enumerate(data, start=1):
-        # formatted_reactions = ', '.join(part.strip().replace(' ', '') for part in report['pt_name_eng'].split(','))       
-        html_body += f"""
+DIGEST_HEADER_ROW = """
             <tr>
-                <td style="color: black;">{idx}</td>
-                <td style="color: black;">{report['report_no']}</td>
-                <td style="color: black;">{report.get('mah_no', 'N/A')}</td>
-                <td style="color: black;">{report['datintreceived']}</td>
-                <td style="color: black;">{report['source_eng']}</td>
-                <td style="color: black;">{report['age']} {report['age_unit_eng']}</td>
-                <td style="color: black;">{report['gender_eng']}</td>
-                <td style="color: black;">{report['drug_name']}</td>
-                <td style="color: black;">{report['pt_name_eng']}</td>
+                <th>Sl.No</th>
+                <th>Adverse Reaction Report Number</th>
+                <th>Market Authorization Holder AER Number</th>
+                <th>Initial Received Date</th>
+                <th>Source of Report</th>
+                <th>Age</th>
+                <th>Gender</th>
+                <th>Suspected Product Brand Name</th>
+                <th class="reactions">Adverse Reaction Terms</th>
             </tr>
-        """
+"""
 
-    html_body += """
+DIGEST_FOOTER = """
         </table>
     </body>
     </html>
+"""
+
+
+def format_report_row(idx, report):
+    """Formats one report as an HTML table row."""
+    return f"""
+            <tr>
+                <td>{idx}</td>
+                <td>{report['report_no']}</td>
+                <td>{report.get('mah_no', 'N/A')}</td>
+                <td>{report['datintreceived']}</td>
+                <td>{report['source_eng']}</td>
+                <td>{report['age']} {report['age_unit_eng']}</td>
+                <td>{report['gender_eng']}</td>
+                <td>{report['drug_name']}</td>
+                <td>{report['pt_name_eng']}</td>
+            </tr>
+"""
+
+
+class EmailDigestBuilder:
+    """
+    Builds the alert digest one row at a time into a list of string chunks.
+
+    Once adding a row would push the current email over byte_budget, the email is closed
+    and the row starts a new one, so every body fits within SES's message size limit.
     """
-    return html_body
+
+    def __init__(self, sent_date, byte_budget=None):
+        self.sent_date = sent_date
+        self.byte_budget = byte_budget or EMAIL_BYTE_BUDGET
+        self.bodies = []
+        self.row_count = 0
+        self._chunks = None
+        self._size = 0
+        self._footer_size = len(DIGEST_FOOTER.encode('utf-8'))
+
+    def _header(self):
+        return f"""
+    <html>
+    <head>{DIGEST_STYLE}    </head>
+    <body>
+        <h2>Adverse Reaction Report - Alert</h2>
+        <p>This email contains the results from the extraction of Adverse Reaction Report.</p>
+        <p>The alert results cover the screening period up to <strong>{self.sent_date}</strong>.</p>
+        <table border="1" cellpadding="5" cellspacing="0">{DIGEST_HEADER_ROW}"""
+
+    def _start_body(self):
+        header = self._header()
+        self._chunks = [header]
+        self._size = len(header.encode('utf-8'))
+
+    def _finish_body(self):
+        self._chunks.append(DIGEST_FOOTER)
+        self.bodies.append("".join(self._chunks))
+        self._chunks = None
+
+    def add_row(self, report):
+        self.row_count += 1
+        row = format_report_row(self.row_count, report)
+        row_size = len(row.encode('utf-8'))
+
+        if self._chunks is None:
+            self._start_body()
+        elif self._size + row_size + self._footer_size > self.byte_budget and len(self._chunks) > 1:
+            self._finish_body()
+            self._start_body()
+
+        self._chunks.append(row)
+        self._size += row_size
+
+    @property
+    def total_bytes(self):
+        return sum(len(body.encode('utf-8')) for body in self.bodies)
+
+    def build(self):
+        """Returns the list of HTML bodies, one per email."""
+        if self._chunks is None and not self.bodies:
+            self._start_body()
+        if self._chunks is not None:
+            self._finish_body()
+        return self.bodies
+
+
+def collapse_linked_reports(data):
+    """Keeps the first report of each cluster and appends the other report numbers of the cluster to its row."""
+    rows, first_by_cluster = [], {}
+    for report in data:
+        cluster_id = report.get('cluster_id')
+        if not cluster_id:
+            rows.append(report)
+        elif cluster_id in first_by_cluster:
+            first_by_cluster[cluster_id]['duplicates'].append(report['report_no'])
+        else:
+            first_by_cluster[cluster_id] = {'report': dict(report), 'duplicates': []}
+            rows.append(first_by_cluster[cluster_id]['report'])
+
+    for cluster in first_by_cluster.values():
+        if cluster['duplicates']:
+            cluster['report']['report_no'] += f" (duplicates: {', '.join(cluster['duplicates'])})"
+    return rows
+
+
+def generate_email_body(data, sent_date):
+    """Generates HTML email body with a single table including all entries."""
+    builder = EmailDigestBuilder(sent_date, byte_budget=float('inf'))
+    for report in data:
+        builder.add_row(report)
+    return builder.build()[0]
+
+
+def generate_email_bodies(data, sent_date, byte_budget=None):
+    """Generates as many HTML email bodies as needed to keep each one under the byte budget."""
+    builder = EmailDigestBuilder(sent_date, byte_budget)
+    for report in data:
+        builder.add_row(report)
+    return builder.build()
+
+
+def generate_summary_body(data, sent_date, csv_url):
+    """Generates a short HTML email that links to the full digest as a CSV file."""
+    return f"""
+    <html>
+    <head>{DIGEST_STYLE}    </head>
+    <body>
+        <h2>Adverse Reaction Report - Alert</h2>
+        <p>This email contains the results from the extraction of Adverse Reaction Report.</p>
+        <p>The alert results cover the screening period up to <strong>{sent_date}</strong>.</p>
+        <p><strong>{len(data)}</strong> new adverse reaction reports were found, too many to list in one email.</p>
+        <p>The full list is available as a CSV file: <a href="{csv_url}">download the report list</a>
+        (the link expires in {CSV_LINK_EXPIRY_SECONDS // 3600} hours).</p>
+    </body>
+    </html>
+"""
+
+
+def upload_digest_csv(data, sent_date):
+    """Uploads the digest rows as a CSV file to S3 and returns a presigned download URL."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for idx, report in enumerate(data, start=1):
+        writer.writerow([idx] + [report.get(key, '') for key in CSV_COLUMNS[1:]])
+
+    csv_key = f"{DIGEST_CSV_PREFIX}adverse_reaction_alert_{sent_date.replace(' ', '_').replace(':', '-')}.csv"
+    storage.write(BUCKET_NAME, csv_key, buffer.getvalue().encode('utf-8'), 'text/csv')
+    return storage.url(BUCKET_NAME, csv_key, expires_in=CSV_LINK_EXPIRY_SECONDS)
+
 
 def send_email(subject, body_html):
     """Sends an email using SES."""
@@ -94,40 +243,85 @@ def send_email(subject, body_html):
             }
         )
         print(f"Email sent! Message ID: {response['MessageId']}")
-    except ClientError as e:
+    except Exception as e:
         print(f"Error sending email: {e}")
 
 def get_latest_file(bucket_name, folder_prefix):
     """Fetches the most recent file based on LastModified date from the specified folder in S3."""
     try:
-        response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=folder_prefix)
-        files = response.get('Contents', [])
+        files = storage.list(bucket_name, folder_prefix)
 
         # Sort files by last modified date and return the key of the most recent file
         files.sort(key=lambda x: x['LastModified'], reverse=True)
         if files:
             return files[0]['Key']
         return None
-    except ClientError as e:
+    except Exception as e:
         print(f"Error fetching the file list: {e}")
         return None
 
+def priority_alert_handler(event, context):
+    """Sends one email per priority alert queued by lambda-1 (SQS-triggered)."""
+    from priority_alerts import send_priority_alert  # Only needed for queued priority alerts
+
+    metrics.reset(getattr(context, 'aws_request_id', None))
+    records = event['Records']
+    failed, times_to_alert = [], []
+    with metrics.stage('priority_alerts', rows_in=len(records)) as stage:
+        for record in records:
+            time_to_alert = send_priority_alert(ses_client, json.loads(record['body']))
+            if time_to_alert is None:
+                failed.append({'itemIdentifier': record['messageId']})
+            else:
+                times_to_alert.append(time_to_alert)
+        stage.add('rows_out', len(times_to_alert))
+        if times_to_alert:
+            stage.add('time_to_alert_max_seconds', max(times_to_alert))
+
+    print(f"Sent {len(records) - len(failed)} priority alert(s); {len(failed)} failed.")
+    # Failed messages go back to the queue to be retried (needs ReportBatchItemFailures on the trigger)
+    return {'batchItemFailures': failed, 'metrics': metrics.emit_summary()}
+
+@profiled('lambda-4', storage)
 def lambda_handler(event, context):
     """Main Lambda handler."""
-    latest_file = get_latest_file(BUCKET_NAME, FOLDER_PREFIX)
+    # Messages from lambda-1's priority alert queue are sent immediately, one email per report
+    if isinstance(event, dict) and any(record.get('eventSource') == 'aws:sqs' for record in event.get('Records', [])):
+        return priority_alert_handler(event, context)
+
+    metrics.reset(getattr(context, 'aws_request_id', None))
+    with metrics.stage('find_input'):
+        latest_file = get_latest_file(BUCKET_NAME, FOLDER_PREFIX)
     if not latest_file:
         print("No files found in the specified folder.")
-        return {'statusCode': 200, 'body': 'No files found in the specified folder.'}
+        return {'statusCode': 200, 'body': 'No files found in the specified folder.', 'metrics': metrics.emit_summary()}
 
-    data = fetch_s3_file(BUCKET_NAME, latest_file)
+    with metrics.stage('load_json') as stage:
+        data = fetch_s3_file(BUCKET_NAME, latest_file)
+        stage.add('rows_out', len(data or []))
     if not data:
         print(f"Error retrieving or decoding content from {latest_file}.")
-        return {'statusCode': 200, 'body': f"Error retrieving or decoding content from {latest_file}."}
+        return {'statusCode': 200, 'body': f"Error retrieving or decoding content from {latest_file}.",
+                'metrics': metrics.emit_summary()}
+
+    if DIGEST_COLLAPSE_LINKED:
+        data = collapse_linked_reports(data)
 
     sent_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    email_body = generate_email_body(data, sent_date)
     subject = f"Adverse Reaction Alert - {sent_date}"
-    
-    send_email(subject, email_body)
+    with metrics.stage('build_digest', rows_in=len(data)) as stage:
+        email_bodies = generate_email_bodies(data, sent_date)
+
+        if len(email_bodies) > 1 and EMAIL_OVERFLOW_MODE == 'summary':
+            csv_url = upload_digest_csv(data, sent_date)
+            email_bodies = [generate_summary_body(data, sent_date, csv_url)]
+        stage.add('rows_out', len(email_bodies))
+
+    with metrics.stage('send_email', rows_in=len(email_bodies)):
+        for part, email_body in enumerate(email_bodies, start=1):
+            part_subject = subject if len(email_bodies) == 1 else f"{subject} ({part} of {len(email_bodies)})"
+            send_email(part_subject, email_body)
 
-    return {'statusCode': 200, 'body': 'Email sent successfully.'}
+    print(f"Sent {len(email_bodies)} email(s) for {len(data)} reports.")
+    return {'statusCode': 200, 'body': f'{len(email_bodies)} email(s) sent successfully.',
+            'metrics': metrics.emit_summary()}
@@ -0,0 +1,314 @@
+import zlib
+
+from report_format import format_data
+
+# A4 landscape page, in points, matching the pdfkit options used by lambda-3
+PAGE_WIDTH = 842
+PAGE_HEIGHT = 595
+MARGIN = 36
+CONTENT_WIDTH = PAGE_WIDTH - 2 * MARGIN
+FONT_SIZE = 8
+LEADING = FONT_SIZE * 1.25
+CELL_PADDING = 4
+HEADER_FILL = (0.663, 0.663, 0.663)  # #A9A9A9, the template's table header colour
+
+# Glyph widths (1/1000 em) for characters 32-126 of the standard Helvetica fonts, which every
+# PDF viewer provides, so no font has to be embedded
+HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278, 556, 556, 556, 556,
+    556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556, 1015, 667, 667, 722, 722, 667, 611, 778,
+    722, 278, 500, 667, 556, 833, 722, 778, 667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278,
+    278, 278, 469, 556, 333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584
+]
+HELVETICA_BOLD_WIDTHS = [
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278, 556, 556, 556, 556,
+    556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611, 975, 722, 722, 722, 722, 667, 611, 778,
+    722, 278, 556, 722, 611, 833, 722, 778, 667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333,
+    278, 333, 584, 556, 333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584
+]
+DEFAULT_GLYPH_WIDTH = 556
+
+
+def text_width(text, size=FONT_SIZE, bold=False):
+    """Width of a string in points."""
+    widths = HELVETICA_BOLD_WIDTHS if bold else HELVETICA_WIDTHS
+    total = 0
+    for char in text:
+        code = ord(char)
+        total += widths[code - 32] if 32 <= code <= 126 else DEFAULT_GLYPH_WIDTH
+    return total * size / 1000
+
+
+def wrap_text(text, width, size=FONT_SIZE, bold=False):
+    """Split text into lines that fit within width, breaking long words like CSS word-wrap does."""
+    lines = []
+    for paragraph in str(text).split('\n'):
+        line = ''
+        for word in paragraph.split(' '):
+            candidate = f"{line} {word}" if line else word
+            if text_width(candidate, size, bold) <= width:
+                line = candidate
+                continue
+            if line:
+                lines.append(line)
+            # Break a word that is wider than the cell on its own
+            line = ''
+            for char in word:
+                if line and text_width(line + char, size, bold) > width:
+                    lines.append(line)
+                    line = ''
+                line += char
+        lines.append(line)
+    return lines
+
+
+def escape_pdf_text(text):
+    """Encode text for a PDF string literal in WinAnsiEncoding."""
+    data = text.encode('cp1252', errors='replace')
+    return data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+class Cell:
+    """A table cell: its text and whether it is styled like a <th>."""
+
+    def __init__(self, text, header=False, align='center'):
+        self.text = '' if text is None else str(text)
+        self.header = header
+        self.align = align
+
+
+class PdfDocument:
+    """Collects page content streams and serializes them as a PDF."""
+
+    def __init__(self):
+        self.pages = []
+        self._ops = None
+        self.y = 0
+        self.new_page()
+
+    def new_page(self):
+        self._ops = []
+        self.pages.append(self._ops)
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def ensure_space(self, height):
+        """Start a new page if height points do not fit on the current one."""
+        if self.y - height < MARGIN and self.y < PAGE_HEIGHT - MARGIN:
+            self.new_page()
+
+    def rect(self, x, y, width, height, fill=None, stroke=True):
+        if fill:
+            self._ops.append(f"{fill[0]:.3f} {fill[1]:.3f} {fill[2]:.3f} rg {x:.2f} {y:.2f} {width:.2f} {height:.2f} re f 0 g".encode('ascii'))
+        if stroke:
+            self._ops.append(f"{x:.2f} {y:.2f} {width:.2f} {height:.2f} re S".encode('ascii'))
+
+    def line(self, x1, y1, x2, y2, width=1):
+        self._ops.append(f"{width} w {x1:.2f} {y1:.2f} m {x2:.2f} {y2:.2f} l S 0.5 w".encode('ascii'))
+
+    def text(self, x, y, text, size=FONT_SIZE, bold=False):
+        font = b'/F2' if bold else b'/F1'
+        self._ops.append(b"BT " + font + f" {size} Tf {x:.2f} {y:.2f} Td (".encode('ascii')
+                         + escape_pdf_text(text) + b") Tj ET")
+
+    def centered_text(self, y, text, size, bold=False):
+        self.text(MARGIN + (CONTENT_WIDTH - text_width(text, size, bold)) / 2, y, text, size, bold)
+
+    def to_bytes(self):
+        """Serialize every page into a single PDF file."""
+        objects = [
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            None,  # Page tree, filled in once the page objects are numbered
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+        ]
+        page_numbers = []
+        for ops in self.pages:
+            content = zlib.compress(b"0.5 w\n" + b"\n".join(ops))
+            objects.append(b"<< /Length " + str(len(content)).encode('ascii') + b" /Filter /FlateDecode >>\nstream\n"
+                           + content + b"\nendstream")
+            objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [ 0 0 {PAGE_WIDTH} {PAGE_HEIGHT} ] "
+                           f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> "
+                           f"/Contents {len(objects)} 0 R >>".encode('ascii'))
+            page_numbers.append(len(objects))
+        kids = " ".join(f"{number} 0 R" for number in page_numbers)
+        objects[1] = f"<< /Type /Pages /Kids [ {kids} ] /Count {len(page_numbers)} >>".encode('ascii')
+
+        pdf = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(pdf))
+            pdf += f"{number} 0 obj\n".encode('ascii') + body + b"\nendobj\n"
+        xref_position = len(pdf)
+        pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('ascii')
+        for offset in offsets:
+            pdf += f"{offset:010d} 00000 n \n".encode('ascii')
+        pdf += (f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+                f"startxref\n{xref_position}\n%%EOF\n").encode('ascii')
+        return bytes(pdf)
+
+
+def row_height(row, column_widths):
+    line_counts = [len(wrap_text(cell.text, width - 2 * CELL_PADDING, bold=cell.header))
+                   for cell, width in zip(row, column_widths)]
+    return max(line_counts) * LEADING + 2 * CELL_PADDING
+
+
+def draw_row(document, row, column_widths, x, top):
+    """Draw one table row with its top edge at `top`; returns the row height."""
+    height = row_height(row, column_widths)
+    for cell, width in zip(row, column_widths):
+        document.rect(x, top - height, width, height, fill=HEADER_FILL if cell.header else None)
+        line_y = top - CELL_PADDING - FONT_SIZE
+        for line in wrap_text(cell.text, width - 2 * CELL_PADDING, bold=cell.header):
+            if cell.align == 'left':
+                line_x = x + CELL_PADDING
+            else:
+                line_x = x + (width - text_width(line, bold=cell.header)) / 2
+            document.text(line_x, line_y, line, bold=cell.header)
+            line_y -= LEADING
+        x += width
+    return height
+
+
+SECTION_HEADING_HEIGHT = FONT_SIZE + 2 * CELL_PADDING + 6
+
+
+def draw_section_heading(document, title, note=None):
+    """Draw a bordered, bold section label like the template's .section-heading."""
+    height = SECTION_HEADING_HEIGHT - 6
+    width = text_width(title, bold=True) + 2 * CELL_PADDING
+    document.y -= 6
+    document.rect(MARGIN, document.y - height, width, height)
+    document.text(MARGIN + CELL_PADDING, document.y - height + CELL_PADDING + 1, title, bold=True)
+    if note:
+        document.text(MARGIN + width + 12, document.y - height + CELL_PADDING + 1, note)
+    document.y -= height
+
+
+def draw_table(document, rows, column_fractions, header_rows=1, x=MARGIN, width=CONTENT_WIDTH,
+               heading=None, note=None):
+    """
+    Draw a table under an optional section heading.
+
+    The heading, the header rows and the first data row are kept together; when the table
+    runs out of room it continues on a new page with the header rows repeated.
+    """
+    column_widths = [width * fraction for fraction in column_fractions]
+    header = rows[:header_rows]
+    first_block = sum(row_height(row, column_widths) for row in rows[:header_rows + 1]) + 6
+    if heading:
+        first_block += SECTION_HEADING_HEIGHT
+    document.ensure_space(first_block)
+
+    if heading:
+        draw_section_heading(document, heading, note)
+    document.y -= 6
+    for index, row in enumerate(rows):
+        height = row_height(row, column_widths)
+        if document.y - height < MARGIN and index > header_rows:
+            document.new_page()
+            for header_row in header:
+                document.y -= draw_row(document, header_row, column_widths, x, document.y)
+        document.y -= draw_row(document, row, column_widths, x, document.y)
+    document.y -= 6
+
+
+def _value(values, index):
+    return values[index] if index < len(values) else ""
+
+
+def draw_report(document, item):
+    """Draw one report, starting on a fresh page, following the layout of template.html."""
+    if document.pages[-1]:
+        document.new_page()
+    formatted_data = format_data(item)
+
+    document.centered_text(document.y - 14, "Canada Vigilance", 14, bold=True)
+    document.centered_text(document.y - 32, "Summary of Reported Adverse Reactions", 12, bold=True)
+    document.y -= 42
+    document.line(MARGIN, document.y, MARGIN + CONTENT_WIDTH, document.y, width=2)
+    document.y -= 6
+
+    # Report information
+    draw_table(document, [
+        [Cell(title, header=True) for title in (
+            "Adverse Reaction Report Number", "Latest AER Version Number", "Initial Received Date",
+            "Latest Received Date", "Source of Report", "Market Authorization Holder AER Number",
+            "Type of Report", "Reporter Type")],
+        [Cell(item.get(key, '')) for key in (
+            'report_no', 'version_no', 'datintreceived', 'datreceived', 'source_eng', 'mah_no',
+            'report_type_eng', 'reporter_type_eng')]
+    ], [1 / 8] * 8, heading="Report Information", note="***AER = Adverse Reaction Report")
+
+    # Seriousness: a narrow "Serious Report" table beside the table of seriousness flags
+    top = document.y
+    draw_table(document, [
+        [Cell("Serious Report", header=True)],
+        [Cell(item.get('seriousness_eng', ''))]
+    ], [1], width=CONTENT_WIDTH * 0.2)
+    serious_bottom = document.y
+    document.y = top
+    flag_fractions = [0.21, 0.05, 0.21, 0.05, 0.43, 0.05]
+    draw_table(document, [
+        [Cell("Death", header=True), Cell(item.get('death', '')),
+         Cell("Disability", header=True), Cell(item.get('disability', '')),
+         Cell("Congenital Anomaly", header=True), Cell(item.get('congenital_anomaly', ''))],
+        [Cell("Life Threatening", header=True), Cell(item.get('life_threatening', '')),
+         Cell("Hospitalization", header=True), Cell(item.get('hospitalization', '')),
+         Cell("Other Medically Important Conditions", header=True), Cell(item.get('other_medically_imp_cond', ''))]
+    ], flag_fractions, header_rows=0, x=MARGIN + CONTENT_WIDTH * 0.25, width=CONTENT_WIDTH * 0.75)
+    document.y = min(document.y, serious_bottom)
+
+    # Patient information
+    draw_table(document, [
+        [Cell(title, header=True) for title in ("Age", "Gender", "Height", "Weight", "Report Outcome")],
+        [Cell(item.get('age', '') + ' ' + item.get('age_unit_eng', '')),
+         Cell(item.get('gender_eng', '')),
+         Cell(item.get('height', '') + ' ' + item.get('height_unit_eng', '')),
+         Cell(item.get('weight', '') + ' ' + item.get('weight_unit_eng', '')),
+         Cell(item.get('outcome_eng', ''))]
+    ], [0.15, 0.15, 0.15, 0.15, 0.4], heading="Patient Information")
+
+    # Link / duplicate information
+    draw_table(document, [
+        [Cell("Record Type", header=True), Cell("Link AER Number", header=True)],
+        [Cell(item.get('record_type_eng', '')), Cell(item.get('report_link_no', ''))]
+    ], [0.5, 0.5], heading="Link / Duplicate Report Information")
+
+    # Product information, one row per drug
+    product_keys = ['drug_name', 'drug_involvement', 'dosage_form', 'route', 'dose', 'freq_time',
+                    'therapy_duration', 'indication']
+    product_rows = [[Cell(_value(formatted_data[key], index), align='left' if key == 'drug_name' else 'center')
+                     for key in product_keys]
+                    for index in range(max(len(formatted_data[key]) for key in product_keys))]
+    draw_table(document, [
+        [Cell(title, header=True) for title in (
+            "Product Description", "Health Product Role", "Dosage Form", "Route of Administration", "Dose",
+            "Frequency", "Therapy Duration", "Indication(s)")]
+    ] + (product_rows or [[Cell("No product data available")] + [Cell('')] * 7]), [1 / 8] * 8,
+        heading="Product Information")
+
+    # Adverse reaction terms, one row per preferred term
+    reaction_rows = [[Cell(pt_name, align='left'),
+                      Cell(_value(formatted_data['meddra_version'], index)),
+                      Cell(f"{_value(formatted_data['duration'], index)} {_value(formatted_data['duration_unit'], index)}")]
+                     for index, pt_name in enumerate(formatted_data['pt_name'])]
+    draw_table(document, [
+        [Cell(title, header=True) for title in ("Adverse Reaction Term(s)", "MedDRA Version", "Reaction Duration")]
+    ] + (reaction_rows or [[Cell("No adverse reaction data available"), Cell(''), Cell('')]]), [1 / 3] * 3,
+        heading="Adverse Reaction Term Information")
+
+
+def render_reports_pdf(items):
+    """
+    Render report records straight to PDF bytes, one or more pages per report.
+
+    :param items: List of report dicts as written by lambda-1
+    :return: PDF file contents
+    """
+    document = PdfDocument()
+    for item in items:
+        draw_report(document, item)
+    return document.to_bytes()
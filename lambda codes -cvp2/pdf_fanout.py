@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Fan-out settings from environment variables
+PDF_CHUNK_SIZE = int(os.getenv("PDF_CHUNK_SIZE", "200"))  # Reports rendered by one worker invocation
+PDF_CHUNK_PREFIX = os.getenv("PDF_CHUNK_PREFIX", "output-pdf/chunks/")
+PDF_CHUNK_RETRIES = int(os.getenv("PDF_CHUNK_RETRIES", "2"))
+PDF_FANOUT_CONCURRENCY = int(os.getenv("PDF_FANOUT_CONCURRENCY", "10"))
+
+
+class LambdaChunkDispatcher:
+    """Runs each chunk in its own synchronous invocation of the worker Lambda."""
+
+    def __init__(self, lambda_client, function_name, max_concurrency=PDF_FANOUT_CONCURRENCY):
+        self.lambda_client = lambda_client
+        self.function_name = function_name
+        self.max_concurrency = max_concurrency
+
+    def _invoke(self, chunk_event):
+        response = self.lambda_client.invoke(
+            FunctionName=self.function_name,
+            InvocationType="RequestResponse",
+            Payload=json.dumps(chunk_event)
+        )
+        payload = json.loads(response['Payload'].read() or 'null')
+        if response.get('FunctionError'):
+            raise Exception(f"Worker error: {payload}")
+        return payload
+
+    def map(self, chunk_events):
+        """Run every chunk and return one result per chunk, in order. Failures are returned as exceptions."""
+        def run(chunk_event):
+            try:
+                return self._invoke(chunk_event)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            return list(executor.map(run, chunk_events))
+
+
+def _call_worker(worker, chunk_event):
+    try:
+        return worker(chunk_event)
+    except Exception as e:
+        return e
+
+
+class LocalChunkDispatcher:
+    """Process-pool stand-in for LambdaChunkDispatcher, for local runs and benchmarks."""
+
+    def __init__(self, worker, max_workers=None):
+        self.worker = worker
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+    def map(self, chunk_events):
+        """Run every chunk and return one result per chunk, in order. Failures are returned as exceptions."""
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(_call_worker, self.worker, chunk_event) for chunk_event in chunk_events]
+            return [future.result() for future in futures]
+
+
+def plan_chunks(part_count, run_id, base_event, chunk_size=PDF_CHUNK_SIZE, chunk_prefix=PDF_CHUNK_PREFIX):
+    """
+    Split part_count reports into chunk events for the workers.
+
+    Chunk output keys are derived from the run id and the report range, so a retried run
+    with the same input finds the chunks that already succeeded.
+
+    :param part_count: Number of reports in the input
+    :param run_id: Identifier shared by every chunk of one run
+    :param base_event: Fields copied into every chunk event (input location, output bucket)
+    :return: List of chunk event dicts, in output order
+    """
+    chunk_events = []
+    for chunk_index, start in enumerate(range(0, part_count, chunk_size)):
+        end = min(start + chunk_size, part_count)
+        chunk_events.append(dict(
+            base_event,
+            mode='render_chunk',
+            run_id=run_id,
+            chunk_index=chunk_index,
+            start=start,
+            end=end,
+            output_key=f"{chunk_prefix}{run_id}/chunk_{start:06d}_{end:06d}.pdf"
+        ))
+    return chunk_events
+
+
+def run_chunks(chunk_events, dispatcher, chunk_exists, retries=PDF_CHUNK_RETRIES):
+    """
+    Render every chunk that does not exist yet, retrying failed chunks only.
+
+    :param chunk_events: Events from plan_chunks
+    :param dispatcher: LambdaChunkDispatcher or LocalChunkDispatcher
+    :param chunk_exists: Callable taking an output key and returning True if it is already stored
+    :param retries: Number of extra attempts for failed chunks
+    :return: List of per-chunk timing dicts, in output order
+    """
+    timings = {}
+    pending = []
+    for chunk_event in chunk_events:
+        if chunk_exists(chunk_event['output_key']):
+            timings[chunk_event['chunk_index']] = {'status': 'reused', 'attempts': 0, 'seconds': 0.0}
+        else:
+            pending.append(chunk_event)
+
+    logging.info(f"Dispatching {len(pending)} of {len(chunk_events)} chunks "
+                 f"({len(chunk_events) - len(pending)} reused from an earlier attempt).")
+
+    attempt = 0
+    while pending and attempt <= retries:
+        attempt += 1
+        dispatch_start = time.perf_counter()
+        results = dispatcher.map(pending)
+        wall_seconds = time.perf_counter() - dispatch_start
+
+        failed = []
+        for chunk_event, result in zip(pending, results):
+            timing = {'attempts': attempt, 'reports': chunk_event['end'] - chunk_event['start']}
+            if isinstance(result, Exception) or not result or result.get('statusCode') != 200:
+                timing.update(status='failed', error=str(result))
+                failed.append(chunk_event)
+            else:
+                timing.update(status='rendered', seconds=result.get('seconds', wall_seconds))
+            timings[chunk_event['chunk_index']] = timing
+        pending = failed
+
+        if pending:
+            logging.warning(f"{len(pending)} chunks failed on attempt {attempt}.")
+
+    if pending:
+        failed_indexes = [chunk_event['chunk_index'] for chunk_event in pending]
+        raise Exception(f"Chunks {failed_indexes} failed after {attempt} attempts.")
+
+    return [dict(timings[chunk_event['chunk_index']], chunk_index=chunk_event['chunk_index'])
+            for chunk_event in chunk_events]
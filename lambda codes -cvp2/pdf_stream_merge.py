@@ -0,0 +1,194 @@
+import logging
+import os
+from array import array
+from io import BytesIO
+
+import PyPDF2
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, StreamObject
+
+# Multipart upload part size (S3 requires at least 5 MiB for every part except the last)
+PDF_UPLOAD_PART_MB = max(5, int(os.getenv("PDF_UPLOAD_PART_MB", "8")))
+
+PAGES_OBJECT_NUMBER = 1
+CATALOG_OBJECT_NUMBER = 2
+
+
+class S3MultipartWriter:
+    """Write-only file-like object that streams its contents to S3 with a multipart upload."""
+
+    def __init__(self, s3_client, bucket, key, content_type='application/pdf',
+                 part_size=PDF_UPLOAD_PART_MB * 1024 * 1024):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.part_size = part_size
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+        self.bytes_written = 0
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_written += len(data)
+        if len(self._buffer) >= self.part_size:
+            self._upload_part()
+        return len(data)
+
+    def _upload_part(self):
+        if self._upload_id is None:
+            # Start the multipart upload lazily so small files can go up with a single put_object
+            response = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type)
+            self._upload_id = response['UploadId']
+
+        part_number = len(self._parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            PartNumber=part_number,
+            UploadId=self._upload_id,
+            Body=bytes(self._buffer)
+        )
+        self._parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+        self._buffer = bytearray()
+
+    def close(self):
+        """Upload any buffered bytes and complete the upload."""
+        if self._upload_id is None:
+            self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer),
+                                      ContentType=self.content_type)
+            self._buffer = bytearray()
+            return
+
+        if self._buffer:
+            self._upload_part()
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            MultipartUpload={'Parts': self._parts}
+        )
+        logging.info(f"Completed multipart upload of {self.key} in {len(self._parts)} parts.")
+
+    def abort(self):
+        """Discard a partially written upload."""
+        if self._upload_id is not None:
+            try:
+                self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            except Exception as e:
+                logging.error(f"Error aborting multipart upload of {self.key}: {e}")
+        self._buffer = bytearray()
+
+
+class StreamingPdfMerger:
+    """
+    Concatenate PDFs page by page into a writable stream.
+
+    Unlike PyPDF2.PdfMerger, every appended document is copied to the output and released
+    immediately; only the byte offset of each written object is kept until close().
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self._position = 0
+        self._offsets = array('Q', [0, 0, 0])  # Index = object number; 1 and 2 are written by close()
+        self._page_numbers = array('Q')
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    @property
+    def page_count(self):
+        return len(self._page_numbers)
+
+    def _write(self, data):
+        self.output.write(data)
+        self._position += len(data)
+
+    def _allocate(self):
+        self._offsets.append(0)
+        return len(self._offsets) - 1
+
+    def _write_object(self, number, obj):
+        self._offsets[number] = self._position
+        buffer = BytesIO()
+        buffer.write(f"{number} 0 obj\n".encode('ascii'))
+        obj.write_to_stream(buffer, None)
+        buffer.write(b"\nendobj\n")
+        self._write(buffer.getvalue())
+
+    def _copy(self, obj, id_map, pending):
+        """Copy a PDF object, renumbering every indirect reference it contains."""
+        if isinstance(obj, IndirectObject):
+            source = (obj.idnum, obj.generation)
+            if source not in id_map:
+                id_map[source] = self._allocate()
+                pending.append((id_map[source], obj))
+            return IndirectObject(id_map[source], 0, None)
+
+        if isinstance(obj, StreamObject):
+            copy = obj.__class__()
+            copy._data = obj._data
+            for key, value in obj.items():
+                if key != '/Length':  # Rewritten from the data by write_to_stream
+                    copy[NameObject(key)] = self._copy(value, id_map, pending)
+            return copy
+
+        if isinstance(obj, DictionaryObject):
+            copy = DictionaryObject()
+            for key, value in obj.items():
+                copy[NameObject(key)] = self._copy(value, id_map, pending)
+            return copy
+
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self._copy(value, id_map, pending) for value in obj)
+
+        return obj
+
+    def append(self, pdf_bytes):
+        """Append every page of a PDF (given as bytes) to the output."""
+        reader = PyPDF2.PdfReader(BytesIO(pdf_bytes))
+        id_map = {}
+        pending = []
+
+        # Number the pages up front so links and annotations that point at a page reuse it
+        pages = []
+        for page in reader.pages:
+            page_number = self._allocate()
+            page_ref = getattr(page, 'indirect_reference', None) or getattr(page, 'indirect_ref', None)
+            if page_ref is not None:
+                id_map[(page_ref.idnum, page_ref.generation)] = page_number
+            pages.append((page_number, page))
+
+        for page_number, page in pages:
+            # PdfReader has already pushed inherited attributes (MediaBox, Resources, ...) onto the page
+            copy = DictionaryObject()
+            for key, value in page.items():
+                if key != '/Parent':
+                    copy[NameObject(key)] = self._copy(value, id_map, pending)
+            copy[NameObject('/Parent')] = IndirectObject(PAGES_OBJECT_NUMBER, 0, None)
+            self._write_object(page_number, copy)
+            self._page_numbers.append(page_number)
+
+            # Write everything the page refers to before moving on
+            while pending:
+                number, source = pending.pop()
+                self._write_object(number, self._copy(source.get_object(), id_map, pending))
+
+    def close(self):
+        """Write the page tree, catalog, cross-reference table and trailer."""
+        kids = " ".join(f"{number} 0 R" for number in self._page_numbers)
+        self._offsets[PAGES_OBJECT_NUMBER] = self._position
+        self._write(f"{PAGES_OBJECT_NUMBER} 0 obj\n<< /Type /Pages /Kids [ {kids} ] "
+                    f"/Count {len(self._page_numbers)} >>\nendobj\n".encode('ascii'))
+        self._offsets[CATALOG_OBJECT_NUMBER] = self._position
+        self._write(f"{CATALOG_OBJECT_NUMBER} 0 obj\n<< /Type /Catalog /Pages {PAGES_OBJECT_NUMBER} 0 R >>"
+                    f"\nendobj\n".encode('ascii'))
+
+        xref_position = self._position
+        xref = BytesIO()
+        xref.write(f"xref\n0 {len(self._offsets)}\n0000000000 65535 f \n".encode('ascii'))
+        for offset in self._offsets[1:]:
+            xref.write(f"{offset:010d} 00000 n \n".encode('ascii'))
+        xref.write(f"trailer\n<< /Size {len(self._offsets)} /Root {CATALOG_OBJECT_NUMBER} 0 R >>\n"
+                   f"startxref\n{xref_position}\n%%EOF\n".encode('ascii'))
+        self._write(xref.getvalue())
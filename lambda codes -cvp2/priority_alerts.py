@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+# Priority alert settings from environment variables. A matched report is a priority report when
+# any of the PRIORITY_ALERT_CRITERIA output fields is "Yes"; it is alerted on its own, right after
+# lambda-1 assembles it, in addition to appearing in lambda-4's batch digest.
+PRIORITY_ALERT_CRITERIA = [name.strip() for name in
+                           os.getenv("PRIORITY_ALERT_CRITERIA", "death,life_threatening,hospitalization").split(',')
+                           if name.strip()]
+# SQS queue lambda-4 consumes alerts from; without one, alerts are sent from an in-process queue
+PRIORITY_ALERT_QUEUE_URL = os.getenv("PRIORITY_ALERT_QUEUE_URL")
+PRIORITY_ALERT_SENDER = os.getenv("PRIORITY_ALERT_SENDER", os.getenv("SENDER_EMAIL"))
+PRIORITY_ALERT_RECIPIENT = os.getenv("PRIORITY_ALERT_RECIPIENT", os.getenv("RECIPIENT_EMAIL"))
+
+# Fields shown in the alert email: (label, output key)
+ALERT_FIELDS = [
+    ('Adverse Reaction Report Number', 'report_no'), ('Market Authorization Holder AER Number', 'mah_no'),
+    ('Initial Received Date', 'datintreceived'), ('Source of Report', 'source_eng'),
+    ('Seriousness', 'seriousness_eng'), ('Outcome', 'outcome_eng'), ('Age', 'age'), ('Gender', 'gender_eng'),
+    ('Suspected Product Brand Name', 'drug_name'), ('Adverse Reaction Terms', 'pt_name_eng')
+]
+
+
+def priority_criteria_met(record, criteria=None):
+    """Return the criteria (output field names) that are "Yes" in record; empty if it is not a priority report."""
+    return [name for name in (criteria or PRIORITY_ALERT_CRITERIA) if record.get(name) == "Yes"]
+
+
+def build_alert_message(record, criteria_met, extract_available_at, run_id=None):
+    """
+    Queue message for one priority report.
+
+    :param extract_available_at: Epoch seconds when the extract the report came from was available
+    """
+    return {
+        'record': record,
+        'criteria': criteria_met,
+        'extract_available_at': extract_available_at,
+        'queued_at': time.time(),
+        'run_id': run_id
+    }
+
+
+def format_alert_email(message):
+    """Return (subject, HTML body) for one priority alert message."""
+    record = message['record']
+    criteria = ', '.join(name.replace('_', ' ') for name in message['criteria'])
+    rows = []
+    for label, key in ALERT_FIELDS:
+        value = f"{record.get('age', '')} {record.get('age_unit_eng', '')}" if key == 'age' else record.get(key, '')
+        rows.append(f"""
+            <tr><th align="left">{label}</th><td>{value}</td></tr>""")
+    rows = "".join(rows)
+    subject = f"Priority Adverse Reaction Alert - {record.get('report_no', '')} ({criteria})"
+    body = f"""
+    <html>
+    <body>
+        <h2>Adverse Reaction Report - Priority Alert</h2>
+        <p>This report meets the priority criteria: <strong>{criteria}</strong>.</p>
+        <p>It will also be listed in the next alert digest.</p>
+        <table border="1" cellpadding="5" cellspacing="0">{rows}
+        </table>
+    </body>
+    </html>
+"""
+    return subject, body
+
+
+def send_priority_alert(ses_client, message):
+    """
+    Email one priority alert through SES.
+
+    :return: Seconds from extract availability to the alert being sent, or None if sending failed
+    """
+    subject, body = format_alert_email(message)
+    try:
+        ses_client.send_email(
+            Source=PRIORITY_ALERT_SENDER,
+            Destination={'ToAddresses': [PRIORITY_ALERT_RECIPIENT]},
+            Message={'Subject': {'Data': subject}, 'Body': {'Html': {'Data': body}}}
+        )
+    except Exception as e:
+        logging.error(f"Error sending priority alert for report {message['record'].get('report_no')}: {e}")
+        return None
+
+    time_to_alert = time.time() - message['extract_available_at']
+    logging.info(f"Priority alert sent for report {message['record'].get('report_no')} "
+                 f"{time_to_alert:.2f} seconds after the extract was available.")
+    return time_to_alert
+
+
+class SqsAlertQueue:
+    """Sends priority alert messages to an SQS queue; lambda-4 is triggered by the queue and emails them."""
+
+    def __init__(self, sqs_client, queue_url=PRIORITY_ALERT_QUEUE_URL):
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+        self.queued = 0
+        self.failed = []
+
+    def _send(self, message):
+        try:
+            self.sqs_client.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(message))
+        except Exception as e:
+            logging.error(f"Error queueing priority alert for report {message['record'].get('report_no')}: {e}")
+            return False
+        return True
+
+    def put(self, message):
+        """Queue one alert; a failed send is logged and retried in close(), so the batch carries on."""
+        self.queued += 1
+        if not self._send(message):
+            self.failed.append(message)
+
+    def close(self):
+        """Retry the alerts that failed to queue; delivery happens in lambda-4. Returns no local timings."""
+        self.failed = [message for message in self.failed if not self._send(message)]
+        return []
+
+
+class LocalAlertQueue:
+    """
+    In-process stand-in for the SQS queue: a worker thread sends each alert as soon as it is put,
+    while the caller carries on with the batch. close() waits for the queue to drain.
+    """
+
+    def __init__(self, send):
+        """
+        :param send: Called with each message; returns the time to alert in seconds, or None
+        """
+        self.send = send
+        self.queued = 0
+        self.times_to_alert = []
+        self.failed = []
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name='priority-alerts', daemon=True)
+        self._worker.start()
+
+    def _run(self):
+        while True:
+            message = self._queue.get()
+            if message is None:
+                return
+            time_to_alert = self.send(message)
+            if time_to_alert is None:
+                self.failed.append(message)
+            else:
+                self.times_to_alert.append(time_to_alert)
+
+    def put(self, message):
+        self._queue.put(message)
+        self.queued += 1
+
+    def close(self):
+        """Wait for every queued alert to be sent and return their times to alert."""
+        self._queue.put(None)
+        self._worker.join()
+        return self.times_to_alert
+
+
+def get_alert_queue(sqs_client, ses_client):
+    """Return the SQS queue when PRIORITY_ALERT_QUEUE_URL is set, else an in-process queue sending through SES."""
+    if PRIORITY_ALERT_QUEUE_URL:
+        return SqsAlertQueue(sqs_client, PRIORITY_ALERT_QUEUE_URL)
+    return LocalAlertQueue(lambda message: send_priority_alert(ses_client, message))
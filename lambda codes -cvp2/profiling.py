@@ -0,0 +1,136 @@
+import cProfile
+import functools
+import io
+import json
+import logging
+import marshal
+import os
+import pstats
+import time
+import tracemalloc
+
+# Profiling settings from environment variables. A single invocation can also opt in with
+# "profile": true (or a mode name) in its event, without redeploying.
+PROFILE_ENABLED = os.getenv("PROFILE", "false").lower() == "true"
+PROFILE_MODE = os.getenv("PROFILE_MODE", "cprofile")  # 'cprofile', 'tracemalloc' or 'all'
+PROFILE_OUTPUT = os.getenv("PROFILE_OUTPUT", "/tmp/profiles/")  # Local directory or s3://bucket/prefix/
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "30"))
+PROFILE_MODES = ('cprofile', 'tracemalloc', 'all')
+
+
+def requested_mode(args):
+    """Return the profiling mode asked for by the environment or the event, or None."""
+    requested = args[0].get('profile') if args and isinstance(args[0], dict) else None
+    if not requested and not PROFILE_ENABLED:
+        return None
+    return requested if requested in PROFILE_MODES else PROFILE_MODE
+
+
+def profiled(function_name, storage=None):
+    """
+    Decorate a handler (or main) so it can be profiled on demand.
+
+    When profiling is off the wrapper only checks a module flag and the event's 'profile'
+    field before calling through.
+
+    :param storage: The lambda's storage, used when PROFILE_OUTPUT is an s3:// location
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            mode = requested_mode(args)
+            if mode is None:
+                return func(*args, **kwargs)
+            context = args[1] if len(args) > 1 else None
+            run_id = getattr(context, 'aws_request_id', None) or time.strftime('%Y%m%d_%H%M%S')
+            return run_profiled(function_name, run_id, mode, func, args, kwargs, storage=storage)
+        return wrapper
+    return decorator
+
+
+def run_profiled(function_name, run_id, mode, func, args, kwargs, output=None, top_n=None, storage=None):
+    """Call func under cProfile and/or tracemalloc and write the artifacts to output (PROFILE_OUTPUT by default)."""
+    output = output or PROFILE_OUTPUT
+    top_n = top_n or PROFILE_TOP_N
+    profiler = cProfile.Profile() if mode in ('cprofile', 'all') else None
+    trace_memory = mode in ('tracemalloc', 'all') and not tracemalloc.is_tracing()
+    if trace_memory:
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - start
+        if profiler:
+            profiler.disable()
+        artifacts = {}
+        summary = {'function': function_name, 'run_id': run_id, 'mode': mode, 'seconds': round(seconds, 4)}
+        if profiler:
+            artifacts.update(cprofile_artifacts(profiler, top_n, summary))
+        if trace_memory:
+            artifacts.update(tracemalloc_artifacts(top_n, summary))
+            tracemalloc.stop()
+        artifacts['summary.json'] = json.dumps(summary, indent=4).encode('utf-8')
+        try:
+            location = write_artifacts(artifacts, output, f"{function_name}/{run_id}/", storage)
+            logging.info(f"Profile for {function_name} written to {location}")
+        except Exception as e:
+            logging.error(f"Error writing profile artifacts: {e}")
+
+
+def cprofile_artifacts(profiler, top_n, summary):
+    """Return the raw profile (loadable with pstats) and a top-N text report; add hot functions to summary."""
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats('cumulative').print_stats(top_n)
+    stats.sort_stats('tottime').print_stats(top_n)
+
+    def top(column):
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][column], reverse=True)[:top_n]
+        return [{'function': f"{path}:{line}({name})", 'calls': calls, 'tottime': round(tottime, 6),
+                 'cumtime': round(cumtime, 6)}
+                for (path, line, name), (_, calls, tottime, cumtime, _) in rows]
+
+    summary['top_cumulative'] = top(3)
+    summary['top_tottime'] = top(2)
+    return {'profile.prof': marshal.dumps(stats.stats), 'profile.txt': stream.getvalue().encode('utf-8')}
+
+
+def tracemalloc_artifacts(top_n, summary):
+    """Return a top-N allocation report by source line; add the peak and top lines to summary."""
+    snapshot = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    lines = snapshot.statistics('lineno')[:top_n]
+    summary['traced_peak_mb'] = round(peak / 2 ** 20, 2)
+    summary['top_allocations'] = [{'line': str(stat.traceback), 'size_kb': round(stat.size / 1024, 1),
+                                   'count': stat.count} for stat in lines]
+    report = "\n".join(str(stat) for stat in lines)
+    return {'memory.txt': f"Peak traced memory: {peak / 2 ** 20:.2f} MiB\n{report}\n".encode('utf-8')}
+
+
+def write_artifacts(artifacts, output, sub_prefix, storage=None):
+    """
+    Write {file name: bytes} under output (a local directory or s3://bucket/prefix/) and return the location.
+
+    :param storage: Storage for s3:// output (default: get_storage() for STORAGE_BACKEND)
+    """
+    if output.startswith('s3://'):
+        if storage is None:
+            from storage import get_storage
+
+            storage = get_storage()
+        bucket, _, prefix = output[len('s3://'):].partition('/')
+        prefix = f"{prefix}{sub_prefix}"
+        for name, body in artifacts.items():
+            storage.write(bucket, f"{prefix}{name}", body)
+        return f"s3://{bucket}/{prefix}"
+
+    directory = os.path.join(output, sub_prefix)
+    os.makedirs(directory, exist_ok=True)
+    for name, body in artifacts.items():
+        with open(os.path.join(directory, name), 'wb') as f:
+            f.write(body)
+    return directory
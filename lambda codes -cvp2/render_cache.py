@@ -0,0 +1,207 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Cache settings from environment variables
+RENDER_CACHE_BUCKET = os.getenv("RENDER_CACHE_BUCKET")  # Leave unset to use only the local /tmp tier
+RENDER_CACHE_PREFIX = os.getenv("RENDER_CACHE_PREFIX", "render_cache/")
+RENDER_CACHE_LOCAL_DIR = os.getenv("RENDER_CACHE_LOCAL_DIR", "/tmp/render_cache")
+RENDER_CACHE_LOCAL_MAX_MB = int(os.getenv("RENDER_CACHE_LOCAL_MAX_MB", "256"))
+
+
+def hash_bytes(data):
+    """Return the hex SHA-256 digest of a str or bytes value."""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_cache_key(kind, content, template_hash='', options=None):
+    """
+    Build a content-addressed cache key.
+
+    :param kind: Artifact type, e.g. 'html' or 'pdf' (also used as the file extension)
+    :param content: The record dict (or rendered source string) the artifact is built from
+    :param template_hash: Hash of template.html, empty when the content already embeds it
+    :param options: Renderer options that affect the output bytes
+    :return: A key of the form '<kind>/<sha256>.<kind>'
+    """
+    payload = json.dumps(
+        {'content': content, 'template': template_hash, 'options': options or {}},
+        sort_keys=True,
+        separators=(',', ':')
+    )
+    return f"{kind}/{hash_bytes(payload)}.{kind}"
+
+
+class RenderCache:
+    """Two-tier cache of rendered artifacts: a local /tmp LRU in front of an S3 prefix."""
+
+    def __init__(self, s3_client=None, bucket=RENDER_CACHE_BUCKET, prefix=RENDER_CACHE_PREFIX,
+                 local_dir=RENDER_CACHE_LOCAL_DIR, local_max_bytes=RENDER_CACHE_LOCAL_MAX_MB * 1024 * 1024):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.local_dir = local_dir
+        self.local_max_bytes = local_max_bytes
+        self._lock = threading.Lock()
+        self._local_index = OrderedDict()  # key -> (size in bytes, render seconds), oldest first
+        self._local_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.time_saved = 0.0
+        self._load_local_index()
+
+    def _local_path(self, key):
+        return os.path.join(self.local_dir, key.replace('/', '_'))
+
+    def _load_local_index(self):
+        """Rebuild the LRU index from files left in /tmp by a previous warm invocation."""
+        try:
+            os.makedirs(self.local_dir, exist_ok=True)
+            entries = []
+            for name in os.listdir(self.local_dir):
+                if name.endswith('.meta'):
+                    continue
+                path = os.path.join(self.local_dir, name)
+                key = name.replace('_', '/', 1)
+                entries.append((os.path.getmtime(path), key, os.path.getsize(path), self._read_meta(path)))
+            for _, key, size, render_seconds in sorted(entries):
+                self._local_index[key] = (size, render_seconds)
+                self._local_bytes += size
+        except OSError as e:
+            logging.warning(f"Render cache local tier unavailable at {self.local_dir}: {e}")
+
+    @staticmethod
+    def _read_meta(path):
+        try:
+            with open(path + '.meta', 'r') as f:
+                return float(f.read() or 0)
+        except (OSError, ValueError):
+            return 0.0
+
+    def _get_local(self, key):
+        with self._lock:
+            if key not in self._local_index:
+                return None, 0.0
+            self._local_index.move_to_end(key)
+            render_seconds = self._local_index[key][1]
+        try:
+            with open(self._local_path(key), 'rb') as f:
+                return f.read(), render_seconds
+        except OSError:
+            with self._lock:
+                size, _ = self._local_index.pop(key, (0, 0.0))
+                self._local_bytes -= size
+            return None, 0.0
+
+    def _put_local(self, key, data, render_seconds):
+        if len(data) > self.local_max_bytes:
+            return
+        path = self._local_path(key)
+        try:
+            with open(path, 'wb') as f:
+                f.write(data)
+            with open(path + '.meta', 'w') as f:
+                f.write(str(render_seconds))
+        except OSError as e:
+            logging.warning(f"Could not write render cache entry {key} to /tmp: {e}")
+            return
+
+        with self._lock:
+            if key in self._local_index:
+                self._local_bytes -= self._local_index[key][0]
+            self._local_index[key] = (len(data), render_seconds)
+            self._local_index.move_to_end(key)
+            self._local_bytes += len(data)
+
+            # Evict least recently used entries until we are back under budget
+            while self._local_bytes > self.local_max_bytes and self._local_index:
+                old_key, (old_size, _) = self._local_index.popitem(last=False)
+                self._local_bytes -= old_size
+                for old_path in (self._local_path(old_key), self._local_path(old_key) + '.meta'):
+                    try:
+                        os.remove(old_path)
+                    except OSError:
+                        pass
+
+    def _get_s3(self, key):
+        if not (self.s3_client and self.bucket):
+            return None, 0.0
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=f"{self.prefix}{key}")
+            render_seconds = float(response.get('Metadata', {}).get('render-seconds', 0) or 0)
+            return response['Body'].read(), render_seconds
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+                logging.warning(f"Render cache S3 lookup failed for {key}: {e}")
+            return None, 0.0
+        except Exception as e:
+            logging.warning(f"Render cache S3 lookup failed for {key}: {e}")
+            return None, 0.0
+
+    def _put_s3(self, key, data, render_seconds):
+        if not (self.s3_client and self.bucket):
+            return
+        try:
+            self.s3_client.put_object(
+                Bucket=self.bucket,
+                Key=f"{self.prefix}{key}",
+                Body=data,
+                Metadata={'render-seconds': f"{render_seconds:.6f}"}
+            )
+        except Exception as e:
+            logging.warning(f"Render cache S3 write failed for {key}: {e}")
+
+    def get(self, key):
+        """Return cached bytes for key, or None on a miss. Hits are promoted to the local tier."""
+        lookup_start = time.perf_counter()
+        data, render_seconds = self._get_local(key)
+        if data is None:
+            data, render_seconds = self._get_s3(key)
+            if data is not None:
+                self._put_local(key, data, render_seconds)
+
+        with self._lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.time_saved += max(render_seconds - (time.perf_counter() - lookup_start), 0.0)
+        return data
+
+    def put(self, key, data, render_seconds):
+        """Store freshly rendered bytes in both tiers along with how long they took to render."""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._put_local(key, data, render_seconds)
+        self._put_s3(key, data, render_seconds)
+
+    def get_or_render(self, key, render):
+        """Return cached bytes for key, calling render() and caching its result on a miss."""
+        data = self.get(key)
+        if data is not None:
+            return data
+        render_start = time.perf_counter()
+        data = render()
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if data:
+            self.put(key, data, time.perf_counter() - render_start)
+        return data
+
+    def stats(self):
+        """Return hit/miss counters for the current run."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'time_saved_seconds': round(self.time_saved, 3)
+        }
@@ -0,0 +1,99 @@
+def clean_field(value):
+    """Clean a field the way lambda-1 does: clean_string(field).strip()."""
+    return value.strip('"').replace('\\"', '').strip()
+
+
+class UnionFind:
+    """Disjoint sets over hashable keys, with union by size and path halving."""
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def find(self, key):
+        parent = self.parent
+        if key not in parent:
+            parent[key] = key
+            self.size[key] = 1
+            return key
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return a
+
+
+class ReportClusters:
+    """
+    Duplicate/linked report clusters keyed by AER number (report_no).
+
+    The canonical cluster id is the smallest AER number in the cluster, so it does not depend
+    on the order links were read in. Reports without links are their own cluster.
+    """
+
+    def __init__(self, cluster_ids, members):
+        """
+        :param cluster_ids: Dict of AER number -> cluster id, for every linked report
+        :param members: Dict of cluster id -> sorted AER numbers in the cluster
+        """
+        self.cluster_ids = cluster_ids
+        self.members = members
+
+    def cluster_id(self, report_no):
+        return self.cluster_ids.get(report_no, report_no)
+
+    def linked_report_nos(self, report_no):
+        """Every other AER number in report_no's cluster, including indirect links."""
+        return [member for member in self.members.get(self.cluster_id(report_no), []) if member != report_no]
+
+
+def build_report_clusters(report_links_content, reports_content):
+    """
+    Build the link graph of report_links.txt and return its connected components.
+
+    One pass over report_links collects the edges (REPORT_ID -> REPORT_LINK_NO), one pass over
+    reports resolves the REPORT_IDs that have links to their own AER numbers, and the edges
+    are merged with union-find, so the cost is near-linear in the number of rows.
+    """
+    edges = []
+    for line in report_links_content:
+        fields = line.split('$')
+        if len(fields) > 4:
+            report_link_no = clean_field(fields[4])
+            if report_link_no:
+                edges.append((clean_field(fields[1]), report_link_no))
+
+    linked_ids = {report_id for report_id, _ in edges}
+    report_nos = {}
+    for line in reports_content:
+        fields = line.split('$', 2)  # Only REPORT_ID and REPORT_NO are needed
+        if len(fields) > 1:
+            report_id = clean_field(fields[0])
+            if report_id in linked_ids:
+                report_nos[report_id] = clean_field(fields[1])
+
+    sets = UnionFind()
+    for report_id, report_link_no in edges:
+        # A REPORT_ID missing from reports.txt still joins its links together under a placeholder node
+        sets.union(report_nos.get(report_id) or f"id:{report_id}", report_link_no)
+
+    groups = {}
+    for key in sets.parent:
+        if not key.startswith('id:'):
+            groups.setdefault(sets.find(key), []).append(key)
+    cluster_ids, members = {}, {}
+    for group in groups.values():
+        group.sort()
+        members[group[0]] = group
+        for report_no in group:
+            cluster_ids[report_no] = group[0]
+    return ReportClusters(cluster_ids, members)
@@ -0,0 +1,47 @@
+"""Record formatting shared by the HTML (lambda-2) and native PDF (lambda-3) report renderers."""
+
+
+def split_comma_values(value):
+    """Helper function to split comma-separated values and remove placeholders."""
+    placeholders = ["{{health_product_role}}", "{{dosage_form}}", "{{route_of_administration}}",
+                    "{{dose}}", "{{frequency}}", "{{therapy_duration}}", "{{indication}}",
+                    "{{meddra_version}}", "{{reaction_duration}}"]
+    values = [v.strip() for v in value.split(',') if v.strip() not in placeholders]
+    
+
+    return values
+
+
+def format_combined_values(quantity, unit):
+    """Combine quantity and unit into a single string."""
+    return f"{quantity} {unit}" if quantity and unit else ""
+
+
+def format_data(item):
+    """Formats the data and handles comma-separated values."""
+    fields = {
+        'drug_name': split_comma_values(item.get('drug_name', '')),
+        'drug_involvement': split_comma_values(item.get('drug_involvement', '')),
+        'dosage_form': split_comma_values(item.get('dosage_form_eng', '')),
+        'route': split_comma_values(item.get('route_admin', '')),
+        'unit_dose': split_comma_values(item.get('unit_dose_qty', '')),
+        'dose_unit': split_comma_values(item.get('dose_unit_eng', '')),
+        'freq_time': split_comma_values(item.get('freq_time_unit_eng', '')),
+        'therapy_duration': split_comma_values(item.get('therapy_duration', '')),
+        'therapy_unit': split_comma_values(item.get('therapy_duration_unit_eng', '')),
+        'indication': split_comma_values(item.get('indication_eng', '')),
+        'pt_name': split_comma_values(item.get('pt_name_eng', '')),
+        'meddra_version': split_comma_values(item.get('meddra_version', '')),
+        'duration': split_comma_values(item.get('duration', '')),
+        'duration_unit': split_comma_values(item.get('duration_unit_eng', '')),
+    }
+
+    fields['dose'] = [format_combined_values(qty, unit) for qty, unit in zip(fields['unit_dose'], fields['dose_unit'])]
+    fields['therapy_duration'] = [format_combined_values(dur, unit) for dur, unit in
+                                  zip(fields['therapy_duration'], fields['therapy_unit'])]
+    
+   
+    # Ensure that drug names are sorted alphabetically
+    fields['drug_name'] = sorted(fields['drug_name'])
+    fields['pt_name'] = sorted(fields['pt_name'])
+    return fields
@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Report index settings from environment variables
+REPORT_INDEX_PREFIX = os.getenv("REPORT_INDEX_PREFIX", "Input_data/report_index/")
+REPORT_INDEX_SHARDS = int(os.getenv("REPORT_INDEX_SHARDS", "256"))
+# Ranges of one table closer than this are fetched with a single read
+REPORT_INDEX_READ_GAP = int(os.getenv("REPORT_INDEX_READ_GAP", str(64 * 1024)))
+REPORT_INDEX_READ_WORKERS = 8
+
+# Column holding the REPORT_ID in each extract table, keyed like lambda-1's input data
+ID_COLUMNS = {'reports': 0, 'reactions': 1, 'report_links': 1, 'report_drug': 1, 'report_drug_indication': 1}
+REPORT_NO_COLUMN = 1  # In reports.txt
+
+
+def clean_id(value):
+    """Clean an id field the way lambda-1 does: clean_string(field).strip()."""
+    return value.strip('"').replace('\\"', '').strip()
+
+
+def clean_field(raw):
+    return clean_id(raw.decode('utf-8'))
+
+
+def shard_of(key, shards):
+    return zlib.crc32(key.encode('utf-8')) % shards
+
+
+def scan_table(path, id_column, on_row=None):
+    """
+    Yield (report_id, start, end) for the rows of a local extract table, where [start, end) is
+    a byte range. Consecutive rows of the same report are merged into one range.
+
+    :param on_row: Optional callback given (report_id, fields) for every row, e.g. to collect report_no
+    """
+    current, start, end = None, 0, 0
+    offset = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            line_start, offset = offset, offset + len(line)
+            fields = line.rstrip(b'\r\n').split(b'$')
+            if len(fields) <= max(id_column, 1):  # lambda-1 skips rows with fewer than two fields
+                continue
+            report_id = clean_field(fields[id_column])
+            if on_row:
+                on_row(report_id, fields)
+            if report_id == current and line_start == end:
+                end = offset
+                continue
+            if current is not None:
+                yield current, start, end
+            current, start, end = report_id, line_start, offset
+    if current is not None:
+        yield current, start, end
+
+
+def build_report_index(storage, bucket, table_paths, table_keys, prefix=REPORT_INDEX_PREFIX,
+                       shards=REPORT_INDEX_SHARDS, work_dir=None):
+    """
+    Build the report_id -> byte range index of every extract table and write it to storage.
+
+    Rows are first bucketed into one temporary file per shard, so memory stays bounded by
+    the size of a single shard. Each shard is written as
+    {"report_ids": {report_id: {table: [[start, end], ...]}}, "report_nos": {report_no: report_id}},
+    and manifest.json, written last, records the table keys and the shard count.
+
+    :param table_paths: Dict of table name (see ID_COLUMNS) -> local path of the table
+    :param table_keys: Dict of table name -> key of the same table in bucket
+    :return: The manifest
+    """
+    build_start = time.time()
+    with tempfile.TemporaryDirectory(prefix='cvp_index_', dir=work_dir) as shard_dir:
+        shard_files = [open(os.path.join(shard_dir, f"{shard:05d}.tsv"), 'w', encoding='utf-8')
+                       for shard in range(shards)]
+        try:
+            def add_report_no(report_id, fields):
+                report_no = clean_field(fields[REPORT_NO_COLUMN])
+                if report_no:
+                    shard_files[shard_of(report_no, shards)].write(f"N\t{report_no}\t{report_id}\n")
+
+            range_counts = {}
+            for table, path in table_paths.items():
+                on_row = add_report_no if table == 'reports' else None
+                range_counts[table] = 0
+                for report_id, start, end in scan_table(path, ID_COLUMNS[table], on_row):
+                    shard_files[shard_of(report_id, shards)].write(f"I\t{report_id}\t{table}\t{start}\t{end}\n")
+                    range_counts[table] += 1
+        finally:
+            for f in shard_files:
+                f.close()
+
+        report_count = 0
+        for shard in range(shards):
+            report_ids, report_nos = {}, {}
+            with open(os.path.join(shard_dir, f"{shard:05d}.tsv"), encoding='utf-8') as f:
+                for line in f:
+                    kind, key, *values = line.rstrip('\n').split('\t')
+                    if kind == 'N':
+                        report_nos[key] = values[0]
+                    else:
+                        table, start, end = values
+                        report_ids.setdefault(key, {}).setdefault(table, []).append([int(start), int(end)])
+            report_count += len(report_ids)
+            storage.write(bucket, f"{prefix}shards/{shard:05d}.json",
+                          json.dumps({'report_ids': report_ids, 'report_nos': report_nos}, separators=(',', ':')),
+                          'application/json')
+
+    manifest = {
+        'tables': table_keys,
+        'shards': shards,
+        'reports': report_count,
+        'ranges': range_counts,
+        'built_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    }
+    storage.write(bucket, f"{prefix}manifest.json", json.dumps(manifest, indent=4), 'application/json')
+    logging.info(f"Indexed {report_count} reports into {shards} shards in {time.time() - build_start:.2f} seconds.")
+    return manifest
+
+
+def coalesce_ranges(ranges, gap=REPORT_INDEX_READ_GAP):
+    """Merge sorted [start, end) ranges that are at most gap bytes apart into read spans."""
+    spans = []
+    for start, end in sorted(ranges):
+        if spans and start - spans[-1][1] <= gap:
+            spans[-1][1] = max(spans[-1][1], end)
+        else:
+            spans.append([start, end])
+    return spans
+
+
+class ReportIndex:
+    """
+    Looks up single reports in an index written by build_report_index and range-reads their rows.
+
+    Shards are cached once read, so a warm container serves repeat lookups from memory.
+    """
+
+    def __init__(self, storage, bucket, prefix=REPORT_INDEX_PREFIX):
+        self.storage = storage
+        self.bucket = bucket
+        self.prefix = prefix
+        self.manifest = json.loads(storage.read_bytes(bucket, f"{prefix}manifest.json").decode('utf-8'))
+        self._shards = {}
+
+    def _shard(self, key):
+        shard = shard_of(key, self.manifest['shards'])
+        if shard not in self._shards:
+            body = self.storage.read_bytes(self.bucket, f"{self.prefix}shards/{shard:05d}.json")
+            self._shards[shard] = json.loads(body.decode('utf-8'))
+        return self._shards[shard]
+
+    def find_report_id(self, report_no):
+        """Return the REPORT_ID of a report_no, or None if it is not in the extract."""
+        return self._shard(report_no)['report_nos'].get(report_no)
+
+    def ranges(self, report_id):
+        """Return {table: [[start, end], ...]} for report_id, or None if it is not in the extract."""
+        return self._shard(report_id)['report_ids'].get(report_id)
+
+    def read_rows(self, report_id, ranges=None):
+        """
+        Range-read every row of report_id from the extract tables.
+
+        :return: Dict of table name -> list of lines, for every table in the manifest
+        """
+        ranges = ranges if ranges is not None else self.ranges(report_id) or {}
+        reads = [(table, span) for table, table_ranges in ranges.items() for span in coalesce_ranges(table_ranges)]
+        with ThreadPoolExecutor(max_workers=REPORT_INDEX_READ_WORKERS) as executor:
+            bodies = list(executor.map(
+                lambda read: self.storage.read_range(self.bucket, self.manifest['tables'][read[0]], *read[1]), reads))
+
+        rows = {table: [] for table in self.manifest['tables']}
+        for (table, (span_start, span_end)), body in zip(reads, bodies):
+            if len(body) != span_end - span_start:
+                raise ValueError(f"Report index is out of date with {self.manifest['tables'][table]}; rebuild it")
+            for start, end in ranges[table]:
+                if span_start <= start and end <= span_end:
+                    rows[table].extend(body[start - span_start:end - span_start].decode('utf-8').splitlines())
+
+        # A changed table shows up as rows of other reports at the indexed offsets
+        for table, lines in rows.items():
+            if any(clean_id(line.split('$')[ID_COLUMNS[table]]) != report_id for line in lines):
+                raise ValueError(f"Report index is out of date with {self.manifest['tables'][table]}; rebuild it")
+        return rows
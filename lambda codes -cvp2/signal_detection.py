@@ -0,0 +1,136 @@
+import os
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from aggregates import REACTIONS_COLUMNS, match_drug_values, read_table
+
+REPORT_DRUG_COLUMNS = {1: 'report_id', 3: 'drug_value'}
+
+# Signal settings from environment variables
+SIGNAL_MIN_CASES = int(os.getenv("SIGNAL_MIN_CASES", "3"))  # Minimum co-reported cases for a drug/PT pair
+SIGNAL_TOP_N = int(os.getenv("SIGNAL_TOP_N", "50"))  # Ranked signals kept per drug
+Z_95 = 1.959964
+
+
+def incidence_matrix(row_codes, column_codes, shape):
+    """Binary sparse matrix with a 1 wherever a (row, column) pair occurs at least once."""
+    matrix = sparse.csr_matrix((np.ones(len(row_codes), dtype=np.int32), (row_codes, column_codes)), shape=shape)
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    return matrix
+
+
+def build_contingency_counts(drug_names, report_drug_content, reactions_content, fuzzy_names=None):
+    """
+    Count reports per watchlisted drug x preferred term over the whole extract.
+
+    The database is the set of reports with at least one reaction. Reports x PTs and drugs x
+    reports are built as binary sparse matrices, so their product gives the number of reports
+    mentioning both the drug and the PT.
+
+    :param drug_names: The watchlist, lowercase
+    :param report_drug_content: Lines of report_drug.txt
+    :param reactions_content: Lines of reactions.txt
+    :param fuzzy_names: {DRUGNAME value: [watchlist names]} of lambda-1's fuzzy matches, if enabled
+    :return: Tuple of (DataFrame with drug, pt_name_eng, a, drug_reports, pt_reports; total reports)
+    """
+    reactions = read_table(reactions_content, REACTIONS_COLUMNS)
+    reactions = reactions[(reactions['report_id'] != '') & (reactions['pt_name_eng'] != '')]
+    report_codes, report_index = pd.factorize(reactions['report_id'])
+    pt_codes, pt_index = pd.factorize(reactions['pt_name_eng'])
+    reports_by_pt = incidence_matrix(report_codes, pt_codes, (len(report_index), len(pt_index)))
+
+    drugs = read_table(report_drug_content, REPORT_DRUG_COLUMNS)
+    drugs['drug_value'] = drugs['drug_value'].str.lower()
+    drugs = drugs.merge(match_drug_values(drugs['drug_value'], drug_names, fuzzy_names), on='drug_value')
+    drug_report_codes = pd.Index(report_index).get_indexer(drugs['report_id'])
+    in_database = drug_report_codes >= 0  # Reports without reactions are outside the database
+    drug_codes, drug_index = pd.factorize(drugs['drug'][in_database])
+    drugs_by_report = incidence_matrix(drug_codes, drug_report_codes[in_database],
+                                       (len(drug_index), len(report_index)))
+
+    pair_counts = (drugs_by_report @ reports_by_pt).tocoo()
+    drug_reports = np.asarray(drugs_by_report.sum(axis=1)).ravel()
+    pt_reports = np.asarray(reports_by_pt.sum(axis=0)).ravel()
+
+    counts = pd.DataFrame({
+        'drug': np.asarray(drug_index)[pair_counts.row],
+        'pt_name_eng': np.asarray(pt_index)[pair_counts.col],
+        'a': pair_counts.data.astype(np.int64),
+        'drug_reports': drug_reports[pair_counts.row].astype(np.int64),
+        'pt_reports': pt_reports[pair_counts.col].astype(np.int64)
+    })
+    return counts, len(report_index)
+
+
+def disproportionality(counts, total_reports, min_cases=SIGNAL_MIN_CASES):
+    """
+    Add PRR and ROR with 95% confidence intervals and the Yates chi-square to the counts.
+
+    Cells of the 2x2 table: a = drug and PT, b = drug without PT, c = PT without drug,
+    d = neither. A 0.5 continuity correction is applied to pairs with an empty b, c or d cell.
+    A pair is flagged as a signal by the Evans criteria (a >= min_cases, PRR >= 2, chi-square >= 4).
+    """
+    stats = counts[counts['a'] >= min_cases].copy()
+    a = stats['a'].to_numpy(dtype=float)
+    b = stats['drug_reports'].to_numpy(dtype=float) - a
+    c = stats['pt_reports'].to_numpy(dtype=float) - a
+    d = total_reports - a - b - c
+
+    correction = np.where((b == 0) | (c == 0) | (d == 0), 0.5, 0.0)
+    a, b, c, d = a + correction, b + correction, c + correction, d + correction
+
+    prr = (a / (a + b)) / (c / (c + d))
+    prr_se = np.sqrt(1 / a - 1 / (a + b) + 1 / c - 1 / (c + d))
+    ror = (a * d) / (b * c)
+    ror_se = np.sqrt(1 / a + 1 / b + 1 / c + 1 / d)
+    n = a + b + c + d
+    chi_square = n * np.maximum(np.abs(a * d - b * c) - n / 2, 0) ** 2 / ((a + b) * (c + d) * (a + c) * (b + d))
+
+    stats['expected'] = stats['drug_reports'] * stats['pt_reports'] / total_reports
+    stats['prr'] = prr
+    stats['prr_lower'] = np.exp(np.log(prr) - Z_95 * prr_se)
+    stats['prr_upper'] = np.exp(np.log(prr) + Z_95 * prr_se)
+    stats['ror'] = ror
+    stats['ror_lower'] = np.exp(np.log(ror) - Z_95 * ror_se)
+    stats['ror_upper'] = np.exp(np.log(ror) + Z_95 * ror_se)
+    stats['chi_square'] = chi_square
+    stats['signal'] = (stats['prr'] >= 2) & (stats['chi_square'] >= 4)
+    return stats
+
+
+def rank_signals(stats, top_n=SIGNAL_TOP_N):
+    """Keep the top_n pairs per drug, flagged signals first, then by ROR lower bound."""
+    ranked = stats.sort_values(['drug', 'signal', 'ror_lower', 'a', 'pt_name_eng'],
+                               ascending=[True, False, False, False, True])
+    ranked = ranked.groupby('drug').head(top_n).copy()
+    ranked['rank'] = ranked.groupby('drug').cumcount() + 1
+    return ranked.reset_index(drop=True)
+
+
+def compute_signals(drug_names, report_drug_content, reactions_content, top_n=SIGNAL_TOP_N,
+                    min_cases=SIGNAL_MIN_CASES, fuzzy_names=None):
+    """
+    Ranked disproportionality signals for every watchlisted drug against the whole extract.
+
+    :return: Tuple of (ranked DataFrame, total reports in the database)
+    """
+    counts, total_reports = build_contingency_counts(drug_names, report_drug_content, reactions_content,
+                                                     fuzzy_names)
+    return rank_signals(disproportionality(counts, total_reports, min_cases), top_n), total_reports
+
+
+def signals_summary(ranked, total_reports, drug_names=None):
+    """Return {'total_reports': N, 'drugs': {drug: [signal dicts in rank order]}}, optionally for some drugs only."""
+    if drug_names is not None:
+        ranked = ranked[ranked['drug'].isin(list(drug_names))]
+    columns = ['rank', 'pt_name_eng', 'a', 'expected', 'prr', 'prr_lower', 'prr_upper', 'ror', 'ror_lower',
+               'ror_upper', 'chi_square', 'signal']
+    drugs = {}
+    for drug, rows in ranked.groupby('drug', sort=True):
+        records = rows[columns].round(4).to_dict(orient='records')
+        drugs[drug] = [{key: (value.item() if hasattr(value, 'item') else value) for key, value in record.items()}
+                       for record in records]
+    return {'total_reports': int(total_reports), 'drugs': drugs}
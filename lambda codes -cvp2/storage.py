@@ -0,0 +1,222 @@
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+
+# Storage settings from environment variables. 's3' talks to S3 through the lambda's client;
+# 'local' serves s3://bucket/key as STORAGE_ROOT/bucket/key so the pipeline can run on one machine.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "s3")
+STORAGE_ROOT = os.getenv("STORAGE_ROOT", "/tmp/storage")
+LINE_BLOCK_BYTES = 1024 * 1024  # Decoded at a time when iterating the lines of a mapped file
+
+
+class MappedLines:
+    """
+    The lines of a UTF-8 text buffer (usually an mmap), decoded a block at a time as they are iterated.
+
+    Behaves like the list from body.decode('utf-8').splitlines(): it can be iterated any number
+    of times, yields the same lines and len() gives the line count. Blocks end on a newline and
+    only one block is decoded at a time, so the file is never copied into one Python bytes
+    object or held as a list of strings.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self._count = None
+
+    def __iter__(self):
+        buffer = self.buffer
+        view = memoryview(buffer)
+        size = len(buffer)
+        start = 0
+        while start < size:
+            stop = min(start + LINE_BLOCK_BYTES, size)
+            if stop < size:
+                newline = buffer.rfind(b'\n', start, stop)
+                if newline < 0:  # Line longer than a block
+                    newline = buffer.find(b'\n', stop)
+                stop = size if newline < 0 else newline + 1
+            yield from str(view[start:stop], 'utf-8').splitlines()
+            start = stop
+
+    def __len__(self):
+        if self._count is None:
+            self._count = sum(1 for _ in self)
+        return self._count
+
+
+class S3Storage:
+    """Storage backed by S3 through a boto3 client (instrumented by the caller if needed)."""
+
+    def __init__(self, s3_client):
+        self.s3_client = s3_client
+
+    def read_bytes(self, bucket, key):
+        return self.s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+    def read_range(self, bucket, key, start, end):
+        """Return bytes [start, end) of the object."""
+        return self.s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}")['Body'].read()
+
+    def read_lines(self, bucket, key):
+        """Return the object's lines as a list of strings."""
+        return self.read_bytes(bucket, key).decode('utf-8').splitlines()
+
+    def write(self, bucket, key, body, content_type=None):
+        extra = {'ContentType': content_type} if content_type else {}
+        self.s3_client.put_object(Bucket=bucket, Key=key, Body=body, **extra)
+
+    def upload_file(self, filename, bucket, key):
+        self.s3_client.upload_file(Filename=filename, Bucket=bucket, Key=key)
+
+    def list(self, bucket, prefix):
+        """Return [{'Key', 'Size', 'LastModified'}] for every object under prefix."""
+        objects = []
+        for page in self.s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+            objects.extend({'Key': obj['Key'], 'Size': obj['Size'], 'LastModified': obj['LastModified']}
+                           for obj in page.get('Contents', []))
+        return objects
+
+    def exists(self, bucket, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.s3_client.head_object(Bucket=bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def delete(self, bucket, key):
+        self.s3_client.delete_object(Bucket=bucket, Key=key)
+
+    def open_writer(self, bucket, key, content_type=None):
+        """Return a write-only file-like object (write/close/abort) that streams to the key."""
+        from pdf_stream_merge import S3MultipartWriter
+
+        return S3MultipartWriter(self.s3_client, bucket, key, content_type=content_type or 'binary/octet-stream')
+
+    def url(self, bucket, key, expires_in=3600):
+        return self.s3_client.generate_presigned_url(
+            'get_object', Params={'Bucket': bucket, 'Key': key}, ExpiresIn=expires_in)
+
+
+class LocalFileWriter:
+    """Write-only file-like object that appears at its path only when closed."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix='.', suffix='.part', delete=False)
+        self.bytes_written = 0
+
+    def write(self, data):
+        self._file.write(data)
+        self.bytes_written += len(data)
+        return len(data)
+
+    def close(self):
+        self._file.close()
+        os.replace(self._file.name, self.path)
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self._file.name)
+        except OSError as e:
+            logging.error(f"Error removing partial file {self._file.name}: {e}")
+
+
+class LocalStorage:
+    """
+    Storage on the local filesystem: s3://bucket/key lives at <root>/bucket/key.
+
+    read_lines memory-maps the file, so extract tables are paged in by the OS on demand
+    rather than read into Python memory.
+    """
+
+    s3_client = None  # No S3 tier for caches layered on the storage
+
+    def __init__(self, root=STORAGE_ROOT):
+        self.root = root
+
+    def path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def read_bytes(self, bucket, key):
+        with open(self.path(bucket, key), 'rb') as f:
+            return f.read()
+
+    def read_range(self, bucket, key, start, end):
+        """Return bytes [start, end) of the file."""
+        with open(self.path(bucket, key), 'rb') as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def read_lines(self, bucket, key):
+        """Return the file's lines as a MappedLines view of a read-only memory map."""
+        with open(self.path(bucket, key), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return []  # Empty files cannot be mapped
+            return MappedLines(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def write(self, bucket, key, body, content_type=None):
+        writer = self.open_writer(bucket, key)
+        writer.write(body.encode('utf-8') if isinstance(body, str) else body)
+        writer.close()
+
+    def upload_file(self, filename, bucket, key):
+        path = self.path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(filename, path)
+
+    def list(self, bucket, prefix):
+        """Return [{'Key', 'Size', 'LastModified'}] for every file under prefix, sorted by key."""
+        bucket_dir = os.path.join(self.root, bucket)
+        objects = []
+        for directory, _, file_names in os.walk(bucket_dir):
+            for file_name in file_names:
+                if file_name.startswith('.'):
+                    continue  # Files still being written by a LocalFileWriter
+                path = os.path.join(directory, file_name)
+                key = os.path.relpath(path, bucket_dir).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    stat = os.stat(path)
+                    objects.append({'Key': key, 'Size': stat.st_size,
+                                    'LastModified': datetime.fromtimestamp(stat.st_mtime, timezone.utc)})
+        return sorted(objects, key=lambda obj: obj['Key'])
+
+    def exists(self, bucket, key):
+        return os.path.isfile(self.path(bucket, key))
+
+    def delete(self, bucket, key):
+        try:
+            os.remove(self.path(bucket, key))
+        except FileNotFoundError:
+            pass  # Same as deleting a missing S3 key
+
+    def open_writer(self, bucket, key, content_type=None):
+        return LocalFileWriter(self.path(bucket, key))
+
+    def url(self, bucket, key, expires_in=3600):
+        return f"file://{os.path.abspath(self.path(bucket, key))}"
+
+
+def get_storage(s3_client=None):
+    """
+    Return the storage for STORAGE_BACKEND.
+
+    :param s3_client: boto3 S3 client for the 's3' backend; ignored by the local backend
+    """
+    if STORAGE_BACKEND == 'local':
+        return LocalStorage(STORAGE_ROOT)
+    if STORAGE_BACKEND != 's3':
+        raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}; expected 's3' or 'local'")
+    if s3_client is None:
+        from aws_clients import LazyClient
+
+        s3_client = LazyClient('s3')
+    return S3Storage(s3_client)
@@ -1,10 +1,19 @@
-import boto3
 import os
+import re
 import requests
 import zipfile
+from datetime import date
+from aws_clients import LazyClient
+from instrumentation import RunMetrics
+from storage import get_storage
 
-# Initialize S3 client
-s3_client = boto3.client('s3')
+# Stage timings, byte counts and S3 call stats for each run
+metrics = RunMetrics('zip-lambda-cvp-2')
+
+# S3 client, built on first use
+s3_client = LazyClient('s3', on_create=metrics.instrument)
+# S3, or the local filesystem when STORAGE_BACKEND=local (e.g. for on-prem backfills)
+storage = get_storage(s3_client)
 
 # Environment Variables (Set these in Lambda configuration)
 # bucket_name = os.getenv('Bucket_name')
@@ -14,6 +23,10 @@ bucket_name = "cvp-2-bucket"  # for local testing
 report_folder = "Input_data/report_id_database/"  # for local testing
 zip_url = "https://www.canada.ca/content/dam/hc-sc/migration/hc-sc/dhp-mps/alt_formats/zip/medeff/databasdon/extract_extrait.zip"  # for local testing
 
+# Keep every extract in the versioned history (first in full, later ones as deltas) so lambda-1
+# can screen the database as it was on an earlier extract date
+extract_history_enabled = os.getenv("EXTRACT_HISTORY", "true").lower() == "true"
+
 # List of allowed files
 allowed_files = [
     "reports.txt",
@@ -34,6 +47,7 @@ def download_zip_file():
     zip_path = f"./tmp/{zip_name}"  # for local testing
     with open(zip_path, 'wb') as f:
         f.write(response.content)
+    metrics.add('bytes_read', len(response.content))
     print(f"File downloaded successfully: {zip_name}")
     return zip_path
 
@@ -44,6 +58,26 @@ def check_zip_contents(zip_path):
         print(f"Contents of the ZIP file: {zip_contents}")
         return zip_contents
 
+# Function to get the folder the extract tables are in ('' at the ZIP root) and the extract date from
+# its name (e.g. cvponline_extract_20240831/reports.txt -> cvponline_extract_20240831, 2024-08-31).
+# Only the extract history needs the date; without it the date is None when the name has none.
+def get_extract_folder(zip_contents):
+    folders = {os.path.dirname(name) for name in zip_contents if os.path.basename(name) in allowed_files}
+    if len(folders) != 1:
+        raise ValueError(f"Expected the extract tables in one folder of the ZIP file, found {sorted(folders)}")
+    extract_folder = folders.pop()
+    match = re.search(r'(\d{4})(\d{2})(\d{2})$', extract_folder)
+    try:
+        extract_date = date(*map(int, match.groups())).isoformat()
+    except (AttributeError, ValueError):
+        if extract_history_enabled:
+            raise ValueError(f"Cannot read the extract date from the ZIP folder name '{extract_folder}', "
+                             f"which the extract history needs")
+        print(f"Warning: no extract date in the ZIP folder name '{extract_folder}'; not needed without the history.")
+        extract_date = None
+    print(f"Extract folder '{extract_folder}', extract date {extract_date}")
+    return extract_folder, extract_date
+
 # Function to check contents of the extracted files in ./tmp directory
 def check_tmp_contents():
     tmp_files = os.listdir("./tmp")
@@ -53,70 +87,114 @@ def check_tmp_contents():
 # Function to check for new data and extract files
 def check_for_new_data():
     # Download the ZIP file to /tmp directory
-    zip_path = download_zip_file()
+    with metrics.stage('download'):
+        zip_path = download_zip_file()
 
     print("Checking ZIP file contents...")
     zip_contents = check_zip_contents(zip_path)
+    extract_folder, extract_date = get_extract_folder(zip_contents)
 
     print("Extracting the ZIP file...")
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall("./tmp")  # for local testing
+    with metrics.stage('extract', rows_in=len(zip_contents)):
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            zip_ref.extractall("./tmp")  # for local testing
 
     # Check the extracted files in ./tmp
     check_tmp_contents()
 
     # Process and copy allowed files to S3
-    copy_allowed_files()
+    with metrics.stage('upload', rows_in=len(allowed_files)):
+        copy_allowed_files(extract_folder)
 
     # Cleanup unwanted files in the S3 bucket
-    cleanup_s3_bucket()
+    with metrics.stage('cleanup'):
+        cleanup_s3_bucket()
+
+    # Index the tables by report so lambda-1 can range-read single reports
+    with metrics.stage('index', rows_in=len(allowed_files)):
+        build_extract_index(extract_folder)
+
+    # Record the extract as the next version of the extract history
+    if extract_history_enabled:
+        with metrics.stage('history', rows_in=len(allowed_files)):
+            record_extract_history(extract_folder, extract_date)
 
 # Function to copy allowed files to S3
-def copy_allowed_files():
-    subfolder = "cvponline_extract_20240831"  # Subfolder inside tmp where files are located
+def copy_allowed_files(extract_folder):
     for file_name in allowed_files:
-        file_path = f"./tmp/{subfolder}/{file_name}"  # Updated to look inside subfolder
+        file_path = os.path.join("./tmp", extract_folder, file_name)  # Updated to look inside subfolder
 
         if os.path.exists(file_path):
             try:
                 # Upload file to S3 bucket in the report folder
-                s3_client.upload_file(
-                    Filename=file_path,
-                    Bucket=bucket_name,
-                    Key=f"{report_folder}{file_name}"
-                )
+                storage.upload_file(file_path, bucket_name, f"{report_folder}{file_name}")
                 print(f"Copied {file_name} to {report_folder}{file_name} in S3")
             except Exception as e:
                 print(f"Error uploading {file_name} to S3: {e}")
         else:
-            print(f"{file_name} not found in ./tmp/{subfolder}. Skipping.")
+            print(f"{file_name} not found in ./tmp/{extract_folder}. Skipping.")
 
 # Function to cleanup unwanted files in the S3 bucket
 def cleanup_s3_bucket():
     try:
         # List objects in the S3 bucket
-        response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=report_folder)
-
-        # Ensure that the folder exists in the bucket, and process its contents
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                file_key = obj['Key']
-                file_name = os.path.basename(file_key)
-
-                # Only delete .txt files not in the allowed list
-                if file_name.endswith(".txt") and file_name not in allowed_files:
-                    print(f"Deleting {file_key} from S3...")
-                    s3_client.delete_object(Bucket=bucket_name, Key=file_key)
+        for obj in storage.list(bucket_name, report_folder):
+            file_key = obj['Key']
+            file_name = os.path.basename(file_key)
+
+            # Only delete .txt files not in the allowed list
+            if file_name.endswith(".txt") and file_name not in allowed_files:
+                print(f"Deleting {file_key} from S3...")
+                storage.delete(bucket_name, file_key)
         print("Unwanted files deleted from S3 bucket.")
     except Exception as e:
         print(f"Error cleaning up S3 bucket: {e}")
 
+# Function to build the report_id -> byte range index of the uploaded tables
+def build_extract_index(extract_folder):
+    from report_index import build_report_index  # Only needed at this step
+
+    table_paths, table_keys = {}, {}
+    for file_name in allowed_files:
+        file_path = os.path.join("./tmp", extract_folder, file_name)
+        if os.path.exists(file_path):
+            table = file_name[:-len('.txt')]
+            table_paths[table] = file_path
+            table_keys[table] = f"{report_folder}{file_name}"
+
+    try:
+        manifest = build_report_index(storage, bucket_name, table_paths, table_keys, work_dir="./tmp")
+        print(f"Indexed {manifest['reports']} reports from {len(table_paths)} tables.")
+    except Exception as e:
+        print(f"Error building the report index: {e}")
+
+# Function to add the extracted tables to the versioned extract history
+def record_extract_history(extract_folder, extract_date):
+    from extract_history import record_extract  # Only needed at this step
+
+    table_paths = {}
+    for file_name in allowed_files:
+        file_path = os.path.join("./tmp", extract_folder, file_name)
+        if os.path.exists(file_path):
+            table_paths[file_name[:-len('.txt')]] = file_path
+
+    try:
+        entry = record_extract(storage, bucket_name, table_paths, extract_date, work_dir="./tmp")
+        if entry:
+            print(f"Recorded the extract of {entry['extract_date']} as history version {entry['version']}.")
+        else:
+            print("The extract is already in the history.")
+    except Exception as e:
+        print(f"Error recording the extract history: {e}")
+
 # Lambda handler function
 def lambda_handler(event, context):
+    metrics.reset(getattr(context, 'aws_request_id', None))
     check_for_new_data()
     return {
         'statusCode': 200,
-        'body': 'Process completed successfully.'
+        'body': 'Process completed successfully.',
+        'metrics': metrics.emit_summary()
     }
 
 # for local testing
@@ -0,0 +1,31 @@
+"""
+Test setup. The tests load the lambdas and the local AWS stand-ins from benchmarks/, as the
+benchmarks do. The lambdas read their settings from the environment at import time, so tests
+that change settings use fresh_lambdas to get their own imports of the lambda modules.
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent.parent / "benchmarks"
+if str(BENCHMARKS_DIR) not in sys.path:
+    sys.path.insert(0, str(BENCHMARKS_DIR))
+
+from _lambdas import LAMBDA_DIR  # noqa: E402
+
+
+def unload_lambda_modules():
+    """Drop every module imported from the lambda directory, so the next import re-reads the environment."""
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, '__file__', None)
+        if path and Path(path).resolve().parent == LAMBDA_DIR:
+            del sys.modules[name]
+
+
+@pytest.fixture
+def fresh_lambdas():
+    """Import the lambdas afresh in this test (set its environment with monkeypatch before loading them)."""
+    unload_lambda_modules()
+    yield
+    unload_lambda_modules()
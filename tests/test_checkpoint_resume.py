@@ -0,0 +1,91 @@
+"""
+lambda-1 to lambda-3 resume a killed run from their checkpoints with identical output.
+
+Each lambda runs in a child process (as in benchmarks/bench_checkpoint_resume.py), so a kill
+leaves nothing cleaned up and every attempt imports the lambdas with its own environment.
+"""
+import multiprocessing
+import os
+import shutil
+from types import SimpleNamespace
+
+import pytest
+
+from _lambdas import TEMPLATE_PATH, load_lambda
+from bench_checkpoint_resume import (
+    KILLED, OUTPUT_PREFIXES, RUN_ID, FailingLambdaClient, alerted_reports, checkpointed_timestamp, list_keys,
+    run_child, single_output
+)
+from bench_pipeline import OUTPUT_BUCKET, configure_environment, load_extract
+from local_s3 import LocalS3Client
+from synthetic_extract import generate_extract
+
+REPORTS = 2000
+SEGMENT_SIZE = 50
+WATCHLIST_RANKS = [0, 3, 10, 40, 150]
+
+
+@pytest.fixture
+def storage(tmp_path, fresh_lambdas):
+    """Two local storage roots loaded with the same synthetic extract: {run: (work_dir, LocalS3Client)}."""
+    extract_dir = str(tmp_path / 'extract')
+    _, drugs = generate_extract(extract_dir, REPORTS, 7)
+    watchlist = [drugs[rank] for rank in WATCHLIST_RANKS if rank < len(drugs)]
+
+    runs = {}
+    for run in ('uninterrupted', 'resumed'):
+        work_dir = str(tmp_path / run)
+        runs[run] = work_dir, LocalS3Client(os.path.join(work_dir, 's3'))
+        load_extract(runs[run][1], extract_dir, watchlist)
+    return runs
+
+
+def run_lambda_2_without_checkpoints(work_dir):
+    """Run lambda-2 with checkpoints off and a failing email invoke; exit 0 only if it returned 200."""
+    configure_environment(work_dir, 'local')
+    os.environ['CHECKPOINTS'] = 'false'
+    os.environ['INPUT_BUCKET'] = OUTPUT_BUCKET
+    shutil.copyfile(TEMPLATE_PATH, os.path.join(work_dir, 'template.html'))
+    module = load_lambda('lambda-2')
+    module.__file__ = os.path.join(work_dir, 'lambda-2.py')
+    module.lambda_client = FailingLambdaClient()
+    response = module.lambda_handler({'run_id': RUN_ID}, SimpleNamespace(aws_request_id=RUN_ID))
+    os._exit(0 if response['statusCode'] == 200 else 1)
+
+
+def test_killed_run_resumes_with_identical_output(storage):
+    reference_dir, reference_s3 = storage['uninterrupted']
+    resumed_dir, s3 = storage['resumed']
+
+    for name in OUTPUT_PREFIXES:
+        assert run_child(reference_dir, name, None, SEGMENT_SIZE)[0] == 0
+
+        assert run_child(resumed_dir, name, 'kill', SEGMENT_SIZE)[0] == KILLED
+        timestamp = checkpointed_timestamp(s3, name)
+        if name == 'lambda-1':
+            assert run_child(resumed_dir, name, 'kill-after-join', SEGMENT_SIZE)[0] == KILLED
+        elif name == 'lambda-2':
+            # With checkpoints on, a failed email invoke fails the run so that Lambda retries it
+            assert run_child(resumed_dir, name, 'invoke', SEGMENT_SIZE)[0] == 2
+        assert run_child(resumed_dir, name, None, SEGMENT_SIZE)[0] == 0
+
+        _, reference = single_output(reference_s3, name)
+        resumed_key, resumed = single_output(s3, name)
+        assert resumed == reference, f"{name}: resumed output differs from the uninterrupted run"
+        assert timestamp in resumed_key, f"{name}: resumed run did not write to its first attempt's key"
+        assert not list_keys(s3, 'checkpoints/') and not list_keys(reference_s3, 'checkpoints/')
+
+    alerted = alerted_reports(reference_dir)
+    assert alerted and alerted_reports(resumed_dir) == alerted
+
+
+def test_lambda_2_without_checkpoints_completes_when_invoke_fails(storage):
+    work_dir, s3 = storage['uninterrupted']
+    assert run_child(work_dir, 'lambda-1', None, SEGMENT_SIZE)[0] == 0
+
+    process = multiprocessing.Process(target=run_lambda_2_without_checkpoints, args=(work_dir,))
+    process.start()
+    process.join()
+
+    assert process.exitcode == 0
+    assert len(list_keys(s3, OUTPUT_PREFIXES['lambda-2'])) == 1
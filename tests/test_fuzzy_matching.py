@@ -0,0 +1,48 @@
+"""The aggregates and signals count the reports lambda-1 matched through the fuzzy index."""
+from aggregates import match_drugs
+from fuzzy_drug_index import FuzzyDrugIndex
+from signal_detection import build_contingency_counts
+
+REPORT_DRUG = [
+    '"1"$"101"$"1"$"METFORMIN"',
+    '"2"$"102"$"1"$"METFROMIN HCL"',
+    '"3"$"103"$"1"$"ASPIRIN"',
+]
+REACTIONS = [f'"{i}"$"{report_id}"$"x"$"x"$"x"$"Nausea"' for i, report_id in enumerate(['101', '102', '103'])]
+
+
+def fuzzy_names():
+    """{DRUGNAME value: [watchlist names]}, as lambda-1 passes its fuzzy matches on."""
+    index = FuzzyDrugIndex.build(line.split('$')[3].strip('"').lower() for line in REPORT_DRUG)
+    names = {}
+    for drug_value, _ in index.lookup('metformin'):
+        names.setdefault(drug_value, []).append('metformin')
+    return names
+
+
+def test_fuzzy_index_matches_the_misspelling():
+    assert 'metfromin hcl' in fuzzy_names()
+
+
+def test_aggregates_keep_fuzzy_only_reports():
+    report_ids = {line.split('$')[1].strip('"'): [line.split('$')] for line in REPORT_DRUG[:2]}
+
+    exact = match_drugs(report_ids, ['metformin'])
+    fuzzy = match_drugs(report_ids, ['metformin'], fuzzy_names())
+
+    assert sorted(exact['report_id']) == ['101']
+    assert sorted(fuzzy['report_id']) == ['101', '102']
+    assert set(fuzzy['drug']) == {'metformin'}
+
+
+def test_signals_count_fuzzy_only_reports():
+    counts, total_reports = build_contingency_counts(['metformin'], REPORT_DRUG, REACTIONS, fuzzy_names())
+
+    assert total_reports == 3
+    assert counts.loc[counts['drug'] == 'metformin', 'drug_reports'].tolist() == [2]
+
+
+def test_fuzzy_names_outside_the_watchlist_are_ignored():
+    report_ids = {'102': [REPORT_DRUG[1].split('$')]}
+
+    assert match_drugs(report_ids, ['aspirin'], fuzzy_names()).empty
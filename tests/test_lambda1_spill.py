@@ -0,0 +1,50 @@
+"""lambda-1's spill-to-disk join gives the same reports as the in-memory join at any memory budget."""
+import json
+import logging
+
+import pytest
+
+from _lambdas import load_lambda
+from bench_lambda1_spill import OUTPUT_BUCKET, make_tables
+from storage import LocalStorage
+
+REPORTS = 2000
+BUDGETS_KB = [4, 64, 1024]
+
+
+@pytest.fixture(scope='module')
+def tables():
+    return make_tables(REPORTS)
+
+
+@pytest.fixture
+def lambda_1(tmp_path, monkeypatch, caplog):
+    module = load_lambda('lambda-1')
+    monkeypatch.setattr(module, 'storage', LocalStorage(str(tmp_path / 's3')))
+    monkeypatch.setattr(module, 'output_bucket', OUTPUT_BUCKET)
+    monkeypatch.setattr(module, 'spill_dir', str(tmp_path / 'spill'))
+    monkeypatch.setattr(module, 'report_data_memory_budget_mb', 0)
+    caplog.set_level(logging.WARNING)  # The new-report filter logs every report at INFO
+    return module
+
+
+def json_output(lambda_1, reports, output_prefix):
+    lambda_1.generate_json_output(reports, output_prefix, 'test')
+    return lambda_1.storage.read_bytes(OUTPUT_BUCKET, f"{output_prefix}reported_adverse_reaction_test.json")
+
+
+@pytest.mark.parametrize('budget_kb', BUDGETS_KB)
+def test_spilling_join_matches_in_memory(lambda_1, tables, monkeypatch, budget_kb):
+    expected = json.dumps(lambda_1.extract_report_data(*tables))
+
+    monkeypatch.setattr(lambda_1, 'report_data_memory_budget_mb', budget_kb / 1024)
+    assert json.dumps(lambda_1.extract_report_data(*tables)) == expected
+
+
+@pytest.mark.parametrize('budget_kb', BUDGETS_KB)
+def test_streamed_json_output_matches_in_memory(lambda_1, tables, budget_kb):
+    expected = json_output(lambda_1, lambda_1.filter_new_report_data(lambda_1.extract_report_data(*tables), set()),
+                           'in_memory/')
+
+    reports = lambda_1.extract_report_data_spilling(*tables, budget_kb * 1024)
+    assert json_output(lambda_1, lambda_1.iter_new_reports(reports, set()), f"spilling_{budget_kb}/") == expected
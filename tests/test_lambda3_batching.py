@@ -0,0 +1,59 @@
+"""Batched wkhtmltopdf rendering in lambda-3 keeps every page of every report."""
+import json
+import os
+import shutil
+from io import BytesIO
+
+import pytest
+
+from _lambdas import SAMPLE_JSON_PATH, TEMPLATE_PATH, load_lambda
+
+WKHTMLTOPDF_PATH = shutil.which(os.getenv("WKHTMLTOPDF_PATH", "wkhtmltopdf"))
+OPTIONS = {'orientation': 'Landscape', 'page-size': 'A4'}
+REPORTS = 12
+
+pytestmark = pytest.mark.skipif(WKHTMLTOPDF_PATH is None, reason="wkhtmltopdf is not installed")
+
+
+@pytest.fixture(scope='module')
+def html_parts():
+    lambda_2 = load_lambda('lambda-2')
+    template_html = TEMPLATE_PATH.read_text()
+    records = json.loads(SAMPLE_JSON_PATH.read_text())
+    return [lambda_2.render_report_html(records[i % len(records)], template_html) for i in range(REPORTS)]
+
+
+@pytest.fixture(scope='module')
+def config():
+    import pdfkit
+    return pdfkit.configuration(wkhtmltopdf=WKHTMLTOPDF_PATH)
+
+
+def count_pages(pdf_parts):
+    import PyPDF2
+    return sum(len(PyPDF2.PdfReader(BytesIO(part)).pages) for part in pdf_parts)
+
+
+def render_pages(html_parts, config, render_cache=None, batch_size=1):
+    lambda_3 = load_lambda('lambda-3')
+    return count_pages(lambda_3.render_pdf_parts(html_parts, config, OPTIONS, render_cache,
+                                                 batch_size=batch_size, max_workers=2))
+
+
+@pytest.mark.parametrize('batch_size', [2, 5, REPORTS])
+def test_batching_preserves_page_count(html_parts, config, batch_size):
+    assert render_pages(html_parts, config, batch_size=batch_size) == render_pages(html_parts, config)
+
+
+def test_cached_reports_are_reused_in_batched_runs(html_parts, config, tmp_path):
+    from render_cache import RenderCache
+
+    expected_pages = render_pages(html_parts, config)
+
+    # Fill the cache for every other report with single-report renders
+    warm_cache = RenderCache(local_dir=str(tmp_path))
+    render_pages(html_parts[::2], config, warm_cache)
+
+    render_cache = RenderCache(local_dir=str(tmp_path))
+    assert render_pages(html_parts, config, render_cache, batch_size=4) == expected_pages
+    assert render_cache.stats()['hits'] == len(html_parts[::2])
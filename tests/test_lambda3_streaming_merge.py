@@ -0,0 +1,27 @@
+"""lambda-3's streaming PDF merge keeps its memory flat however many reports are merged."""
+import tracemalloc
+
+import PyPDF2
+
+from bench_lambda3_streaming_merge import make_single_page_pdf
+from pdf_stream_merge import StreamingPdfMerger
+
+PARTS = 5000
+MAX_PEAK_MB = 8.0  # The merge holds one part and the page offsets, not the merged document
+
+
+def test_streaming_merge_peak_heap(tmp_path):
+    path = tmp_path / 'merged.pdf'
+    with open(path, 'wb') as output:
+        tracemalloc.start()
+        try:
+            merger = StreamingPdfMerger(output)
+            for index in range(PARTS):
+                merger.append(make_single_page_pdf(index))
+            merger.close()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    assert peak / (1024 * 1024) < MAX_PEAK_MB
+    assert len(PyPDF2.PdfReader(str(path)).pages) == PARTS
@@ -0,0 +1,77 @@
+"""lambda-4 keeps every digest email under the byte budget, by splitting it or by linking a CSV."""
+import csv
+import io
+import json
+
+import pytest
+
+from _lambdas import SAMPLE_JSON_PATH, load_lambda
+from local_s3 import LocalSesClient
+from storage import LocalStorage
+
+BUCKET = 'digest-test'
+FOLDER_PREFIX = 'report_output/'
+ROWS = 2000
+BYTE_BUDGET = 64 * 1024
+
+
+@pytest.fixture
+def records():
+    records = json.loads(SAMPLE_JSON_PATH.read_text())
+    return [records[i % len(records)] for i in range(ROWS)]
+
+
+@pytest.fixture
+def lambda_4(tmp_path, monkeypatch, records):
+    module = load_lambda('lambda-4')
+    storage = LocalStorage(str(tmp_path / 's3'))
+    storage.write(BUCKET, f"{FOLDER_PREFIX}report.json", json.dumps(records).encode('utf-8'), 'application/json')
+    monkeypatch.setattr(module, 'storage', storage)
+    monkeypatch.setattr(module, 'ses_client', LocalSesClient())
+    monkeypatch.setattr(module, 'BUCKET_NAME', BUCKET)
+    monkeypatch.setattr(module, 'FOLDER_PREFIX', FOLDER_PREFIX)
+    monkeypatch.setattr(module, 'EMAIL_BYTE_BUDGET', BYTE_BUDGET)
+    return module
+
+
+def test_split_bodies_keep_every_row_within_the_budget(lambda_4, records):
+    bodies = lambda_4.generate_email_bodies(records, '2024-01-01 00:00:00')
+
+    assert len(bodies) > 1
+    assert all(len(body.encode('utf-8')) <= BYTE_BUDGET for body in bodies)
+    assert sum(body.count('<td>') for body in bodies) == ROWS * 9
+
+
+def test_split_mode_sends_numbered_emails(lambda_4, monkeypatch):
+    monkeypatch.setattr(lambda_4, 'EMAIL_OVERFLOW_MODE', 'split')
+
+    assert lambda_4.lambda_handler({}, None)['statusCode'] == 200
+
+    messages = lambda_4.ses_client.messages
+    assert len(messages) > 1
+    assert all(message['bytes'] <= BYTE_BUDGET for message in messages)
+    assert [message['subject'].rsplit('(', 1)[1] for message in messages] == \
+        [f"{part} of {len(messages)})" for part in range(1, len(messages) + 1)]
+
+
+def test_summary_mode_sends_one_email_linking_a_csv(lambda_4, monkeypatch):
+    monkeypatch.setattr(lambda_4, 'EMAIL_OVERFLOW_MODE', 'summary')
+
+    assert lambda_4.lambda_handler({}, None)['statusCode'] == 200
+
+    messages = lambda_4.ses_client.messages
+    assert len(messages) == 1 and messages[0]['bytes'] <= BYTE_BUDGET
+    [csv_file] = lambda_4.storage.list(BUCKET, lambda_4.DIGEST_CSV_PREFIX)
+    rows = list(csv.reader(io.StringIO(lambda_4.storage.read_bytes(BUCKET, csv_file['Key']).decode('utf-8'))))
+    assert rows[0] == lambda_4.CSV_COLUMNS and len(rows) == ROWS + 1
+
+
+def test_small_digest_is_sent_whole_in_summary_mode(lambda_4, monkeypatch):
+    monkeypatch.setattr(lambda_4, 'EMAIL_OVERFLOW_MODE', 'summary')
+    monkeypatch.setattr(lambda_4, 'EMAIL_BYTE_BUDGET', 64 * 1024 * 1024)
+
+    lambda_4.lambda_handler({}, None)
+
+    [message] = lambda_4.ses_client.messages
+    assert ' of ' not in message['subject']
+    assert not lambda_4.storage.list(BUCKET, lambda_4.DIGEST_CSV_PREFIX)
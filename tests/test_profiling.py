@@ -0,0 +1,45 @@
+"""The on-demand profiling hook costs next to nothing when off and writes complete artifacts when on."""
+import json
+import pstats
+
+import pytest
+
+from _lambdas import load_lambda
+from bench_profiling_overhead import LAMBDAS, Context, handler, per_call_seconds, workload
+
+import profiling  # noqa: E402  (from the lambda directory, which _lambdas puts on sys.path)
+
+CALLS = 50000
+MAX_OVERHEAD_US = 5.0  # The benchmark holds 1 us; leave room for slow or busy test machines
+
+
+@pytest.fixture(autouse=True)
+def profiling_off(monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_ENABLED', False)
+
+
+@pytest.mark.parametrize('name', LAMBDAS)
+def test_handlers_carry_the_hook(name):
+    assert hasattr(load_lambda(name).lambda_handler, '__wrapped__')
+
+
+def test_disabled_overhead_is_near_zero():
+    wrapped = profiling.profiled('test')(handler)
+    event = {'records': 1}
+
+    baseline = min(per_call_seconds(handler, CALLS, event) for _ in range(5))
+    disabled = min(per_call_seconds(wrapped, CALLS, event) for _ in range(5))
+
+    assert (disabled - baseline) * 1e6 < MAX_OVERHEAD_US
+
+
+def test_profiled_event_writes_artifacts(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_OUTPUT', str(tmp_path))
+
+    response = profiling.profiled('test')(workload)({'profile': 'all'}, Context())
+
+    assert response == workload({}, None)
+    artifact_dir = tmp_path / 'test' / Context.aws_request_id
+    summary = json.loads((artifact_dir / 'summary.json').read_text())
+    assert summary['top_cumulative'] and summary['top_allocations']
+    assert pstats.Stats(str(artifact_dir / 'profile.prof')).stats